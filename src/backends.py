@@ -0,0 +1,270 @@
+"""
+Backends sharing one judge
+
+web frontend, rejudge worker, contest backend -> /judge -> one ingest pipeline and scheduler
+
+Every connection to /judge belongs to a backend. With BACKEND_TOKENS set a connection
+authenticates with "Authorization: Bearer <token>" and is the backend its token names.
+Without it every connection is an anonymous backend of its own, so each connection
+gets the results of the challenges it sent, as before there were backends.
+
+A backend owns an outbox (see outbox.py), a slow backend fills its own outbox without
+holding up the others. The results of a backend survive its reconnects and go to its
+newest connection. The hello frame of an anonymous backend carries a random session,
+reconnecting to /judge?session=<session> resumes that backend, its outbox is kept for
+ANONYMOUS_BACKEND_GRACE after its connection closed. Without the session, or once it
+expired, the connection is a new anonymous backend.
+
+The results of a challenge go to the backend that sent it, or to the named backend
+given by "reply_to" in the challenge message; fetch requests always go to the sender,
+it has the resources. A backend that sends {"subscribe": [names]} also gets a copy of
+every result of those named backends, {"subscribe": []} stops that.
+
+Flow control is per backend: a backend with BACKEND_HIGH_WATERMARK challenges in flight
+gets {"task": "backpressure", "saturated": true, "inflight": n}, and "saturated": false
+once it is down to BACKEND_LOW_WATERMARK. It is advisory like the ingest backpressure,
+nothing is rejected.
+"""
+import hmac
+import itertools
+import json
+import secrets
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import tornado.ioloop
+import tornado.websocket
+
+import config
+import utils
+from outbox import Outbox
+
+
+def parse_subscribe(msg: str | bytes) -> list[str] | None:
+    """
+    The names of a {"subscribe": [names]} message, None for anything else.
+    """
+    if not isinstance(msg, str) or len(msg) > 4096 or '"subscribe"' not in msg:
+        return None
+    try:
+        obj = json.loads(msg)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict) or "chal_id" in obj or not isinstance(obj.get("subscribe"), list):
+        return None
+    return [name for name in obj["subscribe"] if isinstance(name, str)]
+
+
+class Backend:
+    def __init__(self, name: str, ioloop: tornado.ioloop.IOLoop, anonymous: bool = False):
+        self.name = name
+        self.ioloop = ioloop
+        self.anonymous = anonymous
+        self.session = secrets.token_hex(16) if anonymous else None
+        self.expiry: object | None = None  # IOLoop timeout of a detached anonymous backend
+        self.outbox = Outbox(ioloop, spill_path=f"{config.OUTBOX_SPILL_PATH}.{name}")
+        self.subscribers: list[Backend] = []
+        self.conn: tornado.websocket.WebSocketHandler | None = None
+        self.connections = 0
+
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.submitted = 0
+        self.saturated = False
+
+    def publish(self, data: str):
+        """
+        Queue an encoded result for this backend and its subscribers, runs on any thread.
+        """
+        self.outbox.append(data)
+        for subscriber in self.subscribers:
+            subscriber.outbox.append(data)
+
+    def write_direct(self, data: str):
+        """
+        Write to the current connection without the outbox, runs on any thread.
+        """
+        self.ioloop.add_callback(self.write_current, data)
+
+    def write_current(self, data: str):
+        conn = self.conn
+        if conn is None or conn.ws_connection is None:
+            return
+        conn.write_message(data)
+
+    def submitted_one(self):
+        """
+        A challenge message arrived, runs on the IOLoop.
+        """
+        with self.lock:
+            self.inflight += 1
+            self.submitted += 1
+            inflight = self.inflight
+            notify = not self.saturated and inflight >= config.BACKEND_HIGH_WATERMARK
+            if notify:
+                self.saturated = True
+        if notify:
+            utils.logger.warning(f"Backend {self.name} saturated, {inflight} challenges in flight")
+            self.write_direct(json.dumps({"task": "backpressure", "saturated": True, "inflight": inflight}))
+
+    def finished_one(self):
+        """
+        The summary of a challenge message was reported, runs on any thread.
+        """
+        with self.lock:
+            self.inflight = max(self.inflight - 1, 0)
+            inflight = self.inflight
+            notify = self.saturated and inflight <= config.BACKEND_LOW_WATERMARK
+            if notify:
+                self.saturated = False
+        if notify:
+            utils.logger.info(f"Backend {self.name} drained, {inflight} challenges in flight")
+            self.write_direct(json.dumps({"task": "backpressure", "saturated": False, "inflight": inflight}))
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.conn is not None,
+            "connections": self.connections,
+            "inflight": self.inflight,
+            "submitted": self.submitted,
+            "saturated": self.saturated,
+            "subscribers": [subscriber.name for subscriber in self.subscribers],
+            "outbox": self.outbox.stats(),
+        }
+
+
+@dataclass(slots=True)
+class Reply:
+    """
+    Reporter of one challenge message, origin sent it and target gets its results.
+    """
+    origin: Backend
+    target: Backend
+    encode: Callable[[dict], str]
+
+    def __call__(self, result: dict):
+        # NOTE: Encode on the calling worker thread, only the write runs on the IOLoop
+        self.deliver(self.encode(result), result.get("task"))
+
+    def deliver(self, data: str, task: str | None):
+        """
+        Route an encoded report, runs on any thread.
+        """
+        if task == "backpressure":
+            # NOTE: Flow control for the connection that sent the message, not replayed
+            self.origin.write_direct(data)
+        elif task == "fetch":
+            self.origin.outbox.append(data)
+        else:
+            self.target.publish(data)
+            if task == "summary":
+                self.origin.finished_one()
+
+
+class BackendRegistry:
+    def __init__(self, ioloop: tornado.ioloop.IOLoop, encode: Callable[[dict], str], tokens: dict[str, str]):
+        self.ioloop = ioloop
+        self.encode = encode
+        self.tokens = tokens
+        # NOTE: Every named backend exists from the start, reply_to a backend that has
+        # not connected yet queues in its outbox
+        self.backends = {name: Backend(name, ioloop) for name in tokens}
+        # NOTE: session -> backend of connections without BACKEND_TOKENS, not reachable by
+        # reply_to or subscribe
+        self.anonymous: dict[str, Backend] = {}
+        self.anonymous_ids = itertools.count(1)
+
+    def authenticate(self, auth: str, session: str | None = None) -> Backend | None:
+        if not self.tokens:
+            backend = self.anonymous.get(session) if session else None
+            if backend is not None:
+                # NOTE: Not expiring during the handshake, attach() cancels this
+                if backend.expiry is not None:
+                    self.ioloop.remove_timeout(backend.expiry)
+                    backend.expiry = self.ioloop.call_later(config.ANONYMOUS_BACKEND_GRACE, self.expire, backend)
+                return backend
+            if session:
+                utils.logger.info("Unknown or expired backend session, starting a new anonymous backend")
+            return Backend(f"anonymous-{next(self.anonymous_ids)}", self.ioloop, anonymous=True)
+        for name, token in self.tokens.items():
+            if hmac.compare_digest(auth.encode(), f"Bearer {token}".encode()):
+                return self.backends[name]
+        return None
+
+    def attach(self, backend: Backend, conn: tornado.websocket.WebSocketHandler):
+        """
+        Make conn the current connection of backend and replay its unacknowledged results.
+        """
+        backend.conn = conn
+        backend.connections += 1
+        if backend.anonymous:
+            self.anonymous[backend.session] = backend
+            if backend.expiry is not None:
+                self.ioloop.remove_timeout(backend.expiry)
+                backend.expiry = None
+        backend.outbox.attach(conn, backend.session)
+
+    def detach(self, backend: Backend, conn: tornado.websocket.WebSocketHandler):
+        backend.outbox.detach(conn)
+        if backend.conn is not conn:
+            # NOTE: Already taken over by a newer connection
+            return
+        backend.conn = None
+        if backend.anonymous:
+            backend.expiry = self.ioloop.call_later(config.ANONYMOUS_BACKEND_GRACE, self.expire, backend)
+
+    def expire(self, backend: Backend):
+        """
+        Drop an anonymous backend that was not resumed in time, its late results with it.
+        """
+        backend.expiry = None
+        if backend.conn is not None:
+            return
+        utils.logger.info(f"Backend {backend.name} expired, {backend.outbox.unsent()} result frames dropped")
+        del self.anonymous[backend.session]
+        backend.outbox.close()
+
+    def all(self) -> list[Backend]:
+        return [*self.backends.values(), *self.anonymous.values()]
+
+    def subscribe(self, backend: Backend, names: list[str]):
+        """
+        Runs on the IOLoop, publish() reads the subscriber lists without the lock, so
+        they are replaced instead of modified.
+        """
+        for other in self.backends.values():
+            subscribed = backend in other.subscribers
+            if other.name in names and other is not backend and not subscribed:
+                other.subscribers = other.subscribers + [backend]
+            elif other.name not in names and subscribed:
+                other.subscribers = [subscriber for subscriber in other.subscribers if subscriber is not backend]
+        unknown = set(names) - self.backends.keys()
+        if unknown:
+            utils.logger.warning(f"Backend {backend.name} subscribed to unknown backends {sorted(unknown)}")
+
+    def reply(self, origin: Backend) -> Reply:
+        return Reply(origin, origin, self.encode)
+
+    def route(self, obj: object, reply: Reply) -> Reply:
+        """
+        The reporter of a parsed challenge message, honoring its reply_to.
+        """
+        name = obj.get("reply_to") if isinstance(obj, dict) else None
+        if name is None:
+            return reply
+        target = self.backends.get(name)
+        if target is None:
+            utils.logger.warning(f"Unknown reply_to {name!r} from backend {reply.origin.name}, replying to the sender")
+            return reply
+        return Reply(reply.origin, target, self.encode)
+
+    def broadcast(self, data: str):
+        for backend in self.all():
+            backend.write_direct(data)
+
+    def unsent(self) -> int:
+        return sum(backend.outbox.unsent() for backend in self.all())
+
+    def stats(self) -> dict:
+        return {backend.name: backend.stats() for backend in self.all()}
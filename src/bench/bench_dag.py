@@ -0,0 +1,195 @@
+"""
+Benchmark build_challenge (context, exec order and DAG construction), scheduling the
+DAG and the summary step at growing testcase counts.
+
+    cd src && python bench/bench_dag.py
+    cd src && python bench/bench_dag.py --save-baseline bench/dag_baseline.json
+    cd src && python bench/bench_dag.py --baseline bench/dag_baseline.json
+
+Fails (exit 1) when the per-testcase cost at the largest size grows more than
+--max-scaling times the cost at 1k testcases, or when a stage is more than
+--max-regression times slower than the saved baseline.
+"""
+import argparse
+import decimal
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import server
+from models import CheckerType, Compiler, Status, SummaryType
+from tasks.summary import SummaryTask
+
+SIZES = [10, 1000, 10000, 50000]
+SUBTASK_CNT = 10
+
+
+def make_problem(root: str, testdata_cnt: int):
+    os.makedirs(os.path.join(root, "testdata"))
+    for i in range(testdata_cnt):
+        for ext in ("in", "out"):
+            with open(os.path.join(root, "testdata", f"{i}.{ext}"), "w"):
+                pass
+    with open(os.path.join(root, "a.cpp"), "w") as f:
+        f.write("int main() {}\n")
+
+
+def make_message(root: str, testdata_cnt: int) -> dict:
+    """
+    Subtasks in the usual shape: subtask k owns a contiguous block of testdata and
+    also includes every block of the subtasks it generalizes, so most testdata
+    belong to several subtasks.
+    """
+    rng = random.Random(testdata_cnt)
+    block = max(1, testdata_cnt // SUBTASK_CNT)
+    subtasks = []
+    for k in range(SUBTASK_CNT):
+        tds = list(range(min(k * block, testdata_cnt), min((k + 1) * block, testdata_cnt)))
+        for prev in range(k):
+            if rng.random() < 0.5:
+                tds += subtasks[prev]["testdatas"][: block // 2]
+        subtasks.append({"id": k, "score": 10, "testdatas": sorted(set(tds)), "dependency_subtasks": []})
+
+    return {
+        "chal_id": testdata_cnt,
+        "pro_id": 1,
+        "acct_id": 1,
+        "res_path": root,
+        "code_path": os.path.join(root, "a.cpp"),
+        "userprog_compiler": Compiler.gcc_cpp_17.value,
+        "checker_type": CheckerType.CMS_TPS_TESTLIB.value,
+        "checker_compiler": Compiler.gcc_cpp_17.value,
+        "summary_type": SummaryType.GROUPMIN.value,
+        "skip_nonac": True,
+        "testdatas": [{"id": i, "input": f"{i}.in", "output": f"{i}.out"} for i in range(testdata_cnt)],
+        "subtasks": subtasks,
+    }
+
+
+def timed(fn):
+    gc.collect()
+    start = time.perf_counter()
+    ret = fn()
+    return time.perf_counter() - start, ret
+
+
+def bench_size(root: str, testdata_cnt: int) -> dict:
+    msg = make_message(root, testdata_cnt)
+    server.get_manifest(root)
+
+    build_time, (chal, tasks) = timed(lambda: server.build_challenge(msg))
+
+    tracemalloc.start()
+    kept = server.build_challenge(msg)
+    dag_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+
+    def schedule():
+        server.register_challenge(chal, tasks, lambda _: 0)
+        summary_task = None
+        while not server.task_queue.empty():
+            task = server.task_queue.get_nowait()
+            if isinstance(task.task, SummaryTask):
+                summary_task = task
+            server.remove_task(task)
+        return summary_task
+
+    schedule_time, summary_task = timed(schedule)
+
+    rng = random.Random(0)
+    for testdata_result in chal.result.testdata_results.values():
+        testdata_result.status = rng.choice((Status.Accepted, Status.Accepted, Status.PartialCorrect))
+        testdata_result.score = decimal.Decimal(rng.randint(0, 1000)) / 1000
+        testdata_result.time = rng.randint(0, 10**9)
+        testdata_result.memory = rng.randint(0, 10**8)
+
+    summary_time, _ = timed(lambda: summary_task.task.run(chal, summary_task))
+
+    encode_time, _ = timed(lambda: json.dumps(chal.result, cls=server.Encoder))
+
+    server.challenge_tracker.challenges.pop(chal.internal_id, None)
+    server.challenge_tracker.remaining_tasks.pop(chal.internal_id, None)
+    return {
+        "testdatas": testdata_cnt,
+        "tasks": len(tasks),
+        "build": build_time,
+        "schedule": schedule_time,
+        "summary": summary_time,
+        "encode": encode_time,
+        "build_memory": dag_memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--max-scaling", type=float, default=3.0)
+    parser.add_argument("--max-regression", type=float, default=1.5)
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline")
+    args = parser.parse_args()
+
+    server.utils.logger.setLevel("WARNING")
+    tmp = tempfile.mkdtemp()
+    config.SANDBOX_ROOT = os.path.join(tmp, "sandbox")
+    os.mkdir(config.SANDBOX_ROOT)
+    results = []
+    try:
+        for size in args.sizes:
+            root = os.path.join(tmp, f"res-{size}")
+            make_problem(root, size)
+            results.append(bench_size(root, size))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    stages = ("build", "schedule", "summary", "encode")
+    print(f"{'testdatas':>10} {'tasks':>7} " + " ".join(f"{s + ' ms':>11}" for s in stages) + f" {'us/td build':>12} {'B/td':>8}")
+    for r in results:
+        print(
+            f"{r['testdatas']:>10} {r['tasks']:>7} "
+            + " ".join(f"{r[s] * 1000:>11.2f}" for s in stages)
+            + f" {r['build'] / r['testdatas'] * 1e6:>12.2f} {r['build_memory'] / r['testdatas']:>8.0f}"
+        )
+
+    failed = False
+    by_size = {r["testdatas"]: r for r in results}
+    largest = max(by_size)
+    if 1000 in by_size and largest > 1000:
+        for stage in stages:
+            small = by_size[1000][stage] / 1000
+            large = by_size[largest][stage] / largest
+            if small > 0 and large / small > args.max_scaling:
+                print(f"FAIL: {stage} per-testcase cost at {largest} is {large / small:.1f}x the cost at 1000")
+                failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["testdatas"]: r for r in json.load(f)}
+        for size, r in by_size.items():
+            if size not in baseline or size < 1000:
+                continue
+            for stage in stages:
+                if r[stage] > baseline[size][stage] * args.max_regression:
+                    print(f"FAIL: {stage} at {size} testdatas took {r[stage] * 1000:.1f}ms, baseline {baseline[size][stage] * 1000:.1f}ms")
+                    failed = True
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Round-trip latency of the interactive problem pipes.
+
+A user program and an interactor exchange --queries ping-pong messages through a
+FIFO pair opened by ChallengeBox.open_fifo_pipe, with the descriptors handed over
+the same way run_sandbox does. The sandbox itself is not involved, this measures
+the IPC path an interactive testcase pays per query.
+
+    cd src && python bench/bench_interactive.py
+    cd src && python bench/bench_interactive.py --queries 100000 --cpus 0 1 --budget 1000
+
+Fails (exit 1) when the queries take longer than --budget ms.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from sandbox.sandbox import ChallengeBox
+
+# NOTE: stdio with explicit flush, like a typical contestant / testlib program
+USER_C = r"""
+#include <stdio.h>
+int main(void) {
+    long long x;
+    while (scanf("%lld", &x) == 1) {
+        printf("%lld\n", x + 1);
+        fflush(stdout);
+    }
+    return 0;
+}
+"""
+
+INTERACTOR_C = r"""
+#include <stdio.h>
+#include <stdlib.h>
+int main(int argc, char **argv) {
+    long long n = atoll(argv[1]), y;
+    for (long long i = 0; i < n; i++) {
+        printf("%lld\n", i);
+        fflush(stdout);
+        if (scanf("%lld", &y) != 1 || y != i + 1) return 1;
+    }
+    return 0;
+}
+"""
+
+USER_PY = """
+import sys
+for line in sys.stdin:
+    sys.stdout.write(f"{int(line) + 1}\\n")
+    sys.stdout.flush()
+"""
+
+INTERACTOR_PY = """
+import sys
+for i in range(int(sys.argv[1])):
+    sys.stdout.write(f"{i}\\n")
+    sys.stdout.flush()
+    if int(sys.stdin.readline()) != i + 1:
+        sys.exit(1)
+"""
+
+
+def build_programs(folder: str, use_python: bool) -> tuple[list[str], list[str]]:
+    cc = shutil.which("cc") or shutil.which("gcc")
+    if cc and not use_python:
+        programs = []
+        for name, source in (("user", USER_C), ("interactor", INTERACTOR_C)):
+            path = os.path.join(folder, name)
+            with open(path + ".c", "w") as f:
+                f.write(source)
+            subprocess.run([cc, "-O2", "-o", path, path + ".c"], check=True)
+            programs.append([path])
+        return programs[0], programs[1]
+
+    programs = []
+    for name, source in (("user", USER_PY), ("interactor", INTERACTOR_PY)):
+        path = os.path.join(folder, name + ".py")
+        with open(path, "w") as f:
+            f.write(source)
+        programs.append([sys.executable, path])
+    return programs[0], programs[1]
+
+
+def spawn(cmd: list[str], stdin_fd: int, stdout_fd: int, cpu: int | None) -> subprocess.Popen:
+    preexec = None
+    if cpu is not None:
+        preexec = lambda: os.sched_setaffinity(0, {cpu})
+    return subprocess.Popen(cmd, stdin=stdin_fd, stdout=stdout_fd, preexec_fn=preexec)
+
+
+def run_once(box: ChallengeBox, user: list[str], interactor: list[str], queries: int, cpus: list[int]) -> float:
+    interactor_in, user_out = box.open_fifo_pipe("to-interactor")
+    user_in, interactor_out = box.open_fifo_pipe("to-user")
+    start = time.perf_counter()
+    try:
+        user_proc = spawn(user, user_in, user_out, cpus[0] if cpus else None)
+        interactor_proc = spawn(interactor + [str(queries)], interactor_in, interactor_out, cpus[-1] if cpus else None)
+    finally:
+        # NOTE: Same as run_sandbox, the judge closes its copies once both are started
+        for fd in (interactor_in, user_out, user_in, interactor_out):
+            os.close(fd)
+    interactor_ret = interactor_proc.wait()
+    user_proc.wait()
+    elapsed = time.perf_counter() - start
+    box.delete_fifo("to-interactor")
+    box.delete_fifo("to-user")
+    if interactor_ret != 0:
+        raise RuntimeError(f"interactor exit code {interactor_ret}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cpus", type=int, nargs="*", default=[], help="pin user / interactor to these CPUs")
+    parser.add_argument("--budget", type=float, default=1000, help="ms allowed for all queries")
+    parser.add_argument("--python", action="store_true", help="use Python programs instead of C")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    config.SANDBOX_ROOT = tmp
+    try:
+        user, interactor = build_programs(tmp, args.python)
+        box = ChallengeBox(tmp, "bench")
+        # NOTE: Process startup is measured with a single query and subtracted
+        startup = min(run_once(box, user, interactor, 1, args.cpus) for _ in range(args.repeat))
+        best = min(run_once(box, user, interactor, args.queries, args.cpus) for _ in range(args.repeat))
+        box.cleanup()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    per_query = (best - startup) / args.queries
+    print(f"queries          {args.queries}")
+    print(f"startup          {startup * 1000:.2f} ms")
+    print(f"total            {best * 1000:.2f} ms")
+    print(f"round trip       {per_query * 1e6:.2f} us")
+    if best * 1000 > args.budget:
+        print(f"FAIL: {args.queries} queries took {best * 1000:.1f}ms, budget {args.budget:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
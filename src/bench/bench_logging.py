@@ -0,0 +1,124 @@
+"""
+Logging overhead per testcase.
+
+Worker threads emit the lines one testcase causes (run_task lines for its execute and
+scoring tasks, the execute and scoring result lines) through:
+
+    sync      a plain StreamHandler with eager f-strings, the former setup
+    queue     the judge logger, lazy arguments, no sampling or rate limit
+    sampled   the judge logger with config.LOG_CATEGORIES sampling at --sample-rate
+    limited   the judge logger with the configured LOG_CATEGORIES rate limits
+
+Output goes to /dev/null. "caller" is the time the worker threads spend logging per
+testcase, "drained" includes the log writer catching up.
+
+    cd src && python bench/bench_logging.py
+    cd src && python bench/bench_logging.py --testcases 20000 --threads 8
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import utils
+from utils import CategoryFilter, log_queue, task_logger, testcase_logger
+
+
+def eager_testcase(logger: logging.Logger, chal_id: int, testdata_id: int):
+    for task_id in (testdata_id * 2, testdata_id * 2 + 1):
+        logger.info(f"Start task {task_id} for challenge {chal_id}")
+        logger.info(f"Running task {task_id} for challenge {chal_id}")
+        logger.info(f"Finish task {task_id} for challenge {chal_id}")
+        logger.info(f"Task {task_id} for challenge {chal_id} finished")
+    logger.info(f"Executing testdata {testdata_id} for chal {chal_id} with cpp")
+    logger.info(f"Testdata {testdata_id} executed normally for chal {chal_id}, time: 12ms, memory: 3400KB")
+    logger.info(f"Testdata {testdata_id} accepted for chal {chal_id}")
+
+
+def lazy_testcase(chal_id: int, testdata_id: int):
+    for task_id in (testdata_id * 2, testdata_id * 2 + 1):
+        utils.set_log_context(chal_id, task_id)
+        task_logger.info("Start task %s for challenge %s", task_id, chal_id)
+        task_logger.info("Running task %s for challenge %s", task_id, chal_id)
+        task_logger.info("Finish task %s for challenge %s", task_id, chal_id)
+        task_logger.info("Task %s for challenge %s finished", task_id, chal_id)
+    testcase_logger.info("Executing testdata %s for chal %s with %s", testdata_id, chal_id, "cpp")
+    testcase_logger.info(
+        "Testdata %s executed normally for chal %s, time: %sms, memory: %sKB", testdata_id, chal_id, 12, 3400
+    )
+    testcase_logger.info("Testdata %s accepted for chal %s", testdata_id, chal_id)
+    utils.clear_log_context()
+
+
+def run_threads(threads: int, testcases: int, emit) -> float:
+    per_thread = testcases // threads
+    barrier = threading.Barrier(threads + 1)
+    spent = [0] * threads
+
+    def worker(idx: int):
+        barrier.wait()
+        start = time.perf_counter()
+        for i in range(per_thread):
+            emit(idx + 1, i)
+        spent[idx] = time.perf_counter() - start
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    for t in workers:
+        t.join()
+    return sum(spent) / (per_thread * threads)
+
+
+def set_filters(sample_rate: float | None, rate_limit: bool):
+    for category, (configured_rate, configured_limit) in config.LOG_CATEGORIES.items():
+        for f in utils.logger.getChild(category).filters:
+            if isinstance(f, CategoryFilter):
+                f.sample_rate = configured_rate if sample_rate is None else sample_rate
+                f.rate_limit = configured_limit if rate_limit else 0
+                f.tokens = float(f.rate_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--testcases", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=config.JUDGE_TASK_MAXCONCURRENT)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    utils.logger.setLevel(logging.INFO)
+    utils.handler.setStream(devnull)
+
+    sync_logger = logging.getLogger("bench-sync")
+    sync_logger.setLevel(logging.INFO)
+    sync_logger.propagate = False
+    sync_handler = logging.StreamHandler(devnull)
+    sync_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    sync_logger.addHandler(sync_handler)
+
+    cases = [
+        ("sync", None, False, lambda chal_id, i: eager_testcase(sync_logger, chal_id, i)),
+        ("queue", 1.0, False, lazy_testcase),
+        ("sampled", args.sample_rate, False, lazy_testcase),
+        ("limited", None, True, lazy_testcase),
+    ]
+    print(f"{args.testcases} testcases, {args.threads} threads, 10 lines per testcase")
+    for name, sample_rate, rate_limit, emit in cases:
+        set_filters(sample_rate, rate_limit)
+        start = time.perf_counter()
+        caller = run_threads(args.threads, args.testcases, emit)
+        while not log_queue.empty():
+            time.sleep(0.001)
+        drained = (time.perf_counter() - start) / args.testcases
+        print(f"{name:8} caller {caller * 1e6:8.2f} us/testcase  drained {drained * 1e6:8.2f} us/testcase")
+
+
+if __name__ == "__main__":
+    main()
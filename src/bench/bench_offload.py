@@ -0,0 +1,133 @@
+"""
+IOLoop latency while task threads run CPU-heavy scoring and summary phases.
+
+Task threads repeatedly run the summary of a --testdatas challenge and read a
+--checker-output byte checker output, while the IOLoop measures how late a 1 ms timer
+fires. Each mode runs for --duration seconds:
+
+    idle      no task threads, the baseline lag
+    inline    the phases on the task threads, the GIL is shared with the IOLoop
+    offload   the phases in the offload pool (utils/offload.py)
+
+    cd src && python bench/bench_offload.py
+    cd src && python bench/bench_offload.py --testdatas 50000 --threads 8 --workers 4
+"""
+import argparse
+import asyncio
+import dataclasses
+import decimal
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from models import Status, SubtaskResult, SummaryType, score_to_fixed
+from tasks.scoring import read_checker_output
+from tasks.summary import SummaryInput, compute_summary
+from utils import offload
+
+SUBTASK_CNT = 10
+INTERVAL = 0.001
+
+
+def make_summary_input(testdata_cnt: int) -> SummaryInput:
+    rng = random.Random(testdata_cnt)
+    block = max(1, testdata_cnt // SUBTASK_CNT)
+    return SummaryInput(
+        summary_type=SummaryType.GROUPMIN,
+        use_testdata_score=True,
+        status=array("B", (rng.choice((Status.Accepted, Status.PartialCorrect)) for _ in range(testdata_cnt))),
+        time=array("q", (rng.randint(0, 10**9) for _ in range(testdata_cnt))),
+        memory=array("q", (rng.randint(0, 10**8) for _ in range(testdata_cnt))),
+        score=array("q", (score_to_fixed(decimal.Decimal(rng.randint(0, 1000)) / 1000) for _ in range(testdata_cnt))),
+        subtasks={
+            k: (decimal.Decimal(10), list(range(k * block, min((k + 1) * block, testdata_cnt))), [])
+            for k in range(SUBTASK_CNT)
+        },
+        subtask_results={},
+        total=(0, 0, decimal.Decimal(), None),
+    )
+
+
+def task_thread(inp: SummaryInput, output_path: str, use_pool: bool, stop: threading.Event, done: list[int], idx: int):
+    inp = dataclasses.replace(inp)
+    while not stop.is_set():
+        inp.subtask_results = {k: SubtaskResult() for k in inp.subtasks}
+        offload.run(compute_summary, inp, offload=use_pool)
+        offload.run(read_checker_output, output_path, None, False, offload=use_pool)
+        done[idx] += 1
+
+
+async def measure_lag(duration: float) -> list[float]:
+    lags = []
+    deadline = time.perf_counter() + duration
+    while (start := time.perf_counter()) < deadline:
+        await asyncio.sleep(INTERVAL)
+        lags.append(time.perf_counter() - start - INTERVAL)
+    return lags
+
+
+def run_mode(mode: str, args: argparse.Namespace, inp: SummaryInput, output_path: str) -> dict:
+    stop = threading.Event()
+    threads_cnt = 0 if mode == "idle" else args.threads
+    done = [0] * threads_cnt
+    threads = [
+        threading.Thread(target=task_thread, args=(inp, output_path, mode == "offload", stop, done, i))
+        for i in range(threads_cnt)
+    ]
+    for t in threads:
+        t.start()
+    lags = asyncio.run(measure_lag(args.duration))
+    stop.set()
+    for t in threads:
+        t.join()
+
+    lags.sort()
+    return {
+        "mode": mode,
+        "p50": lags[len(lags) // 2],
+        "p99": lags[min(int(len(lags) * 0.99), len(lags) - 1)],
+        "max": lags[-1],
+        "phases": sum(done) / args.duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--testdatas", type=int, default=20000)
+    parser.add_argument("--checker-output", type=int, default=4 << 20, help="bytes of checker stdout")
+    parser.add_argument("--threads", type=int, default=config.JUDGE_TASK_MAXCONCURRENT)
+    parser.add_argument("--workers", type=int, default=config.OFFLOAD_WORKERS)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    output_path = os.path.join(tmp, "checker-stdout")
+    with open(output_path, "w") as f:
+        line = "ok " * 20 + "\n"
+        f.write(line * (args.checker_output // len(line)))
+    inp = make_summary_input(args.testdatas)
+
+    config.OFFLOAD_WORKERS = args.workers
+    offload.start()
+    try:
+        results = [run_mode(mode, args, inp, output_path) for mode in ("idle", "inline", "offload")]
+    finally:
+        offload.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"{args.testdatas} testdatas, {args.checker_output} byte checker output, {args.threads} task threads, {args.workers} workers")
+    print(f"{'mode':8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11} {'phases/s':>9}")
+    for r in results:
+        print(f"{r['mode']:8} {r['p50'] * 1e3:>11.3f} {r['p99'] * 1e3:>11.3f} {r['max'] * 1e3:>11.3f} {r['phases']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Differential check of the persistent checker host against per-testcase checkers.
+
+Each checker is compiled twice with the host g++: as a plain checker, and together
+with tools/checker_host.cpp as a checker host. Random (input, answer, output) triples
+are checked by both, the raw outcomes (exit status, stdout, stderr) and the testdata
+results set by ScoringTask.apply_testlib_result must be identical. The sandbox is not
+involved, the host talks to CheckerHostClient over plain pipes.
+
+    cd src && python bench/diff_checker_host.py
+    cd src && python bench/diff_checker_host.py --cases 2000 --seed 1
+
+Fails (exit 1) on the first mismatch.
+"""
+import argparse
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Challenge, CheckerType, Result, SandboxStatus, TestData, TestDataResultTable
+from problem.batch.context import BatchProblemContext
+from tasks.scoring import DEFAULT_CHECKER_PATH, ScoringTask
+from utils import logger
+from utils.checker_host import CHECKER_HOST_SOURCE, TOOLS_PATH, CheckerHostClient, CheckerOutcome
+
+# NOTE: Partial score with quitp, aborts on a negative answer
+POINTS_CHECKER = r"""
+#include "testlib.h"
+
+int main(int argc, char *argv[]) {
+    registerTestlibCmd(argc, argv);
+    int n = inf.readInt();
+    int good = 0;
+    for (int i = 0; i < n; i++) {
+        long long expected = ans.readLong();
+        long long found = ouf.readLong();
+        if (expected < 0 || found < 0) {
+            abort();
+        }
+        good += expected == found;
+    }
+    if (good == n) {
+        quitf(_ok, "%d numbers", n);
+    }
+    if (good == 0) {
+        quitf(_wa, "no number is correct");
+    }
+    quitp(double(good) / n, "%d of %d numbers", good, n);
+}
+"""
+
+# NOTE: CMS style, score on stdout and message on stderr, no testlib
+CMS_CHECKER = r"""
+#include <cstdio>
+
+int main(int argc, char *argv[]) {
+    FILE *in = fopen(argv[1], "r"), *ans = fopen(argv[2], "r"), *out = fopen(argv[3], "r");
+    int n = 0, good = 0;
+    fscanf(in, "%d", &n);
+    for (int i = 0; i < n; i++) {
+        long long expected = 0, found = 0;
+        fscanf(ans, "%lld", &expected);
+        if (fscanf(out, "%lld", &found) != 1) {
+            printf("0\n");
+            fprintf(stderr, "output too short\n");
+            return 0;
+        }
+        good += expected == found;
+    }
+    printf("%.6f\n", n ? double(good) / n : 1.0);
+    fprintf(stderr, "%d of %d numbers\n", good, n);
+    return 0;
+}
+"""
+
+
+def compile_checkers(folder: str, name: str, source: str) -> tuple[str, str]:
+    cxx = shutil.which("g++")
+    if cxx is None:
+        print("SKIP: g++ not found")
+        sys.exit(0)
+
+    src_folder = os.path.join(folder, name)
+    os.mkdir(src_folder)
+    shutil.copy(os.path.join(DEFAULT_CHECKER_PATH, "testlib.h"), src_folder)
+    with open(os.path.join(src_folder, "checker.cpp"), "w") as f:
+        f.write(source)
+    shutil.copy(os.path.join(TOOLS_PATH, "checker_host.cpp"), os.path.join(src_folder, CHECKER_HOST_SOURCE))
+
+    plain = os.path.join(folder, f"{name}-plain")
+    host = os.path.join(folder, f"{name}-host")
+    for target, main_source in ((plain, "checker.cpp"), (host, CHECKER_HOST_SOURCE)):
+        subprocess.run([cxx, "-O2", "-std=c++17", "-o", target, main_source], cwd=src_folder, check=True)
+    return plain, host
+
+
+def random_case(folder: str, idx: int, rng: random.Random, allow_negative: bool) -> list[str]:
+    n = rng.randint(0, 8)
+    expected = [rng.randint(0, 100) for _ in range(n)]
+    found = list(expected)
+    kind = rng.random()
+    if kind < 0.3:
+        for i in rng.sample(range(n), rng.randint(0, n)):
+            found[i] += 1
+    elif kind < 0.4:
+        found = found[:rng.randint(0, n)]
+    elif kind < 0.45 and allow_negative and n:
+        found[rng.randrange(n)] = -1
+
+    paths = []
+    for suffix, content in (("in", [n]), ("ans", expected), ("out", found)):
+        path = os.path.join(folder, f"{idx}.{suffix}")
+        with open(path, "w") as f:
+            f.write(" ".join(map(str, content)) + "\n")
+        paths.append(path)
+    return paths
+
+
+def run_plain(checker: str, args: list[str]) -> CheckerOutcome:
+    proc = subprocess.run([checker] + args, stdin=subprocess.DEVNULL, capture_output=True)
+    if proc.returncode < 0:
+        status = SandboxStatus.Signalled
+        code = -proc.returncode
+        if code in (signal.SIGXCPU, signal.SIGALRM):
+            status = SandboxStatus.TimeLimitExceeded
+    else:
+        code = proc.returncode
+        status = SandboxStatus.Normal if code == 0 else SandboxStatus.NonzeroExitStatus
+    return CheckerOutcome(
+        status=status,
+        exit_status=code,
+        stdout=proc.stdout.decode(errors="replace"),
+        stderr=proc.stderr.decode(errors="replace"),
+    )
+
+
+def interpret(checker_type: CheckerType, outcome: CheckerOutcome) -> tuple:
+    chal = Challenge(chal_id=0, pro_id=0, contest_id=0, acct_id=0, priority=0, code_path="", res_path="")
+    chal.problem_context = BatchProblemContext(checker_type=checker_type)
+    chal.result = Result(chal_id=0, testdata_results=TestDataResultTable([0]))
+    task = ScoringTask(TestData(id=0, inputpath="", outputpath=""))
+    task.apply_testlib_result(chal, outcome.status, outcome.exit_status, outcome.stdout, outcome.stderr)
+    res = chal.result.testdata_results[0]
+    return res.status, res.score, res.message
+
+
+def check(name: str, checker_type: CheckerType, source: str, folder: str, cases: int, rng: random.Random) -> tuple[float, float]:
+    plain, host = compile_checkers(folder, name, source)
+    case_folder = os.path.join(folder, f"{name}-cases")
+    os.mkdir(case_folder)
+    triples = [random_case(case_folder, i, rng, checker_type == CheckerType.STD_TESTLIB) for i in range(cases)]
+
+    start = time.perf_counter()
+    expected = [run_plain(plain, args) for args in triples]
+    plain_time = time.perf_counter() - start
+
+    proc = subprocess.Popen([host, "10", "20"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=case_folder)
+    client = CheckerHostClient(proc.stdin, proc.stdout)
+    start = time.perf_counter()
+    found = [client.check(args) for args in triples]
+    host_time = time.perf_counter() - start
+    client.close()
+    proc.wait()
+
+    for args, a, b in zip(triples, expected, found):
+        if a != b:
+            print(f"FAIL {name}: raw outcome differs for {args}\n  plain: {a}\n  host:  {b}")
+            sys.exit(1)
+        if interpret(checker_type, a) != interpret(checker_type, b):
+            print(f"FAIL {name}: testdata result differs for {args}")
+            sys.exit(1)
+
+    verdicts = sorted({(o.status.name, o.exit_status) for o in found})
+    print(f"{name:8} {cases} cases identical, outcomes {verdicts}")
+    return plain_time, host_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.setLevel("CRITICAL")
+    rng = random.Random(args.seed)
+    with open(os.path.join(DEFAULT_CHECKER_PATH, "rcmp6.cpp")) as f:
+        rcmp6 = f.read()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for name, checker_type, source in (
+            ("rcmp6", CheckerType.STD_TESTLIB, rcmp6),
+            ("points", CheckerType.STD_TESTLIB, POINTS_CHECKER),
+            ("cms", CheckerType.CMS_TPS_TESTLIB, CMS_CHECKER),
+        ):
+            plain_time, host_time = check(name, checker_type, source, tmp, args.cases, rng)
+            print(f"{'':8} per testcase {plain_time / args.cases * 1e3:.3f} ms, host {host_time / args.cases * 1e3:.3f} ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
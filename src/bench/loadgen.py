@@ -0,0 +1,578 @@
+"""
+End-to-end load generator, acts as the backend on /judge.
+
+Writes problem resources and sources under --res-root, sends challenge messages drawn
+from a mix (languages, testdata counts, checker types, skip_nonac, priorities) at a
+fixed rate or as fast as --concurrency allows, and consumes the execute / scoring /
+summary frames. Reports throughput, submission to summary latency percentiles and a
+per-stage breakdown:
+
+    ingest   submission to the first testdata frame (build, queueing, compile)
+    judge    first to last testdata frame
+    summary  last testdata frame to the summary
+
+The judge reads res_path / code_path from disk, so it must share --res-root, unless
+--inline sends the source inline and the resources by content hash, the load generator
+then serves the judge's fetch requests (see utils/cas.py). Run it against a judge
+started separately, or let --spawn start one with the real ("go") or simulated sandbox
+backend:
+
+    cd src && python bench/loadgen.py --spawn simulated --challenges 2000 --concurrency 64
+    cd src && python bench/loadgen.py --url ws://judge:2502/judge --rate 20 --duration 60
+    cd src && python bench/loadgen.py --mix mix.json --json
+    cd src && NTOJ_CAS_ROOT=/tmp/cas python bench/loadgen.py --spawn simulated --inline
+
+--ack acknowledges result frames and drops replayed duplicates (see outbox.py),
+--reconnect-every additionally drops and reopens the connection to exercise the replay,
+as a named backend or, without --token, by resuming its anonymous backend session:
+
+    cd src && NTOJ_BACKEND_TOKENS=loadgen:secret \
+        python bench/loadgen.py --spawn simulated --token secret --ack --reconnect-every 2
+
+A run that gets no summary for --drain-timeout seconds, while it waits for a free
+--concurrency slot or after sending, stops and reports the rest as unfinished.
+
+--eta-every polls the judge for ETA estimates of the unfinished challenges (see
+utils/eta.py) and reports how far the predicted completions were off.
+
+--token authenticates as one of the NTOJ_BACKEND_TOKENS backends (see backends.py), run
+one load generator per backend to load a shared judge from several backends.
+
+A mix file overrides any of the keys of DEFAULT_MIX, weights are relative:
+
+    {"languages": {"gcc_cpp_17": 3, "python3": 1}, "testdatas": {"1": 1, "30": 1},
+     "checkers": {"DIFF": 1}, "skip_nonac": 0.5, "priorities": {"0": 1, "5": 1}}
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tornado.httpclient
+import tornado.websocket
+
+import config
+from models import CheckerType, Compiler, Status
+from utils.cas import pack_chunk
+from utils.manifest import hash_file
+from tasks.scoring import DEFAULT_CHECKER_PATH
+
+DEFAULT_MIX = {
+    "languages": {"gcc_cpp_17": 6, "gcc_c_11": 1, "python3": 2, "java": 1},
+    "testdatas": {"1": 1, "10": 4, "30": 2, "100": 1},
+    "checkers": {"DIFF": 8, "DIFF_STRICT": 1, "STD_TESTLIB": 1},
+    "skip_nonac": 0.3,
+    "priorities": {"0": 4, "1": 1},
+}
+
+# NOTE: Read one integer and print it, every testdata i.in / i.out pair is "i"
+ECHO_PROGRAMS = {
+    Compiler.gcc_c_11: '#include <stdio.h>\nint main(void) { int x; scanf("%d", &x); printf("%d\\n", x); }\n',
+    Compiler.clang_c_11: '#include <stdio.h>\nint main(void) { int x; scanf("%d", &x); printf("%d\\n", x); }\n',
+    Compiler.gcc_cpp_17: "#include <iostream>\nint main() { int x; std::cin >> x; std::cout << x << '\\n'; }\n",
+    Compiler.clang_cpp_17: "#include <iostream>\nint main() { int x; std::cin >> x; std::cout << x << '\\n'; }\n",
+    Compiler.rust: (
+        "use std::io::Read;\nfn main() { let mut s = String::new(); "
+        "std::io::stdin().read_to_string(&mut s).unwrap(); println!(\"{}\", s.trim()); }\n"
+    ),
+    Compiler.python3: "print(int(input()))\n",
+    Compiler.java: (
+        "import java.util.Scanner;\nclass main { public static void main(String[] args) "
+        "{ System.out.println(new Scanner(System.in).nextInt()); } }\n"
+    ),
+}
+SOURCE_EXT = {
+    Compiler.gcc_c_11: ".c",
+    Compiler.clang_c_11: ".c",
+    Compiler.gcc_cpp_17: ".cpp",
+    Compiler.clang_cpp_17: ".cpp",
+    Compiler.rust: ".rs",
+    Compiler.python3: ".py",
+    Compiler.java: ".java",
+}
+TESTDATA_FRAMES = ("execute", "scoring")
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class Mix:
+    def __init__(self, mix: dict, rng: random.Random):
+        self.rng = rng
+        self.languages = self.weighted(mix["languages"], lambda name: Compiler[name])
+        self.testdatas = self.weighted(mix["testdatas"], int)
+        self.checkers = self.weighted(mix["checkers"], lambda name: CheckerType[name])
+        self.priorities = self.weighted(mix["priorities"], int)
+        self.skip_nonac = mix["skip_nonac"]
+        for compiler in self.languages[0]:
+            if compiler not in ECHO_PROGRAMS:
+                raise SystemExit(f"no echo program for {compiler.name}")
+        for checker_type in self.checkers[0]:
+            if checker_type in (CheckerType.IOREDIR, CheckerType.TOJ, CheckerType.CMS_TPS_TESTLIB):
+                raise SystemExit(f"checker {checker_type.name} is not supported by the load generator")
+
+    @staticmethod
+    def weighted(weights: dict, convert) -> tuple[list, list[float]]:
+        return [convert(key) for key in weights], list(weights.values())
+
+    def pick(self, choices: tuple[list, list[float]]):
+        return self.rng.choices(*choices)[0]
+
+    def sample(self) -> tuple[Compiler, int, CheckerType, int, bool]:
+        return (
+            self.pick(self.languages),
+            self.pick(self.testdatas),
+            self.pick(self.checkers),
+            self.pick(self.priorities),
+            self.rng.random() < self.skip_nonac,
+        )
+
+
+def write_resources(root: str, mix: Mix):
+    """
+    One problem folder per (checker type, testdata count), one source per language.
+    """
+    os.makedirs(os.path.join(root, "code"), exist_ok=True)
+    for compiler in mix.languages[0]:
+        with open(os.path.join(root, "code", f"{compiler.name}{SOURCE_EXT[compiler]}"), "w") as f:
+            f.write(ECHO_PROGRAMS[compiler])
+
+    for checker_type in mix.checkers[0]:
+        for cnt in mix.testdatas[0]:
+            folder = os.path.join(root, f"{checker_type.name}-{cnt}")
+            os.makedirs(os.path.join(folder, "testdata"), exist_ok=True)
+            for i in range(cnt):
+                for ext in ("in", "out"):
+                    with open(os.path.join(folder, "testdata", f"{i}.{ext}"), "w") as f:
+                        f.write(f"{i}\n")
+            if checker_type == CheckerType.STD_TESTLIB:
+                os.makedirs(os.path.join(folder, "checker"), exist_ok=True)
+                shutil.copy(os.path.join(DEFAULT_CHECKER_PATH, "testlib.h"), os.path.join(folder, "checker"))
+                shutil.copy(os.path.join(DEFAULT_CHECKER_PATH, "rcmp6.cpp"), os.path.join(folder, "checker", "checker.cpp"))
+
+
+def hash_resources(root: str) -> tuple[dict[str, dict[str, str]], dict[str, str]]:
+    """
+    {problem folder: {relpath: digest}} and {digest: path} for --inline.
+    """
+    problems = {}
+    objects = {}
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        if name == "code" or not os.path.isdir(folder):
+            continue
+        resources = problems[folder] = {}
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                digest = hash_file(path)
+                resources[os.path.relpath(path, folder)] = digest
+                objects[digest] = path
+    return problems, objects
+
+
+def make_message(root: str, chal_id: int, sample: tuple, problems: dict | None = None) -> dict:
+    compiler, cnt, checker_type, priority, skip_nonac = sample
+    res_path = os.path.join(root, f"{checker_type.name}-{cnt}")
+    msg = {
+        "chal_id": chal_id,
+        "pro_id": checker_type.value * 1000 + cnt,
+        "acct_id": 1,
+        "userprog_compiler": compiler.value,
+        "checker_type": checker_type.value,
+        "priority": priority,
+        "skip_nonac": skip_nonac,
+        "testdatas": [{"id": i, "input": f"{i}.in", "output": f"{i}.out"} for i in range(cnt)],
+        # NOTE: Several subtasks, so skip_nonac has something to skip
+        "subtasks": [
+            {"id": sub, "score": 100 // min(cnt, 4), "testdatas": list(range(sub, cnt, min(cnt, 4)))}
+            for sub in range(min(cnt, 4))
+        ],
+    }
+    if problems is not None:
+        msg["code"] = ECHO_PROGRAMS[compiler]
+        msg["resources"] = problems[res_path]
+    else:
+        msg["res_path"] = res_path
+        msg["code_path"] = os.path.join(root, "code", f"{compiler.name}{SOURCE_EXT[compiler]}")
+    if checker_type == CheckerType.STD_TESTLIB:
+        msg["checker_compiler"] = Compiler.gcc_cpp_17.value
+    return msg
+
+
+class Submission:
+    __slots__ = ("lang", "testdatas", "sent_at", "first_frame", "last_frame", "frames", "etas")
+
+    def __init__(self, lang: str, testdatas: int, sent_at: float):
+        self.lang = lang
+        self.testdatas = testdatas
+        self.sent_at = sent_at
+        self.first_frame = 0.0
+        self.last_frame = 0.0
+        self.frames = 0
+        self.etas: list[float] = []  # predicted completions, time.time()
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace, mix: Mix):
+        self.args = args
+        self.mix = mix
+        self.pending: dict[int, Submission] = {}
+        self.slots = asyncio.Semaphore(args.concurrency)
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.finished = asyncio.Event()
+        self.sending = True
+        self.stalled = False
+        self.sent = 0
+        self.done = 0
+        self.latencies: list[float] = []
+        self.stages: dict[str, list[float]] = collections.defaultdict(list)
+        self.lang_latencies: dict[str, list[float]] = collections.defaultdict(list)
+        self.verdicts: collections.Counter = collections.Counter()
+        self.frames: collections.Counter = collections.Counter()
+        self.backpressure = 0
+        self.problems, self.objects = hash_resources(args.res_root) if args.inline else (None, {})
+        self.fetched: collections.Counter = collections.Counter()
+        self.conn = None
+        self.epoch = None
+        self.session = None  # resumes the anonymous backend of a tokenless run
+        self.received_seq = 0  # every frame up to this seq was handled
+        self.acked_seq = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        self.eta_errors: list[float] = []  # actual minus predicted completion, seconds
+
+    async def write(self, msg: str | bytes, binary: bool = False):
+        """
+        Write to the current connection, waiting out a reconnect.
+        """
+        while True:
+            try:
+                return await self.conn.write_message(msg, binary=binary)
+            except tornado.websocket.WebSocketClosedError:
+                await asyncio.sleep(0.01)
+
+    async def wait_slot(self, deadline: float | None) -> bool:
+        """
+        Wait out backpressure and for a free slot, False at the deadline or when nothing
+        finished for --drain-timeout.
+        """
+        timeout = self.args.drain_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        try:
+            async with asyncio.timeout(max(timeout, 0)):
+                await self.resumed.wait()
+                await self.slots.acquire()
+        except TimeoutError:
+            if deadline is None or time.monotonic() < deadline:
+                self.stalled = True
+                print(f"no challenge finished for {self.args.drain_timeout}s, stopped sending", file=sys.stderr)
+            return False
+        return True
+
+    async def send_loop(self, deadline: float | None):
+        interval = 1 / self.args.rate if self.args.rate else 0
+        next_at = time.monotonic()
+        chal_id = self.args.first_chal_id
+        while self.sent < self.args.challenges and (deadline is None or time.monotonic() < deadline):
+            if not await self.wait_slot(deadline):
+                break
+            if interval:
+                next_at += interval
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            sample = self.mix.sample()
+            msg = make_message(self.args.res_root, chal_id, sample, self.problems)
+            self.pending[chal_id] = Submission(sample[0].name, sample[1], time.monotonic())
+            await self.write(json.dumps(msg))
+            self.sent += 1
+            chal_id += 1
+
+        self.sending = False
+        if self.done == self.sent:
+            self.finished.set()
+
+    async def read_loop(self):
+        while True:
+            conn = self.conn
+            await self.read_conn(conn)
+            # NOTE: Closed by reconnect_loop, go on with the new connection
+            if self.conn is conn:
+                break
+        self.finished.set()
+
+    async def connect(self):
+        headers = {"Authorization": f"Bearer {self.args.token}"} if self.args.token else {}
+        url = f"{self.args.url}?session={self.session}" if self.session else self.args.url
+        request = tornado.httpclient.HTTPRequest(url, headers=headers)
+        return await tornado.websocket.websocket_connect(request, max_message_size=1 << 30)
+
+    async def eta_loop(self):
+        while not self.finished.is_set():
+            await asyncio.sleep(self.args.eta_every)
+            if self.pending:
+                await self.write(json.dumps({"task": "eta", "chal_ids": list(self.pending)}))
+
+    async def reconnect_loop(self):
+        while not self.finished.is_set():
+            await asyncio.sleep(self.args.reconnect_every)
+            old = self.conn
+            self.conn = await self.connect()
+            self.reconnects += 1
+            old.close()
+
+    async def read_conn(self, conn):
+        while (data := await conn.read_message()) is not None:
+            now = time.monotonic()
+            frame = json.loads(data)
+            if self.args.ack and "seq" in frame:
+                if frame["seq"] <= self.received_seq:
+                    self.duplicates += 1
+                    continue
+                self.received_seq = frame["seq"]
+                if self.received_seq - self.acked_seq >= 64:
+                    self.acked_seq = self.received_seq
+                    await self.write(json.dumps({"ack": self.acked_seq}))
+            task = frame.get("task")
+            self.frames[task] += 1
+            if task == "hello":
+                self.session = frame.get("session")
+                # NOTE: A new outbox, the judge restarted or the session expired
+                if frame["epoch"] != self.epoch:
+                    self.epoch = frame["epoch"]
+                    self.received_seq = self.acked_seq = frame["acked"]
+                if self.args.ack:
+                    await conn.write_message(json.dumps({"ack": self.acked_seq}))
+                continue
+            if task == "fetch":
+                await self.serve_fetch(frame["digests"])
+                continue
+            if task == "eta":
+                for estimate in frame["estimates"]:
+                    if (sub := self.pending.get(estimate["chal_id"])) is not None:
+                        sub.etas.append(estimate["eta"])
+                continue
+            if task == "backpressure":
+                self.backpressure += frame["saturated"]
+                if frame["saturated"]:
+                    self.resumed.clear()
+                else:
+                    self.resumed.set()
+                continue
+
+            sub = self.pending.get(frame.get("chal_id"))
+            if sub is None:
+                continue
+            if task in TESTDATA_FRAMES:
+                if not sub.first_frame:
+                    sub.first_frame = now
+                sub.last_frame = now
+                sub.frames += 1
+            elif task == "summary":
+                self.complete(frame["chal_id"], sub, frame["result"], now)
+
+    async def serve_fetch(self, digests: list[str]):
+        for digest in digests:
+            with open(self.objects[digest], "rb") as f:
+                data = f.read()
+            self.fetched["objects"] += 1
+            self.fetched["bytes"] += len(data)
+            # NOTE: An empty object is still sent as one empty chunk
+            for offset in range(0, max(len(data), 1), config.CAS_CHUNK_SIZE):
+                chunk = data[offset:offset + config.CAS_CHUNK_SIZE]
+                await self.write(pack_chunk(digest, len(data), offset, chunk), binary=True)
+
+    def complete(self, chal_id: int, sub: Submission, result: dict, now: float):
+        del self.pending[chal_id]
+        finished_at = time.time()
+        self.eta_errors.extend(finished_at - predicted for predicted in sub.etas)
+        latency = now - sub.sent_at
+        self.latencies.append(latency)
+        self.lang_latencies[sub.lang].append(latency)
+        # NOTE: CE / JE summaries come without testdata frames, all of it counts as ingest
+        first = sub.first_frame or now
+        last = sub.last_frame or now
+        self.stages["ingest"].append(first - sub.sent_at)
+        self.stages["judge"].append(last - first)
+        self.stages["summary"].append(now - last)
+        status = result["total_result"]["status"]
+        self.verdicts[Status(status).name if status else "None"] += 1
+        self.done += 1
+        self.slots.release()
+        if not self.sending and self.done == self.sent:
+            self.finished.set()
+
+    async def run(self) -> dict:
+        self.conn = await self.connect()
+        deadline = time.monotonic() + self.args.duration if self.args.duration else None
+        start = time.monotonic()
+        reader = asyncio.ensure_future(self.read_loop())
+        reconnector = asyncio.ensure_future(self.reconnect_loop()) if self.args.reconnect_every else None
+        poller = asyncio.ensure_future(self.eta_loop()) if self.args.eta_every else None
+        await self.send_loop(deadline)
+        try:
+            if not self.stalled:
+                await asyncio.wait_for(self.finished.wait(), self.args.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - start
+        if reconnector:
+            reconnector.cancel()
+        if poller:
+            poller.cancel()
+        self.conn.close()
+        reader.cancel()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        def summary(values: list[float]) -> dict:
+            return {
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "max": max(values, default=0.0),
+            }
+
+        return {
+            "sent": self.sent,
+            "completed": self.done,
+            "unfinished": len(self.pending),
+            "elapsed": elapsed,
+            "throughput": self.done / elapsed if elapsed else 0.0,
+            "latency": summary(self.latencies),
+            "stages": {name: summary(values) for name, values in self.stages.items()},
+            "languages": {lang: summary(values) for lang, values in self.lang_latencies.items()},
+            "verdicts": dict(self.verdicts),
+            "frames": dict(self.frames),
+            "backpressure_events": self.backpressure,
+            "fetched": dict(self.fetched),
+            "reconnects": self.reconnects,
+            "duplicates": self.duplicates,
+            "eta_errors": {
+                "estimates": len(self.eta_errors),
+                "abs": summary([abs(error) for error in self.eta_errors]),
+                "mean": sum(self.eta_errors) / len(self.eta_errors) if self.eta_errors else 0.0,
+            },
+        }
+
+
+def print_report(report: dict):
+    def row(name: str, stats: dict):
+        print(
+            f"  {name:12} p50 {stats['p50'] * 1e3:9.1f} ms  p95 {stats['p95'] * 1e3:9.1f} ms"
+            f"  p99 {stats['p99'] * 1e3:9.1f} ms  max {stats['max'] * 1e3:9.1f} ms"
+        )
+
+    print(
+        f"{report['completed']}/{report['sent']} challenges in {report['elapsed']:.1f}s, "
+        f"{report['throughput']:.1f} challenges/s, {report['unfinished']} unfinished"
+    )
+    print("latency (submission to summary)")
+    row("total", report["latency"])
+    print("stages")
+    for name, stats in report["stages"].items():
+        row(name, stats)
+    print("languages")
+    for name, stats in sorted(report["languages"].items()):
+        row(name, stats)
+    print(f"verdicts {report['verdicts']}")
+    print(f"frames {report['frames']}, backpressure events {report['backpressure_events']}")
+    if report["reconnects"] or report["duplicates"]:
+        print(f"reconnects {report['reconnects']}, replayed duplicates dropped {report['duplicates']}")
+    if report["eta_errors"]["estimates"]:
+        print(f"eta error over {report['eta_errors']['estimates']} estimates, mean {report['eta_errors']['mean'] * 1e3:+.1f} ms (late is positive)")
+        row("abs error", report["eta_errors"]["abs"])
+    if report["fetched"]:
+        print(f"fetched {report['fetched']['objects']} objects, {report['fetched']['bytes']} bytes")
+
+
+def spawn_judge(backend: str, url: str) -> subprocess.Popen:
+    env = dict(os.environ, NTOJ_SANDBOX_BACKEND=backend)
+    proc = subprocess.Popen([sys.executable, "server.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    async def wait_ready():
+        for _ in range(100):
+            try:
+                conn = await tornado.websocket.websocket_connect(url)
+                conn.close()
+                return
+            except tornado.httpclient.HTTPClientError:
+                # NOTE: Up, but wants a backend token
+                return
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise SystemExit(f"judge did not come up on {url}")
+
+    asyncio.run(wait_ready())
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://127.0.0.1:2502/judge")
+    parser.add_argument("--challenges", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=0, help="stop sending after this many seconds")
+    parser.add_argument("--rate", type=float, default=0, help="challenges per second, 0 sends whenever a slot is free")
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum challenges in flight")
+    parser.add_argument("--mix", help="JSON file overriding DEFAULT_MIX")
+    parser.add_argument("--res-root", help="resource folder shared with the judge, a temporary one by default")
+    parser.add_argument("--first-chal-id", type=int, default=1)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--inline", action="store_true", help="send sources inline and resources by content hash")
+    parser.add_argument("--eta-every", type=float, default=0, help="query ETA estimates every this many seconds")
+    parser.add_argument("--token", help="backend token, see NTOJ_BACKEND_TOKENS")
+    parser.add_argument("--ack", action="store_true", help="acknowledge result frames, drop replayed duplicates")
+    parser.add_argument("--reconnect-every", type=float, default=0, help="reconnect every this many seconds")
+    parser.add_argument("--spawn", choices=("go", "simulated"), help="start server.py with this sandbox backend")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    mix_obj = dict(DEFAULT_MIX)
+    if args.mix:
+        with open(args.mix) as f:
+            mix_obj.update(json.load(f))
+    mix = Mix(mix_obj, random.Random(args.seed))
+
+    tmp = None
+    if args.res_root is None:
+        tmp = args.res_root = tempfile.mkdtemp()
+    write_resources(args.res_root, mix)
+
+    judge = spawn_judge(args.spawn, args.url) if args.spawn else None
+    try:
+        report = asyncio.run(LoadGenerator(args, mix).run())
+    finally:
+        if judge:
+            judge.terminate()
+            judge.wait()
+            # NOTE: A terminated judge skips its atexit clean_sandbox
+            shutil.rmtree(config.SANDBOX_ROOT, ignore_errors=True)
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
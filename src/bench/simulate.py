@@ -0,0 +1,296 @@
+"""
+Offline scheduler simulator, replays a trace written by utils/recorder.py.
+
+Every recorded challenge arrives at its recorded time (scaled by --load), becomes ready
+after its recorded build delay, and its DAG is rebuilt from real TaskEntry objects with
+link_task / link_fanout. Ready tasks are dispatched to --concurrency slots by a policy
+on a virtual clock, each task occupies its slot for its recorded setup + run + finish
+time, and TaskEntry.release decides what becomes ready next.
+
+    priority  the judge task queue, TaskEntry ordering (priority, challenge, order)
+    fifo      ready order over all challenges
+    fair      the challenge with the fewest running tasks first, TaskEntry order within it
+
+--compile-slots caps concurrently running compile tasks (a compile lane). Every
+combination of --policy and --concurrency is simulated, the output is throughput and
+arrival to summary latency percentiles per configuration:
+
+    NTOJ_RECORD_TRACE=/tmp/trace.jsonl python server.py
+    cd src && python bench/simulate.py /tmp/trace.jsonl --concurrency 2,4,8 --policy priority,fair
+    cd src && python bench/simulate.py /tmp/trace.jsonl --load 2 --compile-slots 1 --json
+
+Durations do not depend on the schedule in the replay, so verdicts that change with the
+order (skip_nonac skipping testdata after a failure) keep their recorded cost.
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import TaskEntry, TaskType
+from utils.challenge_builder import link_fanout, link_task
+
+POLICIES = ("priority", "fifo", "fair")
+
+
+@dataclass(slots=True)
+class SimTask:
+    """
+    Stands in for the Task of a TaskEntry, only what the scheduler needs.
+    """
+    task_type: TaskType
+    duration: int  # ns
+
+
+@dataclass(slots=True)
+class TraceChallenge:
+    chal_id: int
+    arrival: int  # ns since the first arrival
+    build_delay: int
+    priority: int
+    shape: list[list]
+    durations: dict[int, int] = field(default_factory=dict)
+
+
+def load_trace(path: str) -> list[TraceChallenge]:
+    arrivals: dict[int, int] = {}
+    challenges: dict[int, TraceChallenge] = {}
+    with open(path) as f:
+        for line in f:
+            ev = json.loads(line)
+            kind = ev["ev"]
+            if kind == "chal":
+                # NOTE: Messages are matched to their DAG by chal_id, unparsable ones never get a DAG
+                try:
+                    chal_id = json.loads(ev["msg"])["chal_id"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                arrivals[chal_id] = ev["t"]
+            elif kind == "dag":
+                arrival = arrivals.pop(ev["chal_id"], ev["t"])
+                challenges[ev["chal_id"]] = TraceChallenge(
+                    chal_id=ev["chal_id"],
+                    arrival=arrival,
+                    build_delay=ev["t"] - arrival,
+                    priority=ev["priority"],
+                    shape=ev["tasks"],
+                )
+            elif kind == "task":
+                chal = challenges.get(ev["chal_id"])
+                if chal is not None:
+                    chal.durations[ev["idx"]] = ev["setup"] + ev["run"] + ev["finish"]
+
+    result = sorted(challenges.values(), key=lambda chal: chal.arrival)
+    if result:
+        origin = result[0].arrival
+        for chal in result:
+            chal.arrival -= origin
+    return result
+
+
+class ReadyQueue:
+    def __init__(self, policy: str):
+        self.policy = policy
+        self.seq = itertools.count()
+        self.heap: list = []
+        # NOTE: fair keeps one heap per challenge
+        self.per_chal: dict[int, list[TaskEntry]] = {}
+        self.running: dict[int, int] = {}
+        self.size = 0
+
+    def push(self, entry: TaskEntry):
+        self.size += 1
+        if self.policy == "priority":
+            heapq.heappush(self.heap, entry)
+        elif self.policy == "fifo":
+            heapq.heappush(self.heap, (next(self.seq), entry))
+        else:
+            heapq.heappush(self.per_chal.setdefault(entry.internal_id, []), entry)
+
+    def pop(self, allow) -> TaskEntry | None:
+        """
+        Best ready task for which allow(entry) holds.
+        """
+        if self.policy == "fair":
+            candidates = sorted(
+                (self.running.get(internal_id, 0), heap[0], internal_id)
+                for internal_id, heap in self.per_chal.items()
+            )
+            for _, _, internal_id in candidates:
+                heap = self.per_chal[internal_id]
+                skipped = []
+                while heap and not allow(heap[0]):
+                    skipped.append(heapq.heappop(heap))
+                entry = heapq.heappop(heap) if heap else None
+                for other in skipped:
+                    heapq.heappush(heap, other)
+                if entry is not None:
+                    if not heap:
+                        del self.per_chal[internal_id]
+                    self.size -= 1
+                    return entry
+            return None
+
+        skipped = []
+        entry = None
+        while self.heap:
+            item = heapq.heappop(self.heap)
+            candidate = item if self.policy == "priority" else item[1]
+            if allow(candidate):
+                entry = candidate
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self.heap, item)
+        if entry is not None:
+            self.size -= 1
+        return entry
+
+
+def build_entries(chal: TraceChallenge, internal_id: int) -> list[TaskEntry]:
+    entries = [
+        TaskEntry(SimTask(TaskType(task_type), chal.durations.get(idx, 0)), internal_id, chal.priority, order=order)
+        for idx, (task_type, order, _, _) in enumerate(chal.shape)
+    ]
+    for entry, (_, _, successor, fanout) in zip(entries, chal.shape):
+        if successor >= 0:
+            link_task(entry, entries[successor])
+        if fanout:
+            link_fanout(entry, [entries[idx] for idx in fanout])
+    return entries
+
+
+def simulate(challenges: list[TraceChallenge], policy: str, concurrency: int, compile_slots: int, load: float) -> dict:
+    # NOTE: Events are (time, seq, kind, payload), kind 0 builds a challenge, kind 1 finishes a task
+    events = []
+    seq = itertools.count()
+    for internal_id, chal in enumerate(challenges, 1):
+        ready_at = int(chal.arrival / load) + chal.build_delay
+        heapq.heappush(events, (ready_at, next(seq), 0, internal_id))
+
+    ready = ReadyQueue(policy)
+    remaining: dict[int, int] = {}
+    arrived_at: dict[int, int] = {}
+    latencies = []
+    queue_waits = []
+    enqueued_at: dict[int, int] = {}
+    running = running_compiles = 0
+    busy = 0
+    now = end = 0
+
+    def enqueue(entry: TaskEntry):
+        enqueued_at[entry.task_id] = now
+        ready.push(entry)
+
+    def allow(entry: TaskEntry) -> bool:
+        return not compile_slots or entry.task.task_type != TaskType.COMPILE or running_compiles < compile_slots
+
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == 0:
+            chal = challenges[payload - 1]
+            entries = build_entries(chal, payload)
+            remaining[payload] = len(entries)
+            arrived_at[payload] = int(chal.arrival / load)
+            for entry in entries:
+                if entry.indeg_cnt == 0:
+                    enqueue(entry)
+        else:
+            entry = payload
+            running -= 1
+            ready.running[entry.internal_id] -= 1
+            if entry.task.task_type == TaskType.COMPILE:
+                running_compiles -= 1
+            for next_entry in entry.release():
+                enqueue(next_entry)
+            if entry.task.task_type == TaskType.SUMMARY:
+                latencies.append(now - arrived_at[entry.internal_id])
+            remaining[entry.internal_id] -= 1
+            if remaining[entry.internal_id] == 0:
+                del remaining[entry.internal_id]
+            end = now
+
+        while running < concurrency and ready.size:
+            entry = ready.pop(allow)
+            if entry is None:
+                break
+            running += 1
+            ready.running[entry.internal_id] = ready.running.get(entry.internal_id, 0) + 1
+            if entry.task.task_type == TaskType.COMPILE:
+                running_compiles += 1
+            queue_waits.append(now - enqueued_at.pop(entry.task_id))
+            busy += entry.task.duration
+            heapq.heappush(events, (now + entry.task.duration, next(seq), 1, entry))
+
+    def percentile(values: list[int], p: float) -> float:
+        if not values:
+            return 0.0
+        return values[min(int(len(values) * p), len(values) - 1)] / 10**9
+
+    latencies.sort()
+    queue_waits.sort()
+    elapsed = end / 10**9
+    return {
+        "policy": policy,
+        "concurrency": concurrency,
+        "compile_slots": compile_slots,
+        "load": load,
+        "challenges": len(latencies),
+        "unfinished": len(remaining),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "utilization": busy / (end * concurrency) if end else 0.0,
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] / 10**9 if latencies else 0.0,
+        },
+        "queue_wait_p95": percentile(queue_waits, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace")
+    parser.add_argument("--policy", default="priority", help=f"comma separated, of {', '.join(POLICIES)}")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma separated slot counts")
+    parser.add_argument("--compile-slots", type=int, default=0, help="maximum concurrent compile tasks, 0 is unlimited")
+    parser.add_argument("--load", type=float, default=1.0, help="arrival rate multiplier")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    policies = args.policy.split(",")
+    for policy in policies:
+        if policy not in POLICIES:
+            parser.error(f"unknown policy {policy}")
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+
+    challenges = load_trace(args.trace)
+    results = [
+        simulate(challenges, policy, concurrency, args.compile_slots, args.load)
+        for policy in policies
+        for concurrency in concurrencies
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(challenges)} challenges, load x{args.load}, compile slots {args.compile_slots or 'unlimited'}")
+    print(f"{'policy':9} {'slots':>5} {'chal/s':>8} {'util':>6} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8} {'wait p95':>9}")
+    for r in results:
+        lat = r["latency"]
+        print(
+            f"{r['policy']:9} {r['concurrency']:>5} {r['throughput']:>8.2f} {r['utilization']:>6.1%} "
+            f"{lat['p50']:>8.3f} {lat['p95']:>8.3f} {lat['p99']:>8.3f} {lat['max']:>8.3f} {r['queue_wait_p95']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Soak benchmark for the challenge lifecycle.
+
+Builds challenges through build_challenge and drives their DAG through the real
+scheduler bookkeeping (push_tasks / complete_task) without running sandboxes, and
+checks that RSS stays flat.
+
+    cd src && python bench/soak_challenge_list.py --challenges 100000
+"""
+import argparse
+import gc
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import server
+from models import CheckerType, Compiler, Status
+from tasks.summary import SummaryTask
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def make_problem(root: str, testdata_cnt: int):
+    os.makedirs(os.path.join(root, "testdata"))
+    for i in range(testdata_cnt):
+        for ext in ("in", "out"):
+            with open(os.path.join(root, "testdata", f"{i}.{ext}"), "w") as f:
+                f.write(f"{i}\n")
+    with open(os.path.join(root, "a.cpp"), "w") as f:
+        f.write("int main() {}\n")
+
+
+def make_message(root: str, chal_id: int, testdata_cnt: int) -> dict:
+    return {
+        "chal_id": chal_id,
+        "pro_id": 1,
+        "acct_id": 1,
+        "res_path": root,
+        "code_path": os.path.join(root, "a.cpp"),
+        "userprog_compiler": Compiler.gcc_cpp_17.value,
+        "checker_type": CheckerType.DIFF.value,
+        "testdatas": [{"id": i, "input": f"{i}.in", "output": f"{i}.out"} for i in range(testdata_cnt)],
+        "subtasks": [{"id": 0, "score": 100, "testdatas": list(range(testdata_cnt))}],
+    }
+
+
+def drain():
+    """
+    Pop every ready task and complete it, as task_loop / finish_task_loop would.
+    """
+    while not server.task_queue.empty():
+        task = server.task_queue.get_nowait()
+        chal = server.challenge_list[task.internal_id]
+        if isinstance(task.task, SummaryTask):
+            chal.result.total_result.status = Status.Accepted
+            chal.reporter({"chal_id": chal.chal_id, "task": "summary", "result": chal.result})
+            chal.summary_reported = True
+            chal.box.cleanup()
+        server.complete_task(task)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--challenges", type=int, default=100000)
+    parser.add_argument("--testdatas", type=int, default=10)
+    parser.add_argument("--report-every", type=int, default=10000)
+    parser.add_argument("--max-growth", type=float, default=0.10, help="allowed RSS growth after warm-up")
+    args = parser.parse_args()
+
+    server.utils.logger.setLevel("WARNING")
+    tmp = tempfile.mkdtemp()
+    config.SANDBOX_ROOT = os.path.join(tmp, "sandbox")
+    os.mkdir(config.SANDBOX_ROOT)
+    res_path = os.path.join(tmp, "res")
+    make_problem(res_path, args.testdatas)
+
+    reported = 0
+
+    def reporter(_):
+        nonlocal reported
+        reported += 1
+
+    warm_rss = None
+    start = time.perf_counter()
+    try:
+        for i in range(1, args.challenges + 1):
+            chal, tasks = server.build_challenge(make_message(res_path, i, args.testdatas))
+            server.register_challenge(chal, tasks, reporter)
+            drain()
+            del chal, tasks
+
+            if i % args.report_every == 0:
+                gc.collect()
+                rss = rss_bytes()
+                if warm_rss is None:
+                    warm_rss = rss
+                stats = server.challenge_tracker.stats()
+                print(
+                    f"{i:>8} challenges  rss {rss / 2**20:8.1f} MiB  "
+                    f"live {stats['live_challenges']}  alive objects {stats['alive_challenge_objects']}  "
+                    f"task_list {len(server.task_list)}  {i / (time.perf_counter() - start):.0f} chal/s"
+                )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    gc.collect()
+    final_rss = rss_bytes()
+    stats = server.challenge_tracker.stats()
+    growth = (final_rss - warm_rss) / warm_rss if warm_rss else 0.0
+    print(f"RSS growth after warm-up: {growth * 100:.1f}%, reported frames: {reported}")
+    if stats["live_challenges"] or stats["alive_challenge_objects"] or server.task_list:
+        print("FAIL: challenges or tasks leaked")
+        sys.exit(1)
+    if growth > args.max_growth:
+        print(f"FAIL: RSS grew more than {args.max_growth * 100:.0f}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,163 @@
 import logging
+import os
 
 JUDGE_TASK_MAXCONCURRENT = 4
 LOGGER_LEVEL = logging.INFO
+LOG_FORMAT = "text"  # "text" or "json"
+LOG_QUEUE_SIZE = 65536  # records waiting for the log writer thread, more are dropped
+# NOTE: Per-task / per-testcase log categories (see utils/__init__.py),
+# category -> (sample rate, lines per second, 0 is unlimited)
+LOG_CATEGORIES = {
+    "task": (1.0, 1000),
+    "testcase": (1.0, 1000),
+}
 
 CPUSET = []
 CPU_RATE = 0
+
+SANDBOX_ROOT = "/dev/shm/ntoj-judge-sandbox"
+# NOTE: "go" runs the sandbox binary, "simulated" draws results from the SIM_* settings
+# below without running code, for scheduler load tests (see sandbox/backend.py)
+SANDBOX_BACKEND = os.environ.get("NTOJ_SANDBOX_BACKEND", "go")
+SANDBOX_WORKDIR_POOL_SIZE = JUDGE_TASK_MAXCONCURRENT * 2
+
+# NOTE: Simulated sandbox backend
+SIM_SEED = None
+SIM_TIME_SCALE = 0.01  # wall clock seconds per simulated cpu second
+SIM_STATUS_WEIGHTS = {
+    "Normal": 0.80,
+    "TimeLimitExceeded": 0.08,
+    "MemoryLimitExceeded": 0.04,
+    "NonzeroExitStatus": 0.05,
+    "Signalled": 0.03,
+}
+SIM_TIME_FRACTION = (0.2, 0.8)  # lognormal cpu time, (median fraction of time limit, sigma)
+SIM_MEMORY_FRACTION = (0.1, 0.8)  # lognormal memory, (median fraction of memory limit, sigma)
+SIM_COMPILE_ERROR_RATE = 0.02
+
+# NOTE: Startup overhead calibration (see lang/calibration.py)
+CALIBRATION_ENABLED = True
+CALIBRATION_INTERVAL = 600  # sec, 0 means only calibrate at startup
+CALIBRATION_RUNS = 5
+# Compiler names (e.g. "python3", "java") whose limits are raised by the measured baseline
+CALIBRATION_SCALE_LIMITS: list[str] = []
+
+# NOTE: Problem resource manifest cache (see utils/manifest.py)
+MANIFEST_MAX_AGE = 60  # sec, force a rescan to catch files rewritten in place
+MANIFEST_MAX_ENTRIES = 1000  # res_paths kept, least recently used are dropped
+
+# NOTE: Content-addressed store for challenges with hashed resources instead of res_path
+# (see utils/cas.py), shared by the shards of a host
+CAS_ROOT = os.environ.get("NTOJ_CAS_ROOT", "/var/lib/ntoj-judge/cas")
+CAS_FETCH_TIMEOUT = 300  # sec, for the backend to stream the objects of one fetch report
+CAS_CHUNK_SIZE = 1 << 20  # bytes, chunk size backends are expected to send
+CAS_MAX_BYTES = int(os.environ.get("NTOJ_CAS_MAX_BYTES", 20 << 30))  # bytes of objects before collecting
+CAS_GC_MIN_AGE = 3600  # sec, objects and trees used more recently are never collected
+
+# NOTE: Challenge ingestion pipeline (see ingest.py)
+INGEST_WORKERS = 2
+INGEST_HIGH_WATERMARK = 1000  # report saturated to backend when this many messages are pending
+INGEST_LOW_WATERMARK = 100
+
+# NOTE: Process pool for CPU-heavy Python task phases (see utils/offload.py), summaries of
+# challenges with at least OFFLOAD_SUMMARY_MIN_TESTDATAS testdata and checker outputs of
+# at least OFFLOAD_CHECKER_OUTPUT_MIN_BYTES, smaller ones run inline on the task thread
+OFFLOAD_ENABLED = True
+OFFLOAD_WORKERS = 2
+OFFLOAD_SUMMARY_MIN_TESTDATAS = 200
+OFFLOAD_CHECKER_OUTPUT_MIN_BYTES = 1 << 16
+
+# NOTE: Compare user output through a FIFO while the program runs for the DIFF and
+# DIFF_STRICT checkers, and kill the program on the first mismatch (see utils/stream_checker.py)
+STREAM_CHECKER_ENABLED = True
+
+# NOTE: Wall clock watchdog. Sandboxes without an explicit realtime limit get
+# time_limit * REALTIME_LIMIT_FACTOR + REALTIME_LIMIT_GRACE, and user programs that use
+# no CPU time for IDLE_LIMIT (sleep, blocked read) are stopped as TLE. Interactive and
+# stream checked runs have no idle watchdog, they block on the other side
+REALTIME_LIMIT_FACTOR = 2
+REALTIME_LIMIT_GRACE = 1000  # ms
+IDLE_LIMIT = 1000  # ms, 0 disables the idle watchdog
+
+# NOTE: Sandbox telemetry aggregated per run kind, language and problem (see utils/telemetry.py)
+TELEMETRY_ENABLED = True
+TELEMETRY_MAX_GROUPS = 1000
+
+# NOTE: Queue position and ETA estimates (see utils/eta.py), EWMA of task wall time per
+# (problem, language, task type)
+ETA_ALPHA = 0.2
+ETA_DEFAULT_SECONDS = 1.0  # per task, until a task of its type finished
+ETA_MAX_GROUPS = 10000
+ETA_CACHE_SECONDS = 1.0  # a queue walk answers every query this long
+ETA_QUERY_TIMEOUT = 5  # seconds, for the shards to answer
+
+# NOTE: Task and sandbox trace ring buffer, exported by /debug/trace (see utils/trace.py)
+TRACE_ENABLED = True
+TRACE_BUFFER_SIZE = 65536  # spans
+TRACE_DUMP_DIR = "/tmp"
+
+# NOTE: Scheduler trace, incoming challenges, their task DAGs and task stage durations
+# as JSON lines for bench/simulate.py (see utils/recorder.py), None disables it
+RECORD_TRACE_PATH = os.environ.get("NTOJ_RECORD_TRACE") or None
+
+# NOTE: Admin endpoints (/debug/trace, /debug/profile) require "Authorization: Bearer <ADMIN_TOKEN>",
+# they are disabled while it is unset
+ADMIN_TOKEN = os.environ.get("NTOJ_ADMIN_TOKEN") or None
+PROFILE_DEFAULT_RATE = 100  # Hz
+PROFILE_MAX_RATE = 1000  # Hz
+PROFILE_MAX_SECONDS = 60
+
+# NOTE: Interactive problems, the user program and the interactor wait on each other,
+# so their wall clock limit is this many times the time limit
+INTERACTIVE_REALTIME_LIMIT_FACTOR = 3
+
+# NOTE: Persistent checker host for C++ testlib checkers, used by problems whose message
+# sets "checker_host" (see utils/checker_host.py)
+CHECKER_HOST_ENABLED = True
+CHECKER_HOST_MAX_PROCS = 2  # hosts per challenge
+CHECKER_HOST_REALTIME_LIMIT = 600000  # ms, lifetime of one host sandbox
+
+# NOTE: Backends sharing this judge (see backends.py). NTOJ_BACKEND_TOKENS is
+# "name:token,name:token", a connection to /judge sends "Authorization: Bearer <token>"
+# and is the backend its token names. Unset makes every connection an anonymous backend
+# of its own, resumed by reconnecting to /judge?session=<session of its hello frame>
+# within ANONYMOUS_BACKEND_GRACE
+BACKEND_TOKENS = dict(
+    item.split(":", 1) for item in os.environ.get("NTOJ_BACKEND_TOKENS", "").split(",") if ":" in item
+)
+ANONYMOUS_BACKEND_GRACE = 300  # sec an anonymous backend is kept after its connection closed
+BACKEND_HIGH_WATERMARK = 1000  # challenges in flight before a backend gets backpressure
+BACKEND_LOW_WATERMARK = 200
+
+# NOTE: Result outbox of each backend (see outbox.py), unacknowledged result frames kept
+# for replay to a reconnecting backend, spilled to OUTBOX_SPILL_PATH.<backend name>
+# beyond OUTBOX_MAX_MEMORY
+OUTBOX_MAX_MEMORY = 64 * 1024 * 1024  # bytes
+OUTBOX_MAX_SPILL = 1024 * 1024 * 1024  # bytes, older frames are dropped beyond this
+OUTBOX_SPILL_PATH = os.environ.get("NTOJ_OUTBOX_SPILL", "/var/lib/ntoj-judge/outbox.log")
+
+# NOTE: Sharded mode (see shard.py), SHARD_COUNT > 0 makes server.py a front process that
+# owns /judge and runs that many shard processes, each with its own scheduler, sandbox
+# root and slice of CPUSET. JUDGE_TASK_MAXCONCURRENT is split over the shards the same
+# way, so the host runs as many tasks as configured and a slot keeps its CPU.
+# Shards serve their stats endpoints on SHARD_STATS_PORT + index
+SHARD_COUNT = int(os.environ.get("NTOJ_SHARD_COUNT", "0"))
+SHARD_INDEX = int(os.environ["NTOJ_SHARD_INDEX"]) if "NTOJ_SHARD_INDEX" in os.environ else None
+SHARD_STATS_PORT = 2510
+SHARD_RESPAWN_DELAY = 1  # seconds
+SHARD_STOP_TIMEOUT = 10  # seconds
+if SHARD_COUNT:
+    # NOTE: A shard without CPUs would run unpinned next to pinned ones, one without slots never runs
+    if len(CPUSET) and SHARD_COUNT > len(CPUSET):
+        raise ValueError(f"SHARD_COUNT {SHARD_COUNT} is larger than CPUSET, {len(CPUSET)} CPUs")
+    if SHARD_COUNT > JUDGE_TASK_MAXCONCURRENT:
+        raise ValueError(f"SHARD_COUNT {SHARD_COUNT} is larger than JUDGE_TASK_MAXCONCURRENT {JUDGE_TASK_MAXCONCURRENT}")
+if SHARD_INDEX is not None:
+    SANDBOX_ROOT = f"{SANDBOX_ROOT}-{SHARD_INDEX}"
+    CPUSET = CPUSET[len(CPUSET) * SHARD_INDEX // SHARD_COUNT:len(CPUSET) * (SHARD_INDEX + 1) // SHARD_COUNT]
+    JUDGE_TASK_MAXCONCURRENT = (
+        JUDGE_TASK_MAXCONCURRENT * (SHARD_INDEX + 1) // SHARD_COUNT - JUDGE_TASK_MAXCONCURRENT * SHARD_INDEX // SHARD_COUNT
+    )
+    SANDBOX_WORKDIR_POOL_SIZE = JUDGE_TASK_MAXCONCURRENT * 2
+    if RECORD_TRACE_PATH:
+        RECORD_TRACE_PATH = f"{RECORD_TRACE_PATH}.{SHARD_INDEX}"
@@ -0,0 +1,153 @@
+"""
+Challenge ingestion pipeline
+
+accept (IOLoop) -> parse / validate / build (worker threads) -> push DAG (scheduler)
+
+The IOLoop only enqueues the raw message, so a burst of rejudge messages does not
+block pings and result writes. A message whose resources are still being fetched is
+parked (see utils/cas.py) and queued again once they arrived, a cold problem does not
+hold a worker.
+"""
+import json
+import threading
+from dataclasses import dataclass
+from queue import Queue
+from typing import Callable
+
+import config
+import utils
+from models import Challenge, TaskEntry
+
+
+@dataclass(slots=True)
+class IngestItem:
+    msg: str | bytes
+    reporter: Callable
+    # NOTE: Set when a parked message is queued again
+    obj: object = None
+    resumed: bool = False
+    error: Exception | None = None
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        build: Callable[[dict, Callable], tuple[Challenge, list[TaskEntry]]],
+        on_built: Callable[[Challenge, list[TaskEntry], Callable], None],
+        on_error: Callable[[dict | None, Exception, Callable], None],
+        route: Callable[[object, Callable], Callable] | None = None,
+        prepare: Callable[[object, Callable, Callable[[Exception | None], None]], bool] | None = None,
+        workers: int = config.INGEST_WORKERS,
+        high_watermark: int = config.INGEST_HIGH_WATERMARK,
+        low_watermark: int = config.INGEST_LOW_WATERMARK,
+    ):
+        self.build = build
+        self.on_built = on_built
+        self.on_error = on_error
+        # NOTE: Picks the reporter of a parsed message (see backends.py), the submitting one by default
+        self.route = route
+        # NOTE: Starts fetching what a message needs, False parks it until the callback
+        self.prepare = prepare
+        self.workers = workers
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+
+        self.queue: Queue[IngestItem | None] = Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.saturated = False
+        self.throttled_reporters: list[Callable] = []
+        self.threads: list[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker_loop, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+    def depth(self) -> int:
+        return self.pending
+
+    def submit(self, msg: str | bytes, reporter: Callable) -> int:
+        """
+        Accept a raw challenge message. This is the only part that runs on the IOLoop.
+        """
+        with self.lock:
+            self.pending += 1
+            depth = self.pending
+            notify = False
+            if depth >= self.high_watermark:
+                if reporter not in self.throttled_reporters:
+                    self.throttled_reporters.append(reporter)
+                if not self.saturated:
+                    self.saturated = notify = True
+
+        self.queue.put(IngestItem(msg, reporter))
+        if notify:
+            utils.logger.warning(f"Ingest pipeline saturated, queue depth: {depth}")
+            reporter({"task": "backpressure", "saturated": True, "queue_depth": depth})
+        return depth
+
+    def worker_loop(self):
+        while (item := self.queue.get()) is not None:
+            try:
+                if self.process(item):
+                    # NOTE: Still pending until resume() queues it again
+                    continue
+            except Exception as e:
+                utils.logger.error(f"Ingest worker raised {e!r}")
+            try:
+                self.done()
+            except Exception as e:
+                utils.logger.error(f"Ingest backpressure report raised {e!r}")
+
+    def process(self, item: IngestItem) -> bool:
+        """
+        True when the message was parked.
+        """
+        obj = item.obj
+        reporter = item.reporter
+        try:
+            if item.error is not None:
+                raise item.error
+            if not item.resumed:
+                obj = json.loads(item.msg)
+                if self.route is not None:
+                    reporter = self.route(obj, reporter)
+                if self.prepare is not None:
+                    item.obj, item.reporter = obj, reporter
+                    if not self.prepare(obj, reporter, lambda error: self.resume(item, error)):
+                        return True
+            chal, tasks = self.build(obj, reporter)
+        except Exception as e:
+            self.on_error(obj, e, reporter)
+            return False
+
+        self.on_built(chal, tasks, reporter)
+        return False
+
+    def resume(self, item: IngestItem, error: Exception | None):
+        """
+        Queue a parked message again, runs on the thread that finished its fetch.
+        """
+        item.resumed = True
+        item.error = error
+        self.queue.put(item)
+
+    def done(self):
+        with self.lock:
+            self.pending -= 1
+            depth = self.pending
+            reporters = []
+            if self.saturated and depth <= self.low_watermark:
+                self.saturated = False
+                reporters, self.throttled_reporters = self.throttled_reporters, []
+
+        if reporters:
+            utils.logger.info(f"Ingest pipeline drained, queue depth: {depth}")
+        for reporter in reporters:
+            reporter({"task": "backpressure", "saturated": False, "queue_depth": depth})
@@ -0,0 +1,144 @@
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+
+import config
+from lang.base import langs
+from models import Compiler, SandboxStatus
+from sandbox.backend import get_backend
+from sandbox.sandbox import ChallengeBox, SandboxParams
+from utils import logger
+
+# NOTE: Programs that do nothing, used to measure interpreter / VM startup cost
+EMPTY_PROGRAMS = {
+    Compiler.gcc_c_11: "int main(void) { return 0; }\n",
+    Compiler.clang_c_11: "int main(void) { return 0; }\n",
+    Compiler.gcc_cpp_17: "int main() { return 0; }\n",
+    Compiler.clang_cpp_17: "int main() { return 0; }\n",
+    Compiler.rust: "fn main() {}\n",
+    Compiler.python3: "\n",
+    Compiler.java: "class main { public static void main(String[] args) {} }\n",
+    Compiler.asm_with_libc: ".globl main\nmain:\n\txorl %eax, %eax\n\tret\n",
+    Compiler.asm_with_libstdcpp: ".globl main\nmain:\n\txorl %eax, %eax\n\tret\n",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Baseline:
+    time: int  # ns
+    memory: int  # byte
+    measured_at: float
+
+
+baselines: dict[Compiler, Baseline] = {}
+calibration_thread: threading.Thread | None = None
+
+
+def get_baseline(compiler: Compiler) -> Baseline | None:
+    return baselines.get(compiler)
+
+
+def should_scale_limits(compiler: Compiler) -> bool:
+    return compiler.name in config.CALIBRATION_SCALE_LIMITS
+
+
+def calibrate(compiler: Compiler) -> Baseline | None:
+    """
+    Compile and run an empty program for the compiler through the real sandbox path,
+    and record the median time and memory as the baseline.
+    """
+    lang = langs[compiler]
+    box = ChallengeBox(config.SANDBOX_ROOT, f"calibration-{compiler.value}")
+    box.allocate()
+    try:
+        source_name = f"a{lang.source_ext}"
+        with open(box.gen_filepath(source_name), "w") as f:
+            f.write(EMPTY_PROGRAMS[compiler])
+
+        executable_name = f"a{lang.executable_ext}"
+        res = lang.compile(
+            box=box,
+            copyin=[(box.gen_filepath(source_name), source_name)],
+            sources=[source_name],
+            addition_args=[],
+            executable_name=executable_name,
+        )
+        if res.status != SandboxStatus.Normal or not box.get_file(executable_name):
+            logger.warning(f"Calibration compile failed for {compiler.name}, status: {res.status}")
+            return None
+
+        if compiler != Compiler.java:
+            exec, args = lang.get_execute_command("a")
+        else:
+            exec, args = lang.get_execute_command("a", "main")
+
+        times = []
+        memories = []
+        for _ in range(config.CALIBRATION_RUNS):
+            param = SandboxParams(
+                exe_path=exec,
+                args=args,
+                time_limit=5000,
+                memory_limit=512 << 10,
+                stack_limit=65536,
+                proc_limit=lang.allow_thread_count,
+                stdin="/dev/null",
+                allow_proc=lang.allow_thread_count > 1,
+                allow_mount_proc=lang == langs[Compiler.java],
+            )
+            param.add_copy_in_path(box.gen_filepath(executable_name), "a")
+            res = box.run_sandbox([param])[0]
+            if res.status != SandboxStatus.Normal:
+                logger.warning(f"Calibration run failed for {compiler.name}, status: {res.status}")
+                return None
+
+            times.append(max(res.run_time, res.time))
+            memories.append(res.memory)
+
+        baseline = Baseline(
+            time=int(statistics.median(times)),
+            memory=int(statistics.median(memories)),
+            measured_at=time.time(),
+        )
+        baselines[compiler] = baseline
+        logger.info(f"Calibrated {compiler.name}: time {baseline.time}ns, memory {baseline.memory}B")
+        return baseline
+
+    finally:
+        box.cleanup()
+
+
+def calibrate_all():
+    for compiler in langs:
+        try:
+            calibrate(compiler)
+        except Exception as e:
+            logger.error(f"Calibration for {compiler.name} raised {e!r}")
+
+
+def calibration_loop():
+    while True:
+        calibrate_all()
+        if config.CALIBRATION_INTERVAL <= 0:
+            break
+        time.sleep(config.CALIBRATION_INTERVAL)
+
+
+def init_calibration():
+    global calibration_thread
+    if not config.CALIBRATION_ENABLED or not get_backend().runs_programs:
+        return
+
+    calibration_thread = threading.Thread(target=calibration_loop, daemon=True)
+    calibration_thread.start()
+
+
+def apply_baseline(compiler: Compiler, raw_time: int, raw_memory: int) -> tuple[int, int]:
+    """
+    Returns (net_time, net_memory) after removing the startup baseline of the compiler.
+    """
+    baseline = baselines.get(compiler)
+    if baseline is None:
+        return raw_time, raw_memory
+    return max(0, raw_time - baseline.time), max(0, raw_memory - baseline.memory)
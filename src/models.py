@@ -1,9 +1,14 @@
 import decimal
+import itertools
+from array import array
+from operator import itemgetter
 from abc import ABC, abstractmethod
 from enum import IntEnum
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from types import FunctionType
+from typing import ClassVar
 from sandbox.sandbox import ChallengeBox, SandboxResult
+import config
 
 class SandboxStatus(IntEnum):
     Normal = 1
@@ -38,6 +43,12 @@ SignalErrorMessage = {
     11: "segmentation fault",
 }
 
+# NOTE: SandboxResult.timeout, the program was stopped by the sandbox watchdog
+TimeoutMessage = {
+    "wall": "wall clock time limit exceeded",
+    "idle": "no CPU time used for too long (sleeping or blocked)",
+}
+
 class Compiler(IntEnum):
     gcc_c_11 = 1
     clang_c_11 = 2
@@ -91,23 +102,17 @@ class SummaryType(IntEnum):
     CUSTOM = 3
 
 
-internal_id = 0
-task_id = 0
+# NOTE: Challenges are built on the ingest worker threads, next() on itertools.count is atomic
+internal_ids = itertools.count(1)
+task_ids = itertools.count(1)
 
 
 def next_internal_id() -> int:
-    global internal_id
-    internal_id += 1
-    return internal_id
+    return next(internal_ids)
 
 
 def next_task_id() -> int:
-    global task_id
-    task_id += 1
-    return task_id
-
-def next_challenge_box() -> ChallengeBox:
-    return ChallengeBox("/dev/shm/ntoj-judge-sandbox", internal_id)
+    return next(task_ids)
 
 @dataclass(frozen=True, slots=True)
 class Limits:
@@ -123,6 +128,7 @@ class TestData:
     outputpath: str
     useroutput_path: str | None = None
     subtasks: set[int] = field(default_factory=set)
+    stream_checked: bool = False  # output already compared while executing, see utils/stream_checker.py
 
 
 @dataclass(slots=True)
@@ -131,11 +137,227 @@ class TestDataResult:
     score: decimal.Decimal = decimal.Decimal()
     time: int = 0
     memory: int = 0
+    net_time: int = 0  # time with the language startup baseline removed
+    net_memory: int = 0  # memory with the language startup baseline removed
     message: str = ""
     message_type: MessageType = MessageType.NONE
     status: Status | None = None
 
 
+# NOTE: Testdata scores are stored as fixed-point integers with 9 decimal places, scores
+# with more decimal places (testlib points like 1/3) are also kept exactly
+SCORE_SCALE = 10**9
+_STATUS_BY_VALUE: dict[int, Status] = {status.value: status for status in Status}
+_MESSAGE_TYPE_BY_VALUE: dict[int, MessageType] = {t.value: t for t in MessageType}
+
+
+def split_score(score) -> tuple[int, decimal.Decimal | None]:
+    """
+    The fixed-point score, and the exact one when the fixed-point score is rounded.
+    """
+    if not isinstance(score, decimal.Decimal):
+        score = decimal.Decimal(score)
+    scaled = score * SCORE_SCALE
+    fixed = int(scaled.to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+    return fixed, None if scaled == fixed else score
+
+
+def score_to_fixed(score) -> int:
+    return split_score(score)[0]
+
+
+def fixed_to_score(value: int) -> decimal.Decimal:
+    q, r = divmod(value, SCORE_SCALE)
+    if r == 0:
+        return decimal.Decimal(q)
+    return decimal.Decimal(value).scaleb(-9).normalize()
+
+
+def gather(column, idxs: list[int]) -> tuple:
+    """
+    Collect column[i] for every i in idxs with a single C-level call.
+    """
+    if not idxs:
+        return ()
+    if len(idxs) == 1:
+        return (column[idxs[0]],)
+    return itemgetter(*idxs)(column)
+
+
+class TestDataResultTable:
+    """
+    Struct-of-arrays storage of testdata results.
+
+    Status, time, memory and fixed-point score live in parallel array columns, messages
+    and the exact scores the fixed-point column rounds are stored sparsely. Indexing by testdata id returns a TestDataResultView, which
+    has the same attributes as TestDataResult, so it can be used like the old dict of
+    dataclasses.
+    """
+    __slots__ = (
+        "index", "ids", "status", "time", "memory", "net_time", "net_memory", "score", "exact_scores", "messages",
+    )
+
+    def __init__(self, ids=()):
+        self.index: dict[int, int] = {}
+        self.ids: list[int] = []
+        self.status = array("B")  # 0 means None
+        self.time = array("q")
+        self.memory = array("q")
+        self.net_time = array("q")
+        self.net_memory = array("q")
+        self.score = array("q")
+        self.exact_scores: dict[int, decimal.Decimal] = {}
+        self.messages: dict[int, tuple[str, MessageType]] = {}
+        for testdata_id in ids:
+            self.add(testdata_id)
+
+    def add(self, testdata_id: int) -> "TestDataResultView":
+        assert testdata_id not in self.index, "Duplicate testdata result"
+        idx = len(self.ids)
+        self.index[testdata_id] = idx
+        self.ids.append(testdata_id)
+        for column in (self.status, self.time, self.memory, self.net_time, self.net_memory, self.score):
+            column.append(0)
+        return TestDataResultView(self, idx)
+
+    def indexes(self, testdata_ids) -> list[int]:
+        index = self.index
+        return [index[testdata_id] for testdata_id in testdata_ids]
+
+    def fill(self, status: Status | None, message: tuple[str, MessageType] | None = None):
+        n = len(self.ids)
+        self.status = array("B", [status.value if status else 0]) * n
+        for name in ("time", "memory", "net_time", "net_memory", "score"):
+            setattr(self, name, array("q", bytes(8 * n)))
+        self.exact_scores = {}
+        if message is not None:
+            self.messages = dict.fromkeys(range(n), message)
+
+    def __getitem__(self, testdata_id: int) -> "TestDataResultView":
+        return TestDataResultView(self, self.index[testdata_id])
+
+    def __contains__(self, testdata_id: int) -> bool:
+        return testdata_id in self.index
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def keys(self):
+        return list(self.ids)
+
+    def values(self):
+        return [TestDataResultView(self, idx) for idx in range(len(self.ids))]
+
+    def items(self):
+        return [(testdata_id, TestDataResultView(self, idx)) for idx, testdata_id in enumerate(self.ids)]
+
+    def to_dict(self) -> dict[int, dict]:
+        return {testdata_id: TestDataResultView(self, idx).to_dict() for idx, testdata_id in enumerate(self.ids)}
+
+
+class TestDataResultView:
+    __slots__ = ("table", "idx")
+
+    def __init__(self, table: TestDataResultTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+    @property
+    def id(self) -> int:
+        return self.table.ids[self.idx]
+
+    @property
+    def score(self) -> decimal.Decimal:
+        exact = self.table.exact_scores.get(self.idx)
+        return exact if exact is not None else fixed_to_score(self.table.score[self.idx])
+
+    @score.setter
+    def score(self, value):
+        table, idx = self.table, self.idx
+        table.score[idx], exact = split_score(value)
+        if exact is not None:
+            table.exact_scores[idx] = exact
+        elif table.exact_scores:
+            table.exact_scores.pop(idx, None)
+
+    @property
+    def time(self) -> int:
+        return self.table.time[self.idx]
+
+    @time.setter
+    def time(self, value: int):
+        self.table.time[self.idx] = value
+
+    @property
+    def memory(self) -> int:
+        return self.table.memory[self.idx]
+
+    @memory.setter
+    def memory(self, value: int):
+        self.table.memory[self.idx] = value
+
+    @property
+    def net_time(self) -> int:
+        return self.table.net_time[self.idx]
+
+    @net_time.setter
+    def net_time(self, value: int):
+        self.table.net_time[self.idx] = value
+
+    @property
+    def net_memory(self) -> int:
+        return self.table.net_memory[self.idx]
+
+    @net_memory.setter
+    def net_memory(self, value: int):
+        self.table.net_memory[self.idx] = value
+
+    @property
+    def message(self) -> str:
+        return self.table.messages.get(self.idx, ("", MessageType.NONE))[0]
+
+    @message.setter
+    def message(self, value: str):
+        self.table.messages[self.idx] = (value, self.message_type)
+
+    @property
+    def message_type(self) -> MessageType:
+        return self.table.messages.get(self.idx, ("", MessageType.NONE))[1]
+
+    @message_type.setter
+    def message_type(self, value: MessageType):
+        self.table.messages[self.idx] = (self.message, value)
+
+    @property
+    def status(self) -> Status | None:
+        return _STATUS_BY_VALUE.get(self.table.status[self.idx])
+
+    @status.setter
+    def status(self, value: Status | None):
+        self.table.status[self.idx] = value.value if value else 0
+
+    def snapshot(self) -> TestDataResult:
+        return TestDataResult(**self.to_dict())
+
+    def to_dict(self) -> dict:
+        table, idx = self.table, self.idx
+        message, message_type = table.messages.get(idx, ("", MessageType.NONE))
+        return {
+            "id": table.ids[idx],
+            "score": self.score,
+            "time": table.time[idx],
+            "memory": table.memory[idx],
+            "net_time": table.net_time[idx],
+            "net_memory": table.net_memory[idx],
+            "message": message,
+            "message_type": message_type,
+            "status": _STATUS_BY_VALUE.get(table.status[idx]),
+        }
+
+
 @dataclass(slots=True)
 class SubtaskResult:
     time: int = 0
@@ -160,7 +382,18 @@ class Result:
     chal_id: int
     total_result: TotalResult = field(default_factory=TotalResult)
     subtask_results: dict[int, SubtaskResult] = field(default_factory=dict)
-    testdata_results: dict[int, TestDataResult] = field(default_factory=dict)
+    testdata_results: TestDataResultTable = field(default_factory=TestDataResultTable)
+
+    def to_dict(self) -> dict:
+        return {
+            "chal_id": self.chal_id,
+            "total_result": asdict(self.total_result),
+            "subtask_results": {
+                subtask_id: asdict(subtask_result)
+                for subtask_id, subtask_result in self.subtask_results.items()
+            },
+            "testdata_results": self.testdata_results.to_dict(),
+        }
 
 
 @dataclass(slots=True)
@@ -171,7 +404,7 @@ class Subtask:
     dependency_subtasks: list[int] = field(default_factory=list)
 
 
-@dataclass(slots=True)
+@dataclass(slots=True, weakref_slot=True)
 class Challenge:
     chal_id: int
     pro_id: int
@@ -181,24 +414,35 @@ class Challenge:
 
     code_path: str
     res_path: str
+    # NOTE: Inline source, written into the box by the compile task instead of code_path
+    code: str | None = None
+    manifest: 'ResourceManifest' = None
     limits: Limits = None
     result: Result = None
 
     problem_context: 'ProblemContext' = None
 
     reporter: FunctionType = lambda: 0
+    summary_reported: bool = False
     skip_nonac: bool = False
     skip_subtasks: set[int] = field(default_factory=set)
 
     internal_id: int = field(default_factory=next_internal_id)
-    box: ChallengeBox = field(default_factory=next_challenge_box)
+    box: ChallengeBox = None
+    checker_hosts: 'CheckerHostPool' = None
 
     testdatas: dict[int, TestData] = field(default_factory=dict)
     subtasks: dict[int, Subtask] = field(default_factory=dict)
 
+    def __post_init__(self):
+        if self.box is None:
+            self.box = ChallengeBox(config.SANDBOX_ROOT, self.internal_id)
+
 
 @dataclass(slots=True)
 class Task(ABC):
+    task_type: ClassVar[TaskType]
+
     @abstractmethod
     def setup(self, chal: Challenge, task: "TaskEntry") -> bool:
         pass
@@ -213,13 +457,43 @@ class Task(ABC):
 
 @dataclass(slots=True)
 class TaskEntry:
+    """
+    Node of a challenge task DAG.
+
+    Edges are object references instead of per-node lists of task ids: `successor` is
+    the implicit single edge of the regular exec -> scoring -> summary chain, and
+    `fanout` is a list shared with the DAG builder (e.g. compile -> every exec task),
+    so a testcase costs no edge list allocation.
+    """
     task: Task
     internal_id: int
     priority: int
     task_id: int = field(default_factory=next_task_id)
     order: int = 0
     indeg_cnt: int = 0
-    edges: list[int] = field(default_factory=list)
+    successor: "TaskEntry | None" = None
+    fanout: "list[TaskEntry] | tuple[TaskEntry, ...]" = ()
+    enqueued_at: int = 0  # time.monotonic_ns() when pushed to the task queue
+
+    def successors(self):
+        if self.successor is not None:
+            yield self.successor
+        yield from self.fanout
+
+    def release(self) -> list["TaskEntry"]:
+        """
+        Remove the edges leaving this task, returns the successors that became ready.
+        """
+        ready = []
+        if self.successor is not None:
+            self.successor.indeg_cnt -= 1
+            if self.successor.indeg_cnt == 0:
+                ready.append(self.successor)
+        for next_task in self.fanout:
+            next_task.indeg_cnt -= 1
+            if next_task.indeg_cnt == 0:
+                ready.append(next_task)
+        return ready
 
     def __lt__(self, other: "TaskEntry"):
         if self.priority != other.priority:
@@ -0,0 +1,266 @@
+"""
+Result outbox of one backend (see backends.py)
+
+worker threads -> append (seq) -> frames in memory / spill log -> flush (IOLoop) -> current connection
+
+Every result frame (execute, scoring, summary, fetch) gets a sequence number spliced
+into its JSON object and stays in the outbox until the backend acknowledges it with
+{"ack": <seq>}, meaning it has every frame up to seq. The frames go to the current
+connection of the backend, the newest one; a backend that reconnects gets a
+{"task": "hello"} frame with the judge's epoch and acknowledged seq (and the session
+of an anonymous backend), then every unacknowledged frame again, so in-flight
+challenges finish without a rejudge.
+Backends drop frames with a seq they already have. The epoch changes when the judge
+restarts, the seq starts over.
+
+A backend opts in by acknowledging, {"ack": 0} right after connecting is enough.
+Until the first ack a frame is dropped once it is written, as before.
+
+Frames beyond OUTBOX_MAX_MEMORY bytes are spilled, oldest first, to an append-only log
+that is truncated once every spilled frame is acknowledged. Frames that would grow
+the log past OUTBOX_MAX_SPILL bytes, or that cannot be written to it, are dropped,
+their challenges need a rejudge.
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import uuid
+
+import tornado.ioloop
+import tornado.websocket
+
+import config
+import utils
+from utils import metrics
+
+dropped_frames = metrics.registry.counter("ntoj_outbox_dropped_total", "Result frames dropped from a full outbox")
+
+
+def parse_ack(msg: str | bytes) -> int | None:
+    """
+    The seq of an {"ack": <seq>} message, None for anything else. Challenge messages are
+    longer than any ack, so they are not parsed here.
+    """
+    if not isinstance(msg, str) or len(msg) > 64 or '"ack"' not in msg:
+        return None
+    try:
+        return int(json.loads(msg)["ack"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class Outbox:
+    def __init__(
+        self,
+        ioloop: tornado.ioloop.IOLoop,
+        max_memory: int = config.OUTBOX_MAX_MEMORY,
+        spill_path: str = config.OUTBOX_SPILL_PATH,
+        max_spill: int = config.OUTBOX_MAX_SPILL,
+    ):
+        self.ioloop = ioloop
+        self.max_memory = max_memory
+        self.spill_path = spill_path
+        self.max_spill = max_spill
+        self.epoch = uuid.uuid4().hex
+
+        self.lock = threading.Lock()
+        # NOTE: seq -> frame, or (offset, length) in the spill log, in seq order with the
+        # spilled frames first
+        self.frames: collections.OrderedDict[int, str | tuple[int, int]] = collections.OrderedDict()
+        self.in_memory: collections.deque[int] = collections.deque()
+        self.memory_bytes = 0
+        self.spill_fd: int | None = None
+        self.spill_size = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.next_seq = 1
+        self.acked = 0
+        self.acking = False
+        self.closed = False
+
+        # NOTE: Only used on the IOLoop
+        self.conn: tornado.websocket.WebSocketHandler | None = None
+        self.sent = 0  # highest seq written to conn
+        self.flushing = False
+        self.flush_scheduled = False
+
+        try:
+            os.makedirs(os.path.dirname(spill_path) or ".", exist_ok=True)
+        except OSError as e:
+            # NOTE: Spilling fails later and drops frames instead, the judge still runs
+            utils.logger.error(f"Cannot create the outbox spill folder of {spill_path}: {e!r}")
+
+    def append(self, data: str):
+        """
+        Queue an encoded JSON object, runs on any thread.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            seq = self.next_seq
+            self.next_seq += 1
+            frame = f'{{"seq":{seq},{data[1:]}'
+            self.frames[seq] = frame
+            self.in_memory.append(seq)
+            self.memory_bytes += len(frame)
+            while self.memory_bytes > self.max_memory and len(self.in_memory) > 1:
+                self.spill_oldest()
+
+            schedule = not self.flush_scheduled
+            self.flush_scheduled = True
+        if schedule:
+            self.ioloop.add_callback(self.flush)
+
+    def spill_oldest(self):
+        seq = self.in_memory[0]
+        frame = self.frames[seq]
+        data = frame.encode()
+        error = None
+        if self.spill_size + len(data) > self.max_spill:
+            error = "full"
+        else:
+            try:
+                if self.spill_fd is None:
+                    self.spill_fd = os.open(self.spill_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                written = os.pwrite(self.spill_fd, data, self.spill_size)
+                if written != len(data):
+                    error = f"short write to {self.spill_path}"
+            except OSError as e:
+                error = repr(e)
+
+        # NOTE: Only now leaves memory, a raise above keeps the bookkeeping consistent
+        self.in_memory.popleft()
+        self.memory_bytes -= len(frame)
+        if error is not None:
+            del self.frames[seq]
+            if not self.dropped:
+                utils.logger.error(f"Outbox cannot spill ({error}), dropping result frames from seq {seq} on")
+            self.dropped += 1
+            dropped_frames.inc()
+            return
+
+        self.frames[seq] = (self.spill_size, len(data))
+        self.spill_size += len(data)
+        self.spilled += 1
+
+    def ack(self, seq: int):
+        """
+        The backend has every frame up to seq, runs on the IOLoop.
+        """
+        with self.lock:
+            self.acking = True
+            self.ack_locked(seq)
+
+    def ack_locked(self, seq: int):
+        frames = self.frames
+        while frames:
+            first = next(iter(frames))
+            if first > seq:
+                break
+            frame = frames.pop(first)
+            if isinstance(frame, str):
+                self.in_memory.popleft()
+                self.memory_bytes -= len(frame)
+        self.acked = max(self.acked, seq)
+        self.sent = max(self.sent, self.acked)
+
+        # NOTE: Every spilled frame is acknowledged, start the log over
+        if self.spill_size and (not frames or isinstance(frames[next(iter(frames))], str)):
+            os.ftruncate(self.spill_fd, 0)
+            self.spill_size = 0
+
+    def next_frame(self) -> tuple[int, str] | None:
+        with self.lock:
+            if not self.frames:
+                return None
+            seq = max(self.sent + 1, next(iter(self.frames)))
+            frame = self.frames.get(seq)
+            if frame is None:
+                # NOTE: Dropped frames leave a gap after the spilled ones
+                seq = next((key for key in self.frames if key > self.sent), None)
+                if seq is None:
+                    return None
+                frame = self.frames[seq]
+            if isinstance(frame, tuple):
+                offset, length = frame
+                frame = os.pread(self.spill_fd, length, offset).decode()
+            return seq, frame
+
+    async def flush(self):
+        with self.lock:
+            self.flush_scheduled = False
+        if self.flushing:
+            return
+
+        self.flushing = True
+        try:
+            while (conn := self.conn) is not None and (item := self.next_frame()) is not None:
+                seq, frame = item
+                self.sent = seq
+                await conn.write_message(frame)
+                if not self.acking:
+                    with self.lock:
+                        self.ack_locked(seq)
+        except tornado.websocket.WebSocketClosedError:
+            # NOTE: A backend that attached meanwhile was not flushed, this loop was busy
+            if self.conn is not None and self.conn is not conn:
+                self.ioloop.add_callback(self.flush)
+        finally:
+            self.flushing = False
+
+    def attach(self, conn: tornado.websocket.WebSocketHandler, session: str | None = None):
+        """
+        Make conn the current connection and replay the unacknowledged frames.
+        """
+        self.conn = conn
+        with self.lock:
+            self.sent = self.acked
+            hello = {"task": "hello", "epoch": self.epoch, "acked": self.acked}
+        if session is not None:
+            hello["session"] = session
+        conn.write_message(json.dumps(hello))
+        self.ioloop.add_callback(self.flush)
+
+    def detach(self, conn: tornado.websocket.WebSocketHandler):
+        if self.conn is conn:
+            self.conn = None
+
+    def close(self):
+        """
+        Drop every frame and ignore later ones, for a backend that is gone for good.
+        """
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.in_memory.clear()
+            self.memory_bytes = 0
+            if self.spill_fd is not None:
+                os.close(self.spill_fd)
+                self.spill_fd = None
+                with contextlib.suppress(OSError):
+                    os.unlink(self.spill_path)
+            self.spill_size = 0
+        self.conn = None
+
+    def unsent(self) -> int:
+        if self.closed:
+            return 0
+        return self.next_seq - 1 - max(self.sent, self.acked)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "epoch": self.epoch,
+                "next_seq": self.next_seq,
+                "acked": self.acked,
+                "sent": self.sent,
+                "acking": self.acking,
+                "frames": len(self.frames),
+                "memory_bytes": self.memory_bytes,
+                "spill_bytes": self.spill_size,
+                "spilled": self.spilled,
+                "dropped": self.dropped,
+                "connected": self.conn is not None,
+            }
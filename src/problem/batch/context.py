@@ -1,12 +1,12 @@
-import os
 from dataclasses import dataclass
 
 from models import Challenge, ProblemContext, CheckerType, register_context, TaskEntry, TestData
 from problem.mixins import CheckerMixin, SummaryMixin, UserProgramMixin
 from problem.compilation import CheckerCompilationTarget, UserProgramCompilationTarget
 from problem.batch.execute import BatchExecuteTask
-from utils.challenge_builder import parse_checker_info, parse_limits, parse_summary_info, parse_user_program_info, get_exec_order, link_task
+from utils.challenge_builder import parse_checker_info, parse_limits, parse_summary_info, parse_user_program_info, get_exec_order, link_task, link_fanout, create_file_testdata
 from utils import logger
+from utils.checker_host import create_checker_host_pool
 from tasks.compile import CompileTask
 from tasks.scoring import ScoringTask
 from tasks.summary import SummaryTask
@@ -68,8 +68,7 @@ class BatchProblemContext(ProblemContext, UserProgramMixin, CheckerMixin, Summar
             exec_tasks.append(exec_task)
             scoring_tasks.append(scoring_task)
 
-        for exec_task in exec_tasks:
-            link_task(compile_task, exec_task)
+        link_fanout(compile_task, exec_tasks)
 
         assert isinstance(chal.problem_context, CheckerMixin)
         if chal.problem_context.checker_type in (
@@ -82,10 +81,12 @@ class BatchProblemContext(ProblemContext, UserProgramMixin, CheckerMixin, Summar
                 chal.internal_id,
                 chal.priority,
             )
-            for scoring_task in scoring_tasks:
-                link_task(checker_compile_task, scoring_task)
+            link_fanout(checker_compile_task, scoring_tasks)
             add_task(checker_compile_task)
 
+            if chal.problem_context.uses_checker_host():
+                chal.checker_hosts = create_checker_host_pool(chal)
+
         add_task(compile_task)
         for t in exec_tasks:
             add_task(t)
@@ -97,8 +98,4 @@ class BatchProblemContext(ProblemContext, UserProgramMixin, CheckerMixin, Summar
         return tasks
 
     def create_testdata(self, chal: 'Challenge', testdata_obj: dict) -> TestData:
-        return TestData(
-            id=int(testdata_obj['id']),
-            inputpath=os.path.join(chal.res_path, "testdata", testdata_obj['input']),
-            outputpath=os.path.join(chal.res_path, "testdata", testdata_obj['output']),
-        )
+        return create_file_testdata(chal, testdata_obj)
@@ -6,34 +6,38 @@ from models import (
     SandboxStatus,
     Task,
     TaskEntry,
+    TaskType,
     TestData,
     Challenge,
     Status,
     Compiler,
     SignalErrorMessage,
+    TimeoutMessage,
 )
 
 from lang.base import langs
-from utils import logger
+from lang import calibration
+from utils import logger, stream_checker, testcase_logger
+from utils.cpus import cpus
+from utils.telemetry import telemetry
 
 import config
-from problem.mixins import UserProgramMixin
-from sandbox.sandbox import SandboxParams
+from problem.mixins import CheckerMixin, UserProgramMixin
+from sandbox.backend import get_backend
+from sandbox.sandbox import SandboxParams, SandboxResult
 
-execute_id = 0
-def next_execute_id() -> int:
-    global execute_id
-    execute_id += 1
-    return execute_id
 
 class BatchExecuteTask(Task):
+    __slots__ = ("testdata",)
+    task_type = TaskType.EXECUTE
+
     def __init__(self, testdata: TestData):
         self.testdata = testdata
 
     def setup(self, chal: Challenge, task: TaskEntry) -> bool:
         # NOTE: Check CE / CLE / JE
         if chal.result.total_result.status is not None:
-            logger.debug(f"Skipping testdata {self.testdata.id} due to total result status already set")
+            testcase_logger.debug("Skipping testdata %s due to total result status already set", self.testdata.id)
             return False
 
         if chal.skip_nonac:
@@ -44,7 +48,7 @@ class BatchExecuteTask(Task):
                     break
 
             if flag:
-                logger.debug(f"Skipping testdata {self.testdata.id} due to skip_nonac")
+                testcase_logger.debug("Skipping testdata %s due to skip_nonac", self.testdata.id)
                 chal.result.testdata_results[self.testdata.id].status = Status.Skipped
                 chal.reporter(
                     {
@@ -62,7 +66,7 @@ class BatchExecuteTask(Task):
     def run(self, chal: Challenge, task: TaskEntry):
         assert isinstance(chal.problem_context, UserProgramMixin)
         lang = langs[chal.problem_context.userprog_compiler]
-        logger.info(f"Executing testdata {self.testdata.id} for chal {chal.chal_id} with {lang.name}")
+        testcase_logger.info("Executing testdata %s for chal %s with %s", self.testdata.id, chal.chal_id, lang.name)
         if chal.problem_context.userprog_compiler != Compiler.java:
             exec, args = lang.get_execute_command("a")
         else:
@@ -75,56 +79,100 @@ class BatchExecuteTask(Task):
         assert chal.box.get_file(stdin_name) is None
         stdin_path = chal.box.gen_filepath(stdin_name)
         shutil.copyfile(self.testdata.inputpath, stdin_path)
-        cpuset = ""
-        if config.CPUSET:
-            cpuset = config.CPUSET[next_execute_id() % len(config.CPUSET)]
+        time_limit = chal.limits.time // 10**6 # TODO: use ms instead of ns
+        memory_limit = chal.limits.memory // 1024 # TODO: use kib instead of byte
+        baseline = calibration.get_baseline(chal.problem_context.userprog_compiler)
+        if baseline and calibration.should_scale_limits(chal.problem_context.userprog_compiler):
+            time_limit += baseline.time // 10**6
+            memory_limit += baseline.memory // 1024
+        comparator_cls = None
+        # NOTE: The stream checker reads the program output from a pipe
+        if config.STREAM_CHECKER_ENABLED and get_backend().supports_pipes:
+            assert isinstance(chal.problem_context, CheckerMixin)
+            comparator_cls = stream_checker.STREAM_COMPARATORS.get(chal.problem_context.checker_type)
+
+        stdout_name = f"{self.testdata.id}-stdout"
+        idle_limit = config.IDLE_LIMIT
+        if comparator_cls:
+            chal.box.mkfifo(stdout_name)
+            stdout_path = chal.box.gen_fifopath(stdout_name)
+            # NOTE: No idle watchdog, a program blocked writing to the FIFO waits for the
+            # judge thread that drains it, a stalled judge must not be charged as TLE
+            idle_limit = 0
+        else:
+            stdout_path = chal.box.gen_filepath(stdout_name)
+
         param = SandboxParams(
             exe_path=exec,
             args=args,
-            time_limit=chal.limits.time // 10**6, # TODO: use ms instead of ns
-            memory_limit=chal.limits.memory // 1024, # TODO: use kib instead of byte
+            time_limit=time_limit,
+            memory_limit=memory_limit,
             stack_limit=65536,
             output_limit=chal.limits.output // 1024,
             proc_limit=lang.allow_thread_count,
             # TODO: cpu rate
             stdin=stdin_path,
-            stdout=chal.box.gen_filepath(f"{self.testdata.id}-stdout"),
+            stdout=stdout_path,
+            idle_limit=idle_limit,
             allow_proc=lang.allow_thread_count > 1,
             allow_mount_proc=lang == langs[Compiler.java],
-            cpuset=cpuset
         )
         assert chal.problem_context.userprog_path
         param.add_copy_in_path(chal.problem_context.userprog_path, "a")
-        res = chal.box.run_sandbox([param])[0]
+        stream_result = None
+        with cpus.reserve(1) as cpusets:
+            param.set_cpuset(cpusets[0])
+            if comparator_cls:
+                res, stream_result = self.run_streaming(chal, param, comparator_cls(self.testdata.outputpath))
+            else:
+                res = chal.box.run_sandbox([param])[0]
         try:
             os.remove(stdin_path)
         except FileNotFoundError:
             pass
+        telemetry.record("execute", lang.name, chal.pro_id, res)
 
         testdata_result = chal.result.testdata_results[self.testdata.id]
         testdata_result.memory = res.memory
         testdata_result.time = max(res.run_time, res.time)
-        if chal.box.get_file(f"{self.testdata.id}-stdout"):
-            self.testdata.useroutput_path = chal.box.get_file(f"{self.testdata.id}-stdout")
+        testdata_result.net_time, testdata_result.net_memory = calibration.apply_baseline(
+            chal.problem_context.userprog_compiler, testdata_result.time, testdata_result.memory
+        )
+        if chal.box.get_file(stdout_name):
+            self.testdata.useroutput_path = chal.box.get_file(stdout_name)
 
-        if res.status == SandboxStatus.Normal:
-            testdata_result.status = Status.Accepted
-            logger.info(f"Testdata {self.testdata.id} executed normally for chal {chal.chal_id}, time: {res.time}ms, memory: {res.memory}KB")
+        # NOTE: A stream abort kills the sandbox, so its status is not the program's
+        if stream_result and stream_result.output_limit_exceeded:
+            testdata_result.status = Status.OutputLimitExceeded
+            testcase_logger.info("Testdata %s OLE for chal %s, output aborted at %s bytes", self.testdata.id, chal.chal_id, stream_result.output_size)
+        elif stream_result and stream_result.aborted:
+            testdata_result.status = Status.WrongAnswer
+            testcase_logger.info("Testdata %s wrong answer for chal %s, output aborted at %s bytes", self.testdata.id, chal.chal_id, stream_result.output_size)
+        elif res.status == SandboxStatus.Normal:
+            if stream_result and not stream_result.accepted:
+                testdata_result.status = Status.WrongAnswer
+                testcase_logger.info("Testdata %s wrong answer for chal %s", self.testdata.id, chal.chal_id)
+            else:
+                testdata_result.status = Status.Accepted
+                testcase_logger.info("Testdata %s executed normally for chal %s, time: %sms, memory: %sKB", self.testdata.id, chal.chal_id, res.time, res.memory)
         elif res.status == SandboxStatus.TimeLimitExceeded:
             testdata_result.status = Status.TimeLimitExceeded
-            logger.info(f"Testdata {self.testdata.id} TLE for chal {chal.chal_id}")
+            if res.timeout in TimeoutMessage:
+                testdata_result.message = TimeoutMessage[res.timeout]
+                testdata_result.message_type = MessageType.TEXT
+            testcase_logger.info("Testdata %s TLE for chal %s, timeout: %s", self.testdata.id, chal.chal_id, res.timeout or "cpu")
         elif res.status == SandboxStatus.MemoryLimitExceeded:
             testdata_result.status = Status.MemoryLimitExceeded
-            logger.info(f"Testdata {self.testdata.id} MLE for chal {chal.chal_id}")
+            testcase_logger.info("Testdata %s MLE for chal %s", self.testdata.id, chal.chal_id)
         elif res.status == SandboxStatus.OutputLimitExceeded:
             testdata_result.status = Status.OutputLimitExceeded
-            logger.info(f"Testdata {self.testdata.id} OLE for chal {chal.chal_id}")
+            testcase_logger.info("Testdata %s OLE for chal %s", self.testdata.id, chal.chal_id)
         elif res.status == SandboxStatus.NonzeroExitStatus:
             testdata_result.status = Status.RuntimeError
-            logger.info(f"Testdata {self.testdata.id} runtime error for chal {chal.chal_id}, exit code: {res.exit_status}")
+            testcase_logger.info("Testdata %s runtime error for chal %s, exit code: %s", self.testdata.id, chal.chal_id, res.exit_status)
         elif res.status == SandboxStatus.Signalled:
             testdata_result.status = Status.RuntimeErrorSignalled
-            logger.info(f"Testdata {self.testdata.id} signalled for chal {chal.chal_id}, signal: {res.exit_status}")
+            testcase_logger.info("Testdata %s signalled for chal %s, signal: %s", self.testdata.id, chal.chal_id, res.exit_status)
             if res.exit_status in SignalErrorMessage:
                 testdata_result.message = SignalErrorMessage[res.exit_status]
                 testdata_result.message_type = MessageType.TEXT
@@ -132,8 +180,34 @@ class BatchExecuteTask(Task):
             testdata_result.status = Status.InternalError
             logger.error(f"Testdata {self.testdata.id} runner error for chal {chal.chal_id}")
 
+    def run_streaming(
+        self,
+        chal: Challenge,
+        param: SandboxParams,
+        comparator: stream_checker.StrictComparator | stream_checker.LineComparator,
+    ) -> tuple[SandboxResult, stream_checker.StreamResult]:
+        """
+        Run the program with stdout connected to a FIFO and compare the output while it runs.
+        """
+        assert param.stdout
+        # NOTE: Open the read end first, so the sandbox does not block opening the write end
+        fd = os.open(param.stdout, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            proc = chal.box.spawn_sandbox(param)
+            try:
+                stream_result = stream_checker.stream_compare(fd, proc, comparator, chal.limits.output)
+            finally:
+                res = proc.wait()
+        finally:
+            os.close(fd)
+            comparator.close()
+            os.remove(param.stdout)
+
+        self.testdata.stream_checked = True
+        return res, stream_result
+
     def finish(self, chal: Challenge, task: TaskEntry):
-        logger.debug(f"Execution finished for testdata {self.testdata.id} of chal {chal.chal_id}")
+        testcase_logger.debug("Execution finished for testdata %s of chal %s", self.testdata.id, chal.chal_id)
         chal.reporter(
             {
                 "chal_id": chal.chal_id,
@@ -143,7 +217,7 @@ class BatchExecuteTask(Task):
         )
 
         if chal.result.testdata_results[self.testdata.id].status != Status.Accepted:
-            logger.debug(f"Testdata {self.testdata.id} not accepted, marking subtasks as skip")
+            testcase_logger.debug("Testdata %s not accepted, marking subtasks as skip", self.testdata.id)
             chal.skip_subtasks.update(self.testdata.subtasks)
             if self.testdata.useroutput_path:
                 chal.box.delete_file(self.testdata.useroutput_path)
@@ -1,12 +1,12 @@
 from dataclasses import dataclass
 import os
-import glob
 
 from models import CompilationTarget, Challenge, SandboxStatus, Status, MessageType, Compiler
-from problem.mixins import UserProgramMixin, CheckerMixin
+from problem.mixins import UserProgramMixin, CheckerMixin, InteractorMixin
 from lang.base import langs
 from sandbox.sandbox import SandboxResult
 from utils import logger
+from utils.checker_host import CHECKER_HOST_SOURCE, TOOLS_PATH
 
 @dataclass(slots=True)
 class UserProgramCompilationTarget(CompilationTarget):
@@ -15,8 +15,8 @@ class UserProgramCompilationTarget(CompilationTarget):
     def can_compile(self, chal: 'Challenge') -> bool:
         if self.context.has_grader:
             lang = langs[self.context.userprog_compiler]
-            grader_folder_path = os.path.join(chal.res_path, "grader", lang.name)
-            if not os.path.exists(grader_folder_path):
+            grader_folder = os.path.join("grader", lang.name)
+            if not chal.manifest.exists(grader_folder):
                 logger.error(f"Grader folder not found for {lang.name} for chal {chal.chal_id}")
                 chal.result.total_result.status = Status.JudgeError
                 chal.result.total_result.ie_message = f"{lang.name} version grader not support, please contact administrator or problem setter."
@@ -24,8 +24,7 @@ class UserProgramCompilationTarget(CompilationTarget):
                 return False
 
             if self.context.userprog_compiler == Compiler.python3:
-                grader_path = os.path.join(grader_folder_path, "grader.py")
-                if not os.path.exists(grader_path):
+                if not chal.manifest.exists(os.path.join(grader_folder, "grader.py")):
                     logger.error(f"grader.py not found for Python3 grader in chal {chal.chal_id}")
                     chal.result.total_result.status = Status.JudgeError
                     chal.result.total_result.ie_message = "Python3 version grader need grader.py, but file not found.\n please contact administrator or problem setter."
@@ -35,15 +34,16 @@ class UserProgramCompilationTarget(CompilationTarget):
 
     def get_source_files(self, chal: 'Challenge') -> list[tuple[str, str]]:
         lang = langs[self.context.userprog_compiler]
-        copy_in = [(chal.code_path, f"a{lang.source_ext}")]
+        code_path = chal.code_path
+        if chal.code is not None:
+            # NOTE: Removed with the box when the challenge is evicted
+            code_path = chal.box.get_file("inline-source") or chal.box.write_file("inline-source", chal.code.encode())
+        copy_in = [(code_path, f"a{lang.source_ext}")]
 
         if self.context.has_grader:
-            grader_folder_path = os.path.join(chal.res_path, "grader", lang.name)
-            for name in os.listdir(grader_folder_path):
-                if os.path.isdir(os.path.join(grader_folder_path, name)):
-                    continue
-
-                copy_in.append((os.path.join(grader_folder_path, name), name))
+            grader_folder = os.path.join("grader", lang.name)
+            for name in chal.manifest.listdir(grader_folder):
+                copy_in.append((chal.manifest.abspath(os.path.join(grader_folder, name)), name))
         return copy_in
 
     def get_source_list(self, chal: 'Challenge') -> list[str]:
@@ -56,10 +56,9 @@ class UserProgramCompilationTarget(CompilationTarget):
                 Compiler.gcc_c_11,
                 Compiler.gcc_cpp_17,
             ):
-                for sourcefile in glob.glob(
-                    f"{chal.res_path}/grader/{lang.name}/*{lang.source_ext}"
-                ):
-                    sources.append(os.path.basename(sourcefile))
+                sources.extend(
+                    chal.manifest.list_with_ext(os.path.join("grader", lang.name), lang.source_ext)
+                )
 
             if self.context.userprog_compiler == Compiler.python3:
                 sources.append("grader.py")
@@ -111,8 +110,7 @@ class CheckerCompilationTarget(CompilationTarget):
         assert self.context.checker_compiler
         lang = langs[self.context.checker_compiler]
         checker_name = f"checker{lang.source_ext}"
-        checker_path = os.path.join(chal.res_path, "checker")
-        if not os.path.exists(os.path.join(checker_path, checker_name)):
+        if not chal.manifest.exists(os.path.join("checker", checker_name)):
             logger.error(f"Checker file {checker_name} not found in chal {chal.chal_id}")
             chal.result.total_result.status = Status.JudgeError
             chal.result.total_result.ie_message = f"{checker_name} not found, please contact administrator or problem setter"
@@ -124,18 +122,20 @@ class CheckerCompilationTarget(CompilationTarget):
         assert self.context.checker_compiler
         lang = langs[self.context.checker_compiler]
         checker_name = f"checker{lang.source_ext}"
-        checker_path = os.path.join(chal.res_path, "checker")
-        copy_in = [(os.path.join(checker_path, checker_name), checker_name)]
+        copy_in = [(chal.manifest.abspath(os.path.join("checker", checker_name)), checker_name)]
 
-        for name in os.listdir(checker_path):
-            if os.path.isdir(name):
-                continue
+        for name in chal.manifest.listdir("checker"):
+            copy_in.append((chal.manifest.abspath(os.path.join("checker", name)), name))
 
-            copy_in.append((os.path.join(checker_path, name), name))
+        if self.context.uses_checker_host():
+            copy_in.append((os.path.join(TOOLS_PATH, "checker_host.cpp"), CHECKER_HOST_SOURCE))
         return copy_in
 
     def get_source_list(self, chal: 'Challenge') -> list[str]:
         assert self.context.checker_compiler
+        # NOTE: The host source includes checker.cpp itself
+        if self.context.uses_checker_host():
+            return [CHECKER_HOST_SOURCE]
         return [f"checker{langs[self.context.checker_compiler].source_ext}"]
 
     def get_compiler(self, chal: 'Challenge') -> 'Compiler':
@@ -162,3 +162,50 @@ class CheckerCompilationTarget(CompilationTarget):
             with open(stderr) as f:
                 chal.result.total_result.ce_message = f.read()
             chal.box.delete_file("stderr")
+
+
+@dataclass(slots=True)
+class InteractorCompilationTarget(CompilationTarget):
+    context: 'InteractorMixin'
+    def can_compile(self, chal: 'Challenge') -> bool:
+        lang = langs[self.context.interactor_compiler]
+        interactor_name = f"interactor{lang.source_ext}"
+        if not chal.manifest.exists(os.path.join("interactor", interactor_name)):
+            logger.error(f"Interactor file {interactor_name} not found in chal {chal.chal_id}")
+            chal.result.total_result.status = Status.JudgeError
+            chal.result.total_result.ie_message = f"{interactor_name} not found, please contact administrator or problem setter"
+            chal.result.total_result.message_type = MessageType.TEXT
+            return False
+        return True
+
+    def get_source_files(self, chal: 'Challenge') -> list[tuple[str, str]]:
+        return [
+            (chal.manifest.abspath(os.path.join("interactor", name)), name)
+            for name in chal.manifest.listdir("interactor")
+        ]
+
+    def get_source_list(self, chal: 'Challenge') -> list[str]:
+        return [f"interactor{langs[self.context.interactor_compiler].source_ext}"]
+
+    def get_compiler(self, chal: 'Challenge') -> 'Compiler':
+        return self.context.interactor_compiler
+
+    def get_compile_args(self, chal: 'Challenge') -> list[str]:
+        return self.context.interactor_compile_args
+
+    def get_output_name(self, chal: 'Challenge') -> str:
+        return f"interactor{langs[self.context.interactor_compiler].executable_ext}"
+
+    def on_compile_success(self, chal: 'Challenge', file: str):
+        logger.info(f"Interactor compilation succeeded for chal {chal.chal_id}")
+        self.context.interactor_path = chal.box.get_file(file)
+
+    def on_compile_failure(self, chal: 'Challenge', res: SandboxResult):
+        logger.error(f"Interactor compilation failed for chal {chal.chal_id}, status: {res.status}")
+        chal.result.total_result.status = Status.JudgeError
+        chal.result.total_result.message_type = MessageType.TEXT
+        stderr = chal.box.get_file("stderr")
+        if stderr:
+            with open(stderr) as f:
+                chal.result.total_result.ce_message = f.read()
+            chal.box.delete_file("stderr")
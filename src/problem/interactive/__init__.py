@@ -0,0 +1,4 @@
+from problem.interactive.context import InteractiveProblemContext
+from models import *
+
+register_context("interactive")(InteractiveProblemContext)
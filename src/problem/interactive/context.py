@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+
+from models import Challenge, ProblemContext, register_context, TaskEntry, TestData
+from problem.mixins import InteractorMixin, SummaryMixin, UserProgramMixin
+from problem.compilation import InteractorCompilationTarget, UserProgramCompilationTarget
+from problem.interactive.execute import InteractiveExecuteTask
+from utils.challenge_builder import parse_interactor_info, parse_limits, parse_summary_info, parse_user_program_info, get_exec_order, link_task, link_fanout, create_file_testdata
+from utils import logger
+from tasks.compile import CompileTask
+from tasks.summary import SummaryTask
+
+@register_context("interactive")
+@dataclass(slots=True)
+class InteractiveProblemContext(ProblemContext, UserProgramMixin, InteractorMixin, SummaryMixin):
+    problem_type: str = "interactive"
+
+    @classmethod
+    def from_json(cls, obj: dict, chal: 'Challenge') -> 'InteractiveProblemContext':
+        logger.info(f"Creating interactive problem context for chal {chal.chal_id}")
+        context = cls(
+            problem_type="interactive",
+            **parse_user_program_info(obj),
+            **parse_interactor_info(obj),
+            **parse_summary_info(obj),
+        )
+        chal.limits = parse_limits(obj)
+        logger.debug(f"Interactive context created: compiler={context.userprog_compiler}, interactor_compiler={context.interactor_compiler}")
+        return context
+
+    def build_task_dag(self, chal: 'Challenge') -> list[TaskEntry]:
+        logger.info(f"Building task DAG for chal {chal.chal_id}")
+        compile_task = TaskEntry(
+            CompileTask(UserProgramCompilationTarget(self)),
+            chal.internal_id,
+            chal.priority,
+        )
+        interactor_compile_task = TaskEntry(
+            CompileTask(InteractorCompilationTarget(self)),
+            chal.internal_id,
+            chal.priority,
+        )
+        summary_task = TaskEntry(
+            SummaryTask(),
+            chal.internal_id,
+            chal.priority,
+        )
+
+        # NOTE: The interactor decides the verdict, so there is no scoring task
+        exec_tasks = []
+        exec_order = get_exec_order(chal, chal.skip_nonac)
+        for idx, testdata in enumerate(chal.testdatas.values()):
+            exec_task = TaskEntry(
+                InteractiveExecuteTask(testdata),
+                chal.internal_id,
+                chal.priority,
+                order=exec_order[idx],
+            )
+            link_task(exec_task, summary_task)
+            exec_tasks.append(exec_task)
+
+        link_fanout(compile_task, exec_tasks)
+        link_fanout(interactor_compile_task, exec_tasks)
+
+        tasks = [compile_task, interactor_compile_task, *exec_tasks, summary_task]
+        logger.info(f"Task DAG built with {len(tasks)} tasks for chal {chal.chal_id} ({len(exec_tasks)} testcases)")
+        return tasks
+
+    def create_testdata(self, chal: 'Challenge', testdata_obj: dict) -> TestData:
+        return create_file_testdata(chal, testdata_obj)
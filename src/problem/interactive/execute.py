@@ -0,0 +1,276 @@
+import decimal
+import os
+
+from models import (
+    MessageType,
+    SandboxStatus,
+    Task,
+    TaskEntry,
+    TaskType,
+    TestData,
+    Challenge,
+    Status,
+    Compiler,
+    SignalErrorMessage,
+    TimeoutMessage,
+)
+
+from lang.base import langs
+from lang import calibration
+from utils import logger, testcase_logger
+from utils.cpus import cpus
+from utils.telemetry import telemetry
+
+import config
+from problem.mixins import InteractorMixin, UserProgramMixin
+from sandbox.sandbox import SandboxParams, SandboxResult
+from tasks.scoring import generate_random_string
+
+# NOTE: testlib exit codes
+TESTLIB_OK = 0
+TESTLIB_WA = 1
+TESTLIB_PE = 2
+TESTLIB_FAIL = 3
+TESTLIB_POINTS = 7
+
+
+class InteractiveExecuteTask(Task):
+    """
+    Run the user program and the interactor together, the user stdout is the
+    interactor stdin and the interactor stdout is the user stdin. Both sandboxes
+    belong to one task, so they take one scheduling slot (and two CPUs when
+    config.CPUSET is set).
+    """
+    __slots__ = ("testdata",)
+    task_type = TaskType.EXECUTE
+
+    def __init__(self, testdata: TestData):
+        self.testdata = testdata
+
+    def setup(self, chal: Challenge, task: TaskEntry) -> bool:
+        # NOTE: Check CE / CLE / JE
+        if chal.result.total_result.status is not None:
+            testcase_logger.debug("Skipping testdata %s due to total result status already set", self.testdata.id)
+            return False
+
+        if chal.skip_nonac and all(subtask in chal.skip_subtasks for subtask in self.testdata.subtasks):
+            testcase_logger.debug("Skipping testdata %s due to skip_nonac", self.testdata.id)
+            chal.result.testdata_results[self.testdata.id].status = Status.Skipped
+            chal.reporter(
+                {
+                    "chal_id": chal.chal_id,
+                    "task": "execute",
+                    "testdata_result": chal.result.testdata_results[self.testdata.id],
+                }
+            )
+            return False
+
+        return True
+
+    def run(self, chal: Challenge, task: TaskEntry):
+        assert isinstance(chal.problem_context, UserProgramMixin)
+        assert isinstance(chal.problem_context, InteractorMixin)
+        lang = langs[chal.problem_context.userprog_compiler]
+        interactor_lang = langs[chal.problem_context.interactor_compiler]
+        testcase_logger.info("Executing interactive testdata %s for chal %s with %s", self.testdata.id, chal.chal_id, lang.name)
+        if chal.problem_context.userprog_compiler != Compiler.java:
+            exec, args = lang.get_execute_command("a")
+        else:
+            if chal.problem_context.has_grader:
+                exec, args = lang.get_execute_command("a", "grader")
+            else:
+                exec, args = lang.get_execute_command("a", "main")
+
+        in_name = generate_random_string(11)
+        ans_name = generate_random_string(10)
+        interactor_args = [in_name, "tout", ans_name]
+        if chal.problem_context.interactor_compiler != Compiler.java:
+            interactor_exec, interactor_args = interactor_lang.get_execute_command("interactor", args=interactor_args)
+        else:
+            interactor_exec, interactor_args = interactor_lang.get_execute_command("interactor", "interactor", args=interactor_args)
+
+        time_limit = chal.limits.time // 10**6 # TODO: use ms instead of ns
+        memory_limit = chal.limits.memory // 1024 # TODO: use kib instead of byte
+        baseline = calibration.get_baseline(chal.problem_context.userprog_compiler)
+        if baseline and calibration.should_scale_limits(chal.problem_context.userprog_compiler):
+            time_limit += baseline.time // 10**6
+            memory_limit += baseline.memory // 1024
+        # NOTE: No idle watchdog here, either side legitimately blocks on the other
+        realtime_limit = time_limit * config.INTERACTIVE_REALTIME_LIMIT_FACTOR
+
+        user_param = SandboxParams(
+            exe_path=exec,
+            args=args,
+            time_limit=time_limit,
+            realtime_limit=realtime_limit,
+            memory_limit=memory_limit,
+            stack_limit=65536,
+            output_limit=chal.limits.output // 1024,
+            proc_limit=lang.allow_thread_count,
+            allow_proc=lang.allow_thread_count > 1,
+            allow_mount_proc=lang == langs[Compiler.java],
+        )
+        assert chal.problem_context.userprog_path
+        user_param.add_copy_in_path(chal.problem_context.userprog_path, "a")
+
+        stderr_name = f"{self.testdata.id}-interactor-stderr"
+        # NOTE: The interactor mostly waits for the user program, so it may use
+        # the whole time limit of the user program in addition to its own work
+        interactor_time_limit = time_limit * 2
+        interactor_memory_limit = chal.limits.memory // 1024
+        interactor_baseline = calibration.get_baseline(chal.problem_context.interactor_compiler)
+        if interactor_baseline and calibration.should_scale_limits(chal.problem_context.interactor_compiler):
+            interactor_time_limit += interactor_baseline.time // 10**6
+            interactor_memory_limit += interactor_baseline.memory // 1024
+        interactor_param = SandboxParams(
+            exe_path=interactor_exec,
+            args=interactor_args,
+            time_limit=interactor_time_limit,
+            realtime_limit=realtime_limit,
+            memory_limit=interactor_memory_limit,
+            stack_limit=65536,
+            proc_limit=interactor_lang.allow_thread_count,
+            stderr=chal.box.gen_filepath(stderr_name),
+            allow_proc=interactor_lang.allow_thread_count > 1,
+            allow_mount_proc=interactor_lang == langs[Compiler.java],
+        )
+        assert chal.problem_context.interactor_path
+        interactor_param.add_copy_in_path(chal.problem_context.interactor_path, "interactor")
+        interactor_param.add_copy_in_path(self.testdata.inputpath, in_name)
+        interactor_param.add_copy_in_path(self.testdata.outputpath, ans_name)
+
+        to_interactor = f"{self.testdata.id}-to-interactor"
+        to_user = f"{self.testdata.id}-to-user"
+        try:
+            interactor_in, user_out = chal.box.open_fifo_pipe(to_interactor)
+            try:
+                user_in, interactor_out = chal.box.open_fifo_pipe(to_user)
+            except OSError:
+                os.close(interactor_in)
+                os.close(user_out)
+                raise
+            user_param.set_stdin_fd(user_in).set_stdout_fd(user_out)
+            interactor_param.set_stdin_fd(interactor_in).set_stdout_fd(interactor_out)
+
+            # NOTE: Both sides run at once, each on a CPU of its own
+            with cpus.reserve(2) as cpusets:
+                user_param.set_cpuset(cpusets[0])
+                interactor_param.set_cpuset(cpusets[1])
+                res, interactor_res = chal.box.run_sandbox([user_param, interactor_param])
+        finally:
+            chal.box.delete_fifo(to_interactor)
+            chal.box.delete_fifo(to_user)
+        telemetry.record("execute", lang.name, chal.pro_id, res)
+        telemetry.record("interactor", interactor_lang.name, chal.pro_id, interactor_res)
+
+        stderr_content = ""
+        stderr = chal.box.get_file(stderr_name)
+        if stderr:
+            with open(stderr) as f:
+                stderr_content = f.read()
+            chal.box.delete_file(stderr_name)
+
+        testdata_result = chal.result.testdata_results[self.testdata.id]
+        testdata_result.memory = res.memory
+        testdata_result.time = max(res.run_time, res.time)
+        testdata_result.net_time, testdata_result.net_memory = calibration.apply_baseline(
+            chal.problem_context.userprog_compiler, testdata_result.time, testdata_result.memory
+        )
+        self.set_verdict(chal, res, interactor_res, stderr_content)
+
+    def set_verdict(self, chal: Challenge, res: SandboxResult, interactor_res: SandboxResult, stderr_content: str):
+        testdata_result = chal.result.testdata_results[self.testdata.id]
+        checker_message = stderr_content.split("\n")[0]
+
+        # NOTE: Limits of the user program come first, a program killed for TLE
+        # usually makes the interactor report WA on the closed pipe
+        if res.status == SandboxStatus.TimeLimitExceeded:
+            testdata_result.status = Status.TimeLimitExceeded
+            if res.timeout in TimeoutMessage:
+                testdata_result.message = TimeoutMessage[res.timeout]
+                testdata_result.message_type = MessageType.TEXT
+            testcase_logger.info("Testdata %s TLE for chal %s, timeout: %s", self.testdata.id, chal.chal_id, res.timeout or "cpu")
+            return
+        if res.status == SandboxStatus.MemoryLimitExceeded:
+            testdata_result.status = Status.MemoryLimitExceeded
+            testcase_logger.info("Testdata %s MLE for chal %s", self.testdata.id, chal.chal_id)
+            return
+        if res.status == SandboxStatus.RunnerError or interactor_res.status == SandboxStatus.RunnerError:
+            testdata_result.status = Status.InternalError
+            logger.error(f"Testdata {self.testdata.id} runner error for chal {chal.chal_id}")
+            return
+
+        if interactor_res.status not in (SandboxStatus.Normal, SandboxStatus.NonzeroExitStatus):
+            self.set_testdata_result_je(chal, f"interactor failed, status: {interactor_res.status}")
+            return
+
+        # NOTE: The interactor stops reading on a wrong answer, so the user program
+        # may die on a broken pipe; the interactor verdict wins then
+        if interactor_res.exit_status in (TESTLIB_WA, TESTLIB_PE):
+            testdata_result.status = Status.WrongAnswer
+            testcase_logger.info("Testdata %s wrong answer for chal %s", self.testdata.id, chal.chal_id)
+        elif res.status == SandboxStatus.OutputLimitExceeded:
+            testdata_result.status = Status.OutputLimitExceeded
+            testcase_logger.info("Testdata %s OLE for chal %s", self.testdata.id, chal.chal_id)
+            return
+        elif res.status == SandboxStatus.NonzeroExitStatus:
+            testdata_result.status = Status.RuntimeError
+            testcase_logger.info("Testdata %s runtime error for chal %s, exit code: %s", self.testdata.id, chal.chal_id, res.exit_status)
+            return
+        elif res.status == SandboxStatus.Signalled:
+            testdata_result.status = Status.RuntimeErrorSignalled
+            testcase_logger.info("Testdata %s signalled for chal %s, signal: %s", self.testdata.id, chal.chal_id, res.exit_status)
+            if res.exit_status in SignalErrorMessage:
+                testdata_result.message = SignalErrorMessage[res.exit_status]
+                testdata_result.message_type = MessageType.TEXT
+            return
+        elif interactor_res.exit_status == TESTLIB_OK:
+            testdata_result.status = Status.Accepted
+            testdata_result.score = decimal.Decimal(1)
+            testcase_logger.info("Testdata %s accepted for chal %s", self.testdata.id, chal.chal_id)
+        elif interactor_res.exit_status == TESTLIB_POINTS:
+            line = checker_message.split(" ")
+            try:
+                if line[0] != "points":
+                    raise IndexError
+                testdata_result.score = decimal.Decimal(line[1])
+            except (IndexError, decimal.DecimalException):
+                self.set_testdata_result_je(chal, "invalid score")
+                return
+            testdata_result.status = Status.PartialCorrect
+            testcase_logger.info("Testdata %s partial correct (%s) for chal %s", self.testdata.id, line[1], chal.chal_id)
+        elif interactor_res.exit_status == TESTLIB_FAIL:
+            self.set_testdata_result_je(chal, "interactor internal error")
+            return
+        else:
+            self.set_testdata_result_je(chal, f"interactor exit code {interactor_res.exit_status}")
+            return
+
+        if checker_message:
+            testdata_result.message = checker_message
+            testdata_result.message_type = MessageType.TEXT
+
+    def set_testdata_result_je(self, chal: Challenge, reason: str):
+        logger.error(f"Judge error for chal {chal.chal_id} testdata {self.testdata.id}: {reason}")
+        testdata_result = chal.result.testdata_results[self.testdata.id]
+        testdata_result.status = Status.JudgeError
+        testdata_result.memory = 0
+        testdata_result.time = 0
+        testdata_result.message = reason
+        testdata_result.message_type = MessageType.TEXT
+
+    def finish(self, chal: Challenge, task: TaskEntry):
+        testcase_logger.debug("Execution finished for testdata %s of chal %s", self.testdata.id, chal.chal_id)
+        chal.reporter(
+            {
+                "chal_id": chal.chal_id,
+                "task": "execute",
+                "testdata_result": chal.result.testdata_results[self.testdata.id],
+            }
+        )
+
+        if chal.result.testdata_results[self.testdata.id].status not in (
+            Status.Accepted,
+            Status.PartialCorrect,
+        ):
+            chal.skip_subtasks.update(self.testdata.subtasks)
@@ -19,16 +19,40 @@ class CheckerMixin:
     checker_compiler: 'Compiler | None' = None
     checker_compile_args: list[str] = field(default_factory=list)
     checker_path: str | None = None
+    checker_host: bool = False  # check every testcase in a persistent checker host
 
     def has_custom_checker(self) -> bool:
         from models import CheckerType
         return self.checker_type in CheckerType.need_build_checkers()
 
+    def uses_checker_host(self) -> bool:
+        import config
+        from models import CheckerType
+        from sandbox.backend import get_backend
+        return (
+            config.CHECKER_HOST_ENABLED
+            and get_backend().supports_pipes
+            and self.checker_host
+            and self.checker_type in (CheckerType.CMS_TPS_TESTLIB, CheckerType.STD_TESTLIB)
+            and self.checker_compiler in (Compiler.gcc_cpp_17, Compiler.clang_cpp_17)
+        )
+
     def get_checker_compile_target(self):
         from problem.compilation import CheckerCompilationTarget
         return CheckerCompilationTarget(self)
 
 
+@dataclass
+class InteractorMixin:
+    interactor_compiler: 'Compiler' = None
+    interactor_compile_args: list[str] = field(default_factory=list)
+    interactor_path: str | None = None
+
+    def get_interactor_compile_target(self):
+        from problem.compilation import InteractorCompilationTarget
+        return InteractorCompilationTarget(self)
+
+
 @dataclass
 class SummaryMixin:
     summary_type: SummaryType = None
@@ -0,0 +1,185 @@
+"""
+Sandbox backends behind ChallengeBox.spawn_sandbox.
+
+A backend starts a run for SandboxParams and returns a Popen-like handle (poll,
+send_signal, communicate) whose stdout is the result JSON of the Go sandbox, so
+SandboxProcess parses every backend the same way.
+
+"go" runs the real sandbox binary. "simulated" never runs code: it draws results from
+the SIM_* distributions in config.py and takes scaled wall clock time, so the
+scheduler, DAG and reporting paths can be load tested without cgroups or root.
+"""
+import json
+import math
+import os
+import random
+import signal
+import stat
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Protocol
+
+import config
+
+# NOTE: Same values as models.SandboxStatus, models imports sandbox.sandbox which imports this module
+STATUS_NORMAL = 1
+STATUS_TLE = 2
+STATUS_MLE = 3
+STATUS_NONZERO_EXIT = 7
+STATUS_SIGNALLED = 6
+STATUS_RUNNER_ERROR = 8
+SIM_STATUSES = {
+    "Normal": STATUS_NORMAL,
+    "TimeLimitExceeded": STATUS_TLE,
+    "MemoryLimitExceeded": STATUS_MLE,
+    "NonzeroExitStatus": STATUS_NONZERO_EXIT,
+    "Signalled": STATUS_SIGNALLED,
+}
+
+
+class SandboxHandle(Protocol):
+    stdin: None
+
+    def poll(self) -> int | None: ...
+
+    def send_signal(self, sig: int): ...
+
+    def communicate(self) -> tuple[bytes, None]: ...
+
+
+class SandboxBackend(ABC):
+    # NOTE: Whether the program really reads / writes FIFOs and inherited fds, the
+    # stream checker and the checker host need this
+    supports_pipes: bool = True
+    # NOTE: Whether results are measured from a real program, startup calibration
+    # is pointless otherwise
+    runs_programs: bool = True
+
+    @abstractmethod
+    def spawn(self, params: "SandboxParams") -> SandboxHandle:
+        pass
+
+
+backends: dict[str, type[SandboxBackend]] = {}
+
+
+def register_backend(name: str):
+    def decorator(cls: type[SandboxBackend]):
+        backends[name] = cls
+        return cls
+    return decorator
+
+
+@register_backend("go")
+class GoSandboxBackend(SandboxBackend):
+    def spawn(self, params: "SandboxParams") -> SandboxHandle:
+        return subprocess.Popen(
+            ["./sandbox/sandbox"] + params.to_flags(),
+            stdout=subprocess.PIPE,
+            pass_fds=params.inherited_fds(),
+        )
+
+
+class SimulatedProcess:
+    """
+    A run that ends after a precomputed wall clock duration, or on SIGINT like the
+    Go sandbox (RunnerError).
+    """
+    stdin = None
+
+    def __init__(self, result: dict, wall_time: float):
+        self.result = result
+        self.deadline = time.monotonic() + wall_time
+        self.killed = threading.Event()
+        self.returncode: int | None = None
+
+    def poll(self) -> int | None:
+        if self.returncode is None and (self.killed.is_set() or time.monotonic() >= self.deadline):
+            self.returncode = 0
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if sig == signal.SIGINT:
+            self.killed.set()
+
+    def communicate(self) -> tuple[bytes, None]:
+        self.killed.wait(max(self.deadline - time.monotonic(), 0))
+        self.returncode = 0
+        result = self.result
+        if self.killed.is_set():
+            result = dict(result, status=STATUS_RUNNER_ERROR)
+        return json.dumps(result).encode(), None
+
+
+@register_backend("simulated")
+class SimulatedSandboxBackend(SandboxBackend):
+    supports_pipes = False
+    runs_programs = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.SIM_SEED)
+        weights = config.SIM_STATUS_WEIGHTS
+        self.statuses = [SIM_STATUSES[name] for name in weights]
+        self.weights = list(weights.values())
+
+    def draw(self, params: "SandboxParams") -> dict:
+        """
+        Result of one run. Compile runs (they copy files out) only fail with
+        SIM_COMPILE_ERROR_RATE.
+        """
+        time_median, time_sigma = config.SIM_TIME_FRACTION
+        memory_median, memory_sigma = config.SIM_MEMORY_FRACTION
+        time_limit = params.time_limit * 10**6
+        memory_limit = params.memory_limit * 1024
+        with self.lock:
+            if params.copy_out_cache_files:
+                status = STATUS_NONZERO_EXIT if self.rng.random() < config.SIM_COMPILE_ERROR_RATE else STATUS_NORMAL
+            else:
+                status = self.rng.choices(self.statuses, self.weights)[0]
+            cpu_time = int(time_limit * time_median * math.exp(self.rng.gauss(0, time_sigma)))
+            memory = int(memory_limit * memory_median * math.exp(self.rng.gauss(0, memory_sigma)))
+            exit_status = self.rng.choice((1, 11)) if status in (STATUS_NONZERO_EXIT, STATUS_SIGNALLED) else 0
+
+        # NOTE: Limits are honoured, a run stops at its time limit like the real sandbox
+        if status == STATUS_TLE:
+            cpu_time = time_limit
+        else:
+            cpu_time = min(cpu_time, time_limit - 1)
+        if status == STATUS_MLE:
+            memory = memory_limit
+        else:
+            memory = min(memory, memory_limit - 1)
+        return {
+            "status": status,
+            "exitStatus": exit_status,
+            "error": "",
+            "time": cpu_time,
+            "runTime": cpu_time,
+            "memory": memory,
+            "procPeak": 1,
+        }
+
+    def spawn(self, params: "SandboxParams") -> SandboxHandle:
+        result = self.draw(params)
+        # NOTE: Tasks read these files after the run, create them empty
+        for path in (params.stdout, params.stderr):
+            if path and not (os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode)):
+                open(path, "wb").close()
+        for name in params.copy_out_cache_files:
+            open(os.path.join(params.workdir, name), "wb").close()
+        return SimulatedProcess(result, result["runTime"] / 10**9 * config.SIM_TIME_SCALE)
+
+
+backend: SandboxBackend | None = None
+backend_lock = threading.Lock()
+
+
+def get_backend() -> SandboxBackend:
+    global backend
+    with backend_lock:
+        if backend is None:
+            backend = backends[config.SANDBOX_BACKEND]()
+        return backend
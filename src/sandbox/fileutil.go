@@ -1,6 +1,9 @@
 package main
 
-import "os"
+import (
+	"fmt"
+	"os"
+)
 
 // prepareFile opens file for new process
 func prepareFiles(inputFile, outputFile, errorFile string) ([]*os.File, error) {
@@ -13,13 +16,13 @@ func prepareFiles(inputFile, outputFile, errorFile string) ([]*os.File, error) {
 		}
 	}
 	if outputFile != "" {
-		files[1], err = os.OpenFile(outputFile, os.O_WRONLY|os.O_TRUNC|os.O_CREATE, 0o755)
+		files[1], err = openOutputFile(outputFile)
 		if err != nil {
 			goto openerror
 		}
 	}
 	if errorFile != "" {
-		files[2], err = os.OpenFile(errorFile, os.O_WRONLY|os.O_TRUNC|os.O_CREATE, 0o755)
+		files[2], err = openOutputFile(errorFile)
 		if err != nil {
 			goto openerror
 		}
@@ -30,6 +33,29 @@ openerror:
 	return nil, err
 }
 
+// openOutputFile opens output file, a named pipe is opened as is so the judge can
+// read the output while the program runs
+func openOutputFile(name string) (*os.File, error) {
+	if fi, err := os.Stat(name); err == nil && fi.Mode()&os.ModeNamedPipe != 0 {
+		return os.OpenFile(name, os.O_WRONLY, 0)
+	}
+	return os.OpenFile(name, os.O_WRONLY|os.O_TRUNC|os.O_CREATE, 0o755)
+}
+
+// inheritFiles replaces files with descriptors inherited from the judge (e.g. the
+// FIFO pair of an interactive problem, already opened by the judge)
+func inheritFiles(files []*os.File, fds ...int) {
+	for i, fd := range fds {
+		if fd < 0 {
+			continue
+		}
+		if files[i] != nil {
+			files[i].Close()
+		}
+		files[i] = os.NewFile(uintptr(fd), fmt.Sprintf("fd%d", fd))
+	}
+}
+
 // closeFiles close all file in the list
 func closeFiles(files []*os.File) {
 	for _, f := range files {
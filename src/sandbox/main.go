@@ -135,11 +135,11 @@ var (
 var (
 	addBindPath, addMaskPath, addAllowSyscall, addKillSyscall, addEnv                                                 arrayFlags
 	stdinFile, stdoutFile, stderrFile, workPath, cpuSet                                                               string
-	timeLimit, realTimeLimit, memoryLimit, vssMemoryLimit, outputLimit, openFileLimit, stackLimit, procLimit, cpuRate uint64
+	timeLimit, realTimeLimit, idleLimit, memoryLimit, vssMemoryLimit, outputLimit, openFileLimit, stackLimit, procLimit, cpuRate uint64
 
 	allowMountProc, allowMountProcRW, allowProc, redirOutputToNull, enableSeccomp, showDetails bool
 	args                                                                     []string
-	// stdinFd, stdoutFd, stderrFd                                                                                       uint64
+	stdinFd, stdoutFd, stderrFd                                              int
 )
 
 func printUsage() {
@@ -158,9 +158,9 @@ func main() {
 	flag.StringVar(&stdinFile, "stdin", "", "Set stdin file name")
 	flag.StringVar(&stdoutFile, "stdout", "", "Set stdout file name")
 	flag.StringVar(&stderrFile, "stderr", "", "Set stderr file name")
-	// flag.StringVar(&stdinFd, "stdin-fd", "", "Set stdin file descriptor")
-	// flag.StringVar(&stdoutFd, "stdout-fd", "", "Set stdout file descriptor")
-	// flag.StringVar(&stderrFd, "stderr-fd", "", "Set stderr file descriptor")
+	flag.IntVar(&stdinFd, "stdin-fd", -1, "Set stdin file descriptor (inherited, overrides --stdin)")
+	flag.IntVar(&stdoutFd, "stdout-fd", -1, "Set stdout file descriptor (inherited, overrides --stdout)")
+	flag.IntVar(&stderrFd, "stderr-fd", -1, "Set stderr file descriptor (inherited, overrides --stderr)")
 	flag.StringVar(&cpuSet, "cpuset", "", "Set cpu set")
 	flag.StringVar(&workPath, "workpath", "", "Set the work path of the program")
 	flag.BoolVar(&allowProc, "allow-proc", false, "Allow fork, exec... etc.")
@@ -171,6 +171,7 @@ func main() {
 	flag.BoolVar(&showDetails, "show-trace-details", false, "Show trace details")
 	flag.Uint64Var(&timeLimit, "time-limit", 1000, "Set time limit (in millisecond)")
 	flag.Uint64Var(&realTimeLimit, "realtime-limit", 0, "Set real time limit (in millisecond)")
+	flag.Uint64Var(&idleLimit, "idle-limit", 0, "Stop the program when it uses no cpu time for this long (in millisecond, 0 to disable)")
 	flag.Uint64Var(&memoryLimit, "memory-limit", 262144, "Set memory limit (in kib)")
 	flag.Uint64Var(&outputLimit, "output-limit", 262144, "Set output limit (in kib)")
 	flag.Uint64Var(&openFileLimit, "open-file-limit", 256, "Set open file times limit")
@@ -195,11 +196,11 @@ func main() {
 		stackLimit = memoryLimit
 	}
 	if redirOutputToNull {
-		if stderrFile == "" {
+		if stderrFile == "" && stderrFd < 0 {
 			stderrFile = "/dev/null"
 		}
 
-		if stdoutFile == "" {
+		if stdoutFile == "" && stdoutFd < 0 {
 			stdoutFile = "/dev/null"
 		}
 	}
@@ -220,6 +221,8 @@ func main() {
 		RunTime    uint64 `json:"runTime"`
 		Memory     uint64 `json:"memory"`
 		ProcPeak   uint64 `json:"procPeak"`
+		Timeout    string `json:"timeout"`
+		telemetry
 	}{
 		Status:     int(rt.Status),
 		ExitStatus: rt.ExitStatus,
@@ -228,6 +231,8 @@ func main() {
 		RunTime:    uint64(rt.RunningTime),
 		Memory:     rt.Memory.Byte(),
 		ProcPeak:   rt.ProcPeak,
+		Timeout:    timeoutReason,
+		telemetry:  runTelemetry,
 	})
 	if err != nil {
 		fmt.Fprintf(os.Stdout, "failed to output result: %v", err)
@@ -235,6 +240,54 @@ func main() {
 	fmt.Fprintf(os.Stdout, "%v", string(b))
 }
 
+// why the run was stopped before the program exited, reported as "timeout"
+const (
+	timeoutWall = "wall"
+	timeoutIdle = "idle"
+)
+
+var timeoutReason string
+
+// filled by start once the program exited
+var (
+	runTelemetry telemetry
+	processStart = time.Now()
+)
+
+const (
+	idleCheckInterval = 100 * time.Millisecond
+	// cpu time below this per idle window counts as no progress (timers, wakeups)
+	idleMinProgress = time.Millisecond
+)
+
+// watchIdle calls stop when the cgroup cpu usage grows by less than idleMinProgress
+// within the idle limit, e.g. the program sleeps or blocks on a pipe
+func watchIdle(c context.Context, cg cgroup.Cgroup, limit time.Duration, stop func()) {
+	ticker := time.NewTicker(idleCheckInterval)
+	defer ticker.Stop()
+
+	var progress uint64
+	progressTime := time.Now()
+	for {
+		select {
+		case <-c.Done():
+			return
+		case now := <-ticker.C:
+			cpu, err := cg.CPUUsage()
+			if err != nil {
+				return
+			}
+			if time.Duration(cpu-progress) >= idleMinProgress {
+				progress = cpu
+				progressTime = now
+			} else if now.Sub(progressTime) >= limit {
+				stop()
+				return
+			}
+		}
+	}
+}
+
 type ss string
 
 func (s *ss) Scan(state fmt.ScanState, verb rune) error {
@@ -368,6 +421,7 @@ func start() (*runner.Result, error) {
 	if err != nil {
 		return nil, fmt.Errorf("failed to prepare files: %w", err)
 	}
+	inheritFiles(files, stdinFd, stdoutFd, stderrFd)
 	defer closeFiles(files)
 	// if not defined, then use the original value
 	fds := make([]uintptr, len(files))
@@ -459,13 +513,26 @@ func start() (*runner.Result, error) {
 	}()
 	rTime := time.Now()
 
+	idle := make(chan struct{})
+	if idleLimit > 0 && idleLimit < realTimeLimit {
+		go watchIdle(c, cg, time.Duration(idleLimit)*time.Millisecond, func() { close(idle) })
+	}
+
 	select {
 	case <-sig:
 		cancel()
 		rt = <-s
 		rt.Status = runner.StatusRunnerError
 
+	case <-idle:
+		cancel()
+		rt = <-s
+		timeoutReason = timeoutIdle
+
 	case rt = <-s:
+		if errors.Is(c.Err(), context.DeadlineExceeded) {
+			timeoutReason = timeoutWall
+		}
 	}
 	eTime := time.Now()
 
@@ -474,6 +541,8 @@ func start() (*runner.Result, error) {
 		rt.RunningTime = eTime.Sub(rTime)
 	}
 
+	runTelemetry = collectTelemetry(cgDir.Name(), rt.SetUpTime, processStart)
+
 	cpu, err := cg.CPUUsage()
 	if err != nil {
 		return nil, fmt.Errorf("cgroup cpu: %v", err)
@@ -513,13 +582,19 @@ func start() (*runner.Result, error) {
 		rt.Status = runner.StatusMemoryLimitExceeded
 	}
 
-	if rt.Status == runner.StatusNormal && rt.ExitStatus != 0 && rt.RunningTime > time.Duration(realTimeLimit) {
+	// the program was killed by the wall clock or the idle watchdog, not by itself
+	if timeoutReason != "" && rt.Status != runner.StatusRunnerError && rt.Status != runner.StatusMemoryLimitExceeded {
+		rt.Status = runner.StatusTimeLimitExceeded
+	}
+
+	realTime := time.Duration(realTimeLimit) * time.Millisecond
+	if rt.Status == runner.StatusNormal && rt.ExitStatus != 0 && rt.RunningTime > realTime {
 		rt.Status = runner.StatusTimeLimitExceeded
 	}
 
 	// Fix TLE due to context cancel, from go-judge
 	if rt.Status == runner.StatusNormal && rt.ExitStatus != 0 &&
-		rt.Time < time.Duration(timeLimit) && rt.RunningTime < time.Duration(realTimeLimit) {
+		rt.Time < limit.TimeLimit && rt.RunningTime < realTime {
 		rt.Status = runner.StatusSignalled
 	}
 	return &rt, nil
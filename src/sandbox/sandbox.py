@@ -1,12 +1,20 @@
 import os
+import queue
 import shutil
+import signal
 import subprocess
+import threading
+import time
 from dataclasses import dataclass, field
 import select
 import json
 import uuid
 
+import config
 import utils
+from utils import metrics
+from utils.trace import tracer
+from sandbox.backend import SandboxHandle, get_backend
 
 
 # From CMS
@@ -66,6 +74,20 @@ class SandboxResult:
     run_time: int
     memory: int
     proc_peak: int
+    timeout: str = ""  # "wall" or "idle" when the watchdog stopped the program
+    # NOTE: Telemetry, zero when the sandbox or cgroup version does not report it
+    memory_peak: int = 0  # cgroup memory.peak, byte
+    max_rss: int = 0  # byte
+    minor_faults: int = 0
+    major_faults: int = 0
+    voluntary_ctx_switches: int = 0
+    involuntary_ctx_switches: int = 0
+    throttled_time: int = 0  # ns
+    io_read_bytes: int = 0
+    io_write_bytes: int = 0
+    setup_time: int = 0  # ns, fork to exec
+    sandbox_time: int = 0  # ns, sandbox process start to result
+    judge_time: int = 0  # ns, spawn to result parsed, measured by the judge
 
     @staticmethod
     def from_dict(d: dict) -> "SandboxResult":
@@ -77,6 +99,18 @@ class SandboxResult:
             run_time=d.get("runTime", 0),
             memory=d.get("memory", 0),
             proc_peak=d.get("procPeak", 0),
+            timeout=d.get("timeout", ""),
+            memory_peak=d.get("memoryPeak", 0),
+            max_rss=d.get("maxRss", 0),
+            minor_faults=d.get("minorFaults", 0),
+            major_faults=d.get("majorFaults", 0),
+            voluntary_ctx_switches=d.get("voluntaryCtxSwitch", 0),
+            involuntary_ctx_switches=d.get("involuntaryCtxSwitch", 0),
+            throttled_time=d.get("throttledTime", 0),
+            io_read_bytes=d.get("ioReadBytes", 0),
+            io_write_bytes=d.get("ioWriteBytes", 0),
+            setup_time=d.get("setUpTime", 0),
+            sandbox_time=d.get("sandboxTime", 0),
         )
 
 
@@ -86,6 +120,8 @@ class SandboxParams:
     args: list[str] = field(default_factory=list)
     workdir: str = ""  # 建議由 ChallengeBox 設定
     time_limit: int = 1000 # ms
+    realtime_limit: int = 0 # ms, 0 means derived from time_limit
+    idle_limit: int = 0 # ms, 0 disables the idle watchdog
     memory_limit: int = 262144 # kib
     stack_limit: int = 65536 # kib
     vss_memory_limit: int = 0 # kib
@@ -95,6 +131,8 @@ class SandboxParams:
     stdin: str | None = None
     stdout: str | None = None
     stderr: str | None = None
+    stdin_fd: int | None = None  # inherited by the sandbox and closed in the judge once started
+    stdout_fd: int | None = None
     extra_env: list[str] = field(default_factory=list)
     allow_proc: bool = False
     allow_mount_proc: bool = False
@@ -116,6 +154,19 @@ class SandboxParams:
         self.time_limit = time_limit
         return self
 
+    def set_realtime_limit(self, realtime_limit: int):
+        self.realtime_limit = realtime_limit
+        return self
+
+    def set_idle_limit(self, idle_limit: int):
+        self.idle_limit = idle_limit
+        return self
+
+    def get_realtime_limit(self) -> int:
+        if self.realtime_limit:
+            return self.realtime_limit
+        return self.time_limit * config.REALTIME_LIMIT_FACTOR + config.REALTIME_LIMIT_GRACE
+
     def set_memory_limit(self, memory_limit: int):
         self.memory_limit = memory_limit
         return self
@@ -152,6 +203,22 @@ class SandboxParams:
         self.stderr = stderr
         return self
 
+    def set_stdin_fd(self, fd: int):
+        self.stdin_fd = fd
+        return self
+
+    def set_stdout_fd(self, fd: int):
+        self.stdout_fd = fd
+        return self
+
+    def inherited_fds(self) -> list[int]:
+        return [fd for fd in (self.stdin_fd, self.stdout_fd) if fd is not None]
+
+    def close_inherited_fds(self):
+        for fd in self.inherited_fds():
+            os.close(fd)
+        self.stdin_fd = self.stdout_fd = None
+
     def add_env(self, env: str):
         self.extra_env.append(env)
         return self
@@ -192,6 +259,7 @@ class SandboxParams:
         flags = [
             "--workpath", self.workdir,
             "--time-limit", str(self.time_limit),
+            "--realtime-limit", str(self.get_realtime_limit()),
             "--memory-limit", str(self.memory_limit),
             "--stack-limit", str(self.stack_limit),
             "--proc-limit", str(self.proc_limit),
@@ -202,12 +270,18 @@ class SandboxParams:
         ]
         if __debug__:
             flags.append("--show-trace-details")
+        if self.idle_limit:
+            flags += ["--idle-limit", str(self.idle_limit)]
         if self.stdin:
             flags += ["--stdin", self.stdin]
         if self.stdout:
             flags += ["--stdout", self.stdout]
         if self.stderr:
             flags += ["--stderr", self.stderr]
+        if self.stdin_fd is not None:
+            flags += ["--stdin-fd", str(self.stdin_fd)]
+        if self.stdout_fd is not None:
+            flags += ["--stdout-fd", str(self.stdout_fd)]
         if self.allow_proc:
             flags += ["--allow-proc"]
         if self.allow_mount_proc:
@@ -226,24 +300,216 @@ class SandboxParams:
         return flags
 
 
+class WatchdogStats:
+    """
+    Runs stopped by the wall clock limit or the idle watchdog. A run stopped as idle
+    gives back the rest of its wall clock limit, counted as reclaimed slot time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wall_timeouts = 0
+        self.idle_timeouts = 0
+        self.reclaimed_time = 0  # ns
+
+    def record(self, params: SandboxParams, result: SandboxResult):
+        if not result.timeout:
+            return
+
+        with self.lock:
+            if result.timeout == "idle":
+                self.idle_timeouts += 1
+                self.reclaimed_time += max(params.get_realtime_limit() * 10**6 - result.run_time, 0)
+            else:
+                self.wall_timeouts += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "wall_timeouts": self.wall_timeouts,
+                "idle_timeouts": self.idle_timeouts,
+                "reclaimed_slot_time": self.reclaimed_time,
+            }
+
+
+watchdog_stats = WatchdogStats()
+
+
+class SandboxReaper:
+    """
+    Remove trashed box roots and workdirs on a background thread, so the heavy
+    rmtree is off the task's critical path.
+    """
+    def __init__(self):
+        self.queue: queue.Queue[str] = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name="sandbox-reaper", daemon=True)
+                self.thread.start()
+
+    def loop(self):
+        while True:
+            path = self.queue.get()
+            shutil.rmtree(path, ignore_errors=True)
+
+    def discard(self, path: str):
+        """
+        Move path into the trash folder (a cheap rename on the same filesystem)
+        and let the reaper remove it later.
+        """
+        trash_folder = os.path.join(config.SANDBOX_ROOT, "trash")
+        os.makedirs(trash_folder, exist_ok=True)
+        trash_path = os.path.join(trash_folder, uuid.uuid4().hex)
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            trash_path = path
+
+        self.start()
+        self.queue.put(trash_path)
+
+
+reaper = SandboxReaper()
+
+
+class WorkdirPool:
+    """
+    Pre-created sandbox workdirs that are reset in place and reused between runs.
+    """
+    # NOTE: Workdirs with more entries than this are trashed instead of reset
+    RESET_MAX_ENTRIES = 32
+
+    def __init__(self, root: str, size: int):
+        self.root = root
+        self.size = size
+        self.free: list[str] = []
+        self.lock = threading.Lock()
+        self.created = 0
+        os.makedirs(self.root, exist_ok=True)
+        for _ in range(size):
+            self.free.append(self.create())
+
+    def create(self) -> str:
+        with self.lock:
+            self.created += 1
+            path = os.path.join(self.root, f"w{self.created}")
+        os.mkdir(path)
+        return path
+
+    def acquire(self) -> str:
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return self.create()
+
+    def release(self, workdir: str):
+        if not self.reset(workdir):
+            reaper.discard(workdir)
+            workdir = self.create()
+
+        with self.lock:
+            if len(self.free) < self.size:
+                self.free.append(workdir)
+                return
+        reaper.discard(workdir)
+
+    def reset(self, workdir: str) -> bool:
+        try:
+            with os.scandir(workdir) as it:
+                entries = list(it)
+            if len(entries) > self.RESET_MAX_ENTRIES:
+                return False
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    return False
+                os.unlink(entry.path)
+        except OSError:
+            return False
+        return True
+
+
+workdir_pool: WorkdirPool | None = None
+workdir_pool_lock = threading.Lock()
+
+
+def get_workdir_pool() -> WorkdirPool:
+    global workdir_pool
+    with workdir_pool_lock:
+        if workdir_pool is None:
+            workdir_pool = WorkdirPool(
+                os.path.join(config.SANDBOX_ROOT, "workdirs"),
+                config.SANDBOX_WORKDIR_POOL_SIZE,
+            )
+        return workdir_pool
+
+
 class ChallengeBox:
-    def __init__(self, base_tmp_path: str, id: int):
+    """
+    Folders of a challenge. They are created by allocate() when the challenge's first
+    task starts, not when the challenge is built.
+    """
+    def __init__(self, base_tmp_path: str, id: int | str):
         self.root = os.path.join(base_tmp_path, str(id))
         self.fifo_folder = os.path.join(self.root, "fifo")
         self.file_folder = os.path.join(self.root, "file")
-        os.mkdir(self.root)
-        os.mkdir(self.file_folder)
-        os.mkdir(self.fifo_folder)
+        self.allocated = False
+        self.cleaned = False
+        self.lock = threading.Lock()
+
+    def allocate(self):
+        if self.allocated:
+            return
+
+        with self.lock:
+            if self.allocated:
+                return
+            assert not self.cleaned, "Box already cleaned"
+            os.mkdir(self.root)
+            os.mkdir(self.file_folder)
+            os.mkdir(self.fifo_folder)
+            self.allocated = True
 
     def mkdir(self, path: str):
+        self.allocate()
         os.mkdir(os.path.join(self.root, path))
 
     def mkfifo(self, name: str):
+        self.allocate()
         os.mkfifo(os.path.join(self.fifo_folder, name))
 
+    def open_fifo_pipe(self, name: str) -> tuple[int, int]:
+        """
+        Create a FIFO in the box and open both ends, returns (read_fd, write_fd).
+        The ends are handed to sandboxes with SandboxParams.stdin_fd / stdout_fd, so
+        neither sandbox blocks in open() waiting for the other.
+        """
+        self.mkfifo(name)
+        path = self.gen_fifopath(name)
+        # NOTE: A non-blocking read open succeeds without a writer, then the write open
+        # succeeds because a reader exists
+        read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            write_fd = os.open(path, os.O_WRONLY)
+        except OSError:
+            os.close(read_fd)
+            raise
+        os.set_blocking(read_fd, True)
+        return read_fd, write_fd
+
     def gen_filepath(self, name: str) -> str:
         return os.path.join(self.file_folder, name)
 
+    def write_file(self, name: str, data: bytes) -> str:
+        self.allocate()
+        path = self.gen_filepath(name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
     def gen_fifopath(self, name: str) -> str:
         return os.path.join(self.fifo_folder, name)
 
@@ -270,48 +536,110 @@ class ChallengeBox:
             os.remove(path)
 
     def cleanup(self):
-        for fifo in os.listdir(self.fifo_folder):
-            os.remove(os.path.join(self.fifo_folder, fifo))
-        shutil.rmtree(self.root)
+        with self.lock:
+            if self.cleaned:
+                return
+            self.cleaned = True
+            if not self.allocated:
+                return
+
+        reaper.discard(self.root)
 
-    def __alloc_workdir(self, tag: str) -> str:
-        assert tag, "Must provide a tag to alloc workdir"
-        workdir = os.path.join(self.root, f"sandbox_{tag}")
-        assert not os.path.exists(workdir), "Workdir already exists"
-        os.makedirs(workdir)
-        return workdir
+    def __alloc_workdir(self) -> str:
+        return get_workdir_pool().acquire()
+
+    def spawn_sandbox(self, params: SandboxParams) -> "SandboxProcess":
+        """
+        Start a sandbox without waiting for it, used when the caller consumes the
+        program output while it runs.
+        """
+        self.allocate()
+        params.workdir = self.__alloc_workdir()
+        proc = get_backend().spawn(params)
+        if proc.stdin:
+            proc.stdin.close()
+        return SandboxProcess(self, params, proc)
 
     def run_sandbox(self, params_list: list[SandboxParams]) -> list[SandboxResult]:
-        # TODO: copy out
-        # TODO: wait multiple processes
-        procs: list[tuple[subprocess.Popen, SandboxParams]] = []
+        # NOTE: All sandboxes run concurrently, e.g. the user program and the interactor
+        procs = []
+        try:
+            for params in params_list:
+                procs.append(self.spawn_sandbox(params))
+        except Exception:
+            for params in params_list:
+                params.close_inherited_fds()
+            for proc in procs:
+                proc.kill()
+                proc.wait()
+            raise
+
+        # NOTE: The judge must not keep pipe ends open, otherwise a reader never sees EOF
         for params in params_list:
-            params.workdir = self.__alloc_workdir(tag=str(uuid.uuid4()))
-            proc = subprocess.Popen(
-                ["./sandbox/sandbox"] + params.to_flags(),
-                stdout=subprocess.PIPE,
-            )
-            if proc.stdin:
-                proc.stdin.close()
-            procs.append((proc, params))
+            params.close_inherited_fds()
+        return [proc.wait() for proc in procs]
+
 
-        for proc in procs:
-            proc[0].wait()
+class SandboxProcess:
+    """
+    A running sandbox started by ChallengeBox.spawn_sandbox.
+    """
+    def __init__(self, box: ChallengeBox, params: SandboxParams, proc: SandboxHandle):
+        self.box = box
+        self.params = params
+        self.proc = proc
+        self.result: SandboxResult | None = None
+        self.spawned_at = time.monotonic_ns()
 
-        results = []
-        for proc, params in procs:
-            stdout_data = proc.stdout.read().decode("utf-8").strip()
+    def poll(self) -> int | None:
+        return self.proc.poll()
+
+    def kill(self):
+        """
+        Ask the sandbox to stop the program. The sandbox handles SIGINT by killing the
+        program and still reports its result.
+        """
+        if self.proc.poll() is None:
             try:
-                result_dict = json.loads(stdout_data)
-                result = SandboxResult.from_dict(result_dict)
-            except Exception:
-                utils.logger.error(f"Sandbox parse error: {stdout_data}")
-                result = SandboxResult(8, 0, "parse error", 0, 0, 0, 0)
-            results.append(result)
-            for fname in params.copy_out_cache_files:
-                src_path = os.path.join(params.workdir, fname)
-                dst_path = os.path.join(self.file_folder, fname)
-                if os.path.isfile(src_path):
-                    os.rename(src_path, dst_path)
-            shutil.rmtree(params.workdir, ignore_errors=True)
-        return results
+                self.proc.send_signal(signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    def wait(self) -> SandboxResult:
+        if self.result is not None:
+            return self.result
+
+        stdout_data = self.proc.communicate()[0].decode("utf-8").strip()
+        try:
+            result_dict = json.loads(stdout_data)
+            result = SandboxResult.from_dict(result_dict)
+        except Exception:
+            utils.logger.error(f"Sandbox parse error: {stdout_data}")
+            result = SandboxResult(8, 0, "parse error", 0, 0, 0, 0)
+        result.judge_time = time.monotonic_ns() - self.spawned_at
+        metrics.sandbox_overhead.observe_ns(max(result.judge_time - result.run_time, 0))
+        self.trace(result)
+        watchdog_stats.record(self.params, result)
+
+        for fname in self.params.copy_out_cache_files:
+            src_path = os.path.join(self.params.workdir, fname)
+            dst_path = os.path.join(self.box.file_folder, fname)
+            if os.path.isfile(src_path):
+                os.rename(src_path, dst_path)
+        get_workdir_pool().release(self.params.workdir)
+        self.result = result
+        return result
+
+    def trace(self, result: SandboxResult):
+        end = self.spawned_at + result.judge_time
+        tracer.span("sandbox", "sandbox", self.spawned_at, end, args={
+            "exe": self.params.exe_path,
+            "status": result.status,
+            "sandbox_time": result.sandbox_time,
+        })
+        # NOTE: The sandbox reports durations only, the program is placed right before
+        # the result and its exec setup right before the program
+        program_start = max(end - result.run_time, self.spawned_at)
+        setup_start = max(program_start - result.setup_time, self.spawned_at)
+        tracer.span("exec setup", "sandbox", setup_start, program_start)
+        tracer.span("program", "sandbox", program_start, end, args={"time": result.time})
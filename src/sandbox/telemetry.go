@@ -0,0 +1,103 @@
+package main
+
+import (
+	"bufio"
+	"os"
+	"path/filepath"
+	"strconv"
+	"strings"
+	"syscall"
+	"time"
+)
+
+// telemetry is the resource usage of a run beyond the limits, for capacity planning
+type telemetry struct {
+	MemoryPeak           uint64 `json:"memoryPeak"`           // cgroup memory.peak, bytes
+	MaxRss               uint64 `json:"maxRss"`               // bytes
+	MinorFaults          uint64 `json:"minorFaults"`          // page faults without I/O
+	MajorFaults          uint64 `json:"majorFaults"`          // page faults with I/O
+	VoluntaryCtxSwitch   uint64 `json:"voluntaryCtxSwitch"`   // blocked / slept
+	InvoluntaryCtxSwitch uint64 `json:"involuntaryCtxSwitch"` // preempted
+	ThrottledTime        uint64 `json:"throttledTime"`        // cgroup cpu.stat, ns
+	IoReadBytes          uint64 `json:"ioReadBytes"`          // cgroup io.stat
+	IoWriteBytes         uint64 `json:"ioWriteBytes"`
+	SetUpTime            uint64 `json:"setUpTime"`   // fork to exec, ns
+	SandboxTime          uint64 `json:"sandboxTime"` // sandbox start to result, ns
+}
+
+// readKeyValues parses "key value" lines of a cgroup v2 file, e.g. cpu.stat
+func readKeyValues(path string) map[string]uint64 {
+	values := make(map[string]uint64)
+	f, err := os.Open(path)
+	if err != nil {
+		return values
+	}
+	defer f.Close()
+
+	scanner := bufio.NewScanner(f)
+	for scanner.Scan() {
+		fields := strings.Fields(scanner.Text())
+		if len(fields) == 2 {
+			if v, err := strconv.ParseUint(fields[1], 10, 64); err == nil {
+				values[fields[0]] = v
+			}
+		}
+	}
+	return values
+}
+
+// readIOStat sums rbytes / wbytes over the devices in io.stat
+func readIOStat(path string) (read, write uint64) {
+	f, err := os.Open(path)
+	if err != nil {
+		return
+	}
+	defer f.Close()
+
+	scanner := bufio.NewScanner(f)
+	for scanner.Scan() {
+		for _, field := range strings.Fields(scanner.Text()) {
+			key, value, ok := strings.Cut(field, "=")
+			if !ok {
+				continue
+			}
+			v, err := strconv.ParseUint(value, 10, 64)
+			if err != nil {
+				continue
+			}
+			switch key {
+			case "rbytes":
+				read += v
+			case "wbytes":
+				write += v
+			}
+		}
+	}
+	return
+}
+
+// collectTelemetry reads cgroup v2 stat files (missing files on cgroup v1 leave zeros)
+// and the rusage of the program, the only child of the sandbox
+func collectTelemetry(cgPath string, setUpTime time.Duration, startTime time.Time) telemetry {
+	var t telemetry
+	if v, ok := readKeyValues(filepath.Join(cgPath, "cpu.stat"))["throttled_usec"]; ok {
+		t.ThrottledTime = v * uint64(time.Microsecond)
+	}
+	if b, err := os.ReadFile(filepath.Join(cgPath, "memory.peak")); err == nil {
+		t.MemoryPeak, _ = strconv.ParseUint(strings.TrimSpace(string(b)), 10, 64)
+	}
+	t.IoReadBytes, t.IoWriteBytes = readIOStat(filepath.Join(cgPath, "io.stat"))
+
+	var ru syscall.Rusage
+	if err := syscall.Getrusage(syscall.RUSAGE_CHILDREN, &ru); err == nil {
+		t.MaxRss = uint64(ru.Maxrss) << 10
+		t.MinorFaults = uint64(ru.Minflt)
+		t.MajorFaults = uint64(ru.Majflt)
+		t.VoluntaryCtxSwitch = uint64(ru.Nvcsw)
+		t.InvoluntaryCtxSwitch = uint64(ru.Nivcsw)
+	}
+
+	t.SetUpTime = uint64(setUpTime)
+	t.SandboxTime = uint64(time.Since(startTime))
+	return t
+}
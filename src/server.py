@@ -9,11 +9,23 @@ import os
 import signal
 import shlex
 import atexit
+import hmac
 import threading
 from multiprocessing.dummy import Pool as ThreadingPool
 from queue import PriorityQueue, Queue
-
-from utils.challenge_builder import parse_base_challenge_info, parse_testdatas_and_subtasks
+from typing import Callable
+
+from utils.challenge_builder import parse_base_challenge_info, parse_testdatas_and_subtasks, validate_challenge_message
+from utils.manifest import get_manifest
+from utils import cas
+from utils.lifecycle import ChallengeTracker, SlotTracker
+from utils.telemetry import telemetry
+from utils import metrics
+from utils.trace import tracer
+from utils.recorder import recorder
+from utils import profiler
+from utils import offload
+from utils import eta
 
 import importlib
 import pkgutil
@@ -29,37 +41,72 @@ import config
 import utils
 from models import *
 from lang.base import init_langs
+from sandbox.sandbox import get_workdir_pool
+from lang import calibration
+from ingest import IngestPipeline
+from shard import FRAME_ANSWER, ShardConnection, ShardReporter, ShardRouter
+from outbox import parse_ack
+from backends import BackendRegistry, parse_subscribe
 
 server_running = True
 ioloop = tornado.ioloop.IOLoop.current()
-challenge_list: dict[int, Challenge] = {}
+challenge_tracker = ChallengeTracker()
+slot_tracker = SlotTracker()
+challenge_list: dict[int, Challenge] = challenge_tracker.challenges
 task_list: dict[int, TaskEntry] = {}
 task_queue: PriorityQueue[TaskEntry] = PriorityQueue()
 finish_queue = Queue()
 task_event = threading.Event()
 task_running_cnt = 0
+queued_cnt = dict.fromkeys(TaskType, 0)  # tasks in task_queue per TaskType
+queued_lock = threading.Lock()
 threading_pool: multiprocessing.pool.Pool = ThreadingPool()
 
-def remove_task(task: TaskEntry):
-    for next in task.edges:
-        next_task = task_list[next]
-        next_task.indeg_cnt -= 1
+def enqueue_task(task: TaskEntry):
+    task.enqueued_at = time.monotonic_ns()
+    with queued_lock:
+        queued_cnt[task.task.task_type] += 1
+    task_queue.put(task)
+
 
-        if next_task.indeg_cnt == 0:
-            task_queue.put(next_task)
+def remove_task(task: TaskEntry):
+    for next_task in task.release():
+        enqueue_task(next_task)
     task_list.pop(task.task_id)
 
 
 def run_task(chal: Challenge, task: TaskEntry, finish_queue: Queue[TaskEntry]):
     global task_running_cnt
+    start = time.monotonic_ns()
+    task_type = task.task.task_type.name
+    metrics.task_queue_wait.observe_ns(start - task.enqueued_at, task_type)
+    tracer.set_context(chal.chal_id, task.task_id)
+    utils.set_log_context(chal.chal_id, task.task_id)
+    profiler.set_task(task_type, chal.chal_id)
+    tracer.span("queue", task_type, task.enqueued_at, start)
+    t1 = t2 = t3 = start
+    ready = False
     try:
-        utils.logger.info(f"Start task {task.task_id} for challenge {chal.chal_id}")
-        if task.task.setup(chal, task):
-            utils.logger.info(f"Running task {task.task_id} for challenge {chal.chal_id}")
+        utils.task_logger.info("Start task %s for challenge %s", task.task_id, chal.chal_id)
+        # NOTE: Box folders are created when the first task of the challenge starts
+        if not chal.box.cleaned:
+            chal.box.allocate()
+        ready = task.task.setup(chal, task)
+        t1 = time.monotonic_ns()
+        metrics.task_setup_time.observe_ns(t1 - start, task_type)
+        tracer.span("setup", task_type, start, t1)
+        if ready:
+            utils.task_logger.info("Running task %s for challenge %s", task.task_id, chal.chal_id)
             task.task.run(chal, task)
-            utils.logger.info(f"Finish task {task.task_id} for challenge {chal.chal_id}")
+            t2 = time.monotonic_ns()
+            metrics.task_run_time.observe_ns(t2 - t1, task_type)
+            tracer.span("run", task_type, t1, t2)
+            utils.task_logger.info("Finish task %s for challenge %s", task.task_id, chal.chal_id)
             task.task.finish(chal, task)
-            utils.logger.info(f"Task {task.task_id} for challenge {chal.chal_id} finished")
+            t3 = time.monotonic_ns()
+            metrics.task_finish_time.observe_ns(t3 - t2, task_type)
+            tracer.span("finish", task_type, t2, t3)
+            utils.task_logger.info("Task %s for challenge %s finished", task.task_id, chal.chal_id)
     except Exception as e:
         import traceback
 
@@ -73,10 +120,7 @@ def run_task(chal: Challenge, task: TaskEntry, finish_queue: Queue[TaskEntry]):
             subtask_result.score = decimal.Decimal()
             subtask_result.status = Status.InternalError
 
-        for testdata_result in chal.result.testdata_results.values():
-            testdata_result.memory = testdata_result.time = 0
-            testdata_result.score = decimal.Decimal()
-            testdata_result.status = Status.InternalError
+        chal.result.testdata_results.fill(Status.InternalError)
         if __debug__:
             chal.result.total_result.ie_message = "\n".join(
                 traceback.format_exception(e)
@@ -88,7 +132,21 @@ def run_task(chal: Challenge, task: TaskEntry, finish_queue: Queue[TaskEntry]):
         chal.reporter(
             {"chal_id": chal.chal_id, "task": "summary", "result": chal.result}
         )
+        chal.summary_reported = True
     finally:
+        elapsed = time.monotonic_ns() - start
+        slot_tracker.task_finished(elapsed)
+        eta.estimator.observe(chal, task.task.task_type, elapsed / 1e9, not task_queue.empty())
+        metrics.tasks_total.inc(task_type)
+        tracer.clear_context()
+        utils.clear_log_context()
+        profiler.clear_task()
+        if recorder.enabled:
+            end = time.monotonic_ns()
+            # NOTE: Stages after a skipping setup or an exception keep their start time
+            recorder.record_task(
+                end, task, start - task.enqueued_at, t1 - start, max(t2 - t1, 0), max(t3 - t2, 0), ready
+            )
         finish_queue.put(task)
 
 
@@ -97,6 +155,8 @@ def task_loop():
     while task_event.wait() and server_running:
         while task_running_cnt < config.JUDGE_TASK_MAXCONCURRENT:
             task = task_queue.get()
+            with queued_lock:
+                queued_cnt[task.task.task_type] -= 1
             threading_pool.apply_async(
                 run_task,
                 (challenge_list[task.internal_id], task, finish_queue),
@@ -106,11 +166,39 @@ def task_loop():
         task_event.clear()
 
 
+def take_eta_snapshot() -> dict[int, eta.Estimate]:
+    with task_queue.mutex:
+        queued = list(task_queue.queue)
+    # NOTE: Copied in one step under the GIL while other threads add and remove tasks
+    tasks = list(task_list.values())
+    return eta.estimate(queued, tasks, challenge_list, config.JUDGE_TASK_MAXCONCURRENT, eta.estimator)
+
+
+def lookup_estimates(match: Callable[[Challenge], object]) -> dict[object, eta.Estimate]:
+    """
+    Estimates of the live challenges by match(chal), challenges it maps to None are left out.
+    """
+    found = {}
+    for internal_id, estimate in eta.snapshots.get(take_eta_snapshot).items():
+        chal = challenge_list.get(internal_id)
+        if chal is None or (key := match(chal)) is None:
+            continue
+        # NOTE: A rejudge next to the first judge, the later one counts
+        if key not in found or estimate.eta > found[key].eta:
+            found[key] = estimate
+    return found
+
+
+def complete_task(task: TaskEntry):
+    remove_task(task)
+    challenge_tracker.task_done(task)
+
+
 def finish_task_loop():
     global task_running_cnt
     while server_running:
         finish_task = finish_queue.get()
-        remove_task(finish_task)
+        complete_task(finish_task)
         task_running_cnt -= 1
         task_event.set()
 
@@ -153,18 +241,29 @@ obj = {
 """
 
 
-def build_challenge(obj: dict):
+def prepare_challenge(obj: object, reporter, resume) -> bool:
+    """
+    Request the resources the store misses, False when the message has to wait for them.
+    """
+    chal_id = obj.get("chal_id") if isinstance(obj, dict) else None
+    request = lambda digests: reporter({"chal_id": chal_id, "task": "fetch", "digests": digests})
+    return cas.fetch_resources(obj, request, lambda error: resume(cas.FetchError(error) if error else None))
+
+
+def build_challenge(obj: dict, reporter=None):
+    validate_challenge_message(obj)
+    resources = cas.resolve_challenge(obj)
     problem_type = obj.get("problem_type", "batch")
     base_info = parse_base_challenge_info(obj)
     chal = Challenge(**base_info)
+    chal.manifest = get_manifest(chal.res_path, resources)
     context_class = get_context_class(problem_type)
     context = context_class.from_json(obj, chal)
     chal.problem_context = context
     chal.testdatas, chal.subtasks = parse_testdatas_and_subtasks(obj, chal, context)
 
     chal.result = Result(chal_id=chal.chal_id)
-    for testdata_id in chal.testdatas:
-        chal.result.testdata_results[testdata_id] = TestDataResult(id=testdata_id)
+    chal.result.testdata_results = TestDataResultTable(chal.testdatas.keys())
     for subtask_id in chal.subtasks:
         chal.result.subtask_results[subtask_id] = SubtaskResult()
 
@@ -176,14 +275,48 @@ def push_tasks(tasks: list[TaskEntry]):
     for task in tasks:
         task_list[task.task_id] = task
         if task.indeg_cnt == 0:
-            task_queue.put(task)
+            enqueue_task(task)
 
     task_event.set()
 
+
+def register_challenge(chal: Challenge, tasks: list[TaskEntry], reporter):
+    chal.reporter = reporter
+    recorder.record_dag(time.monotonic_ns(), chal, tasks)
+    challenge_tracker.register(chal, tasks)
+    push_tasks(tasks)
+
+
+def report_build_error(obj: dict | None, e: Exception, reporter):
+    import traceback
+
+    # TODO: 有可能連 chal_id 都不知道，這個只有 backend 知道而已
+    chal_id = 1110
+    if isinstance(obj, dict):
+        chal_id = obj.get("chal_id", chal_id)
+    utils.logger.error(f"Failed to build challenge {chal_id}: {e!r}")
+    result = Result(chal_id)
+    result.total_result.status = Status.InternalError
+    result.total_result.memory = 0
+    result.total_result.time = 0
+    result.total_result.score = decimal.Decimal()
+    if __debug__:
+        result.total_result.ie_message = "\n".join(
+            traceback.format_exception(e)
+        )
+        result.total_result.message_type = MessageType.TEXT
+
+    reporter({"chal_id": chal_id, "task": "summary", "result": result})
+
+
 class Encoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, decimal.Decimal):
-            return str(o)
+            # NOTE: Plain notation, str() gives 1E-9 for small scores
+            return format(o, "f")
+
+        elif isinstance(o, (Result, TestDataResultView, TestDataResultTable)):
+            return o.to_dict()
 
         elif dataclasses.is_dataclass(o):
             return dataclasses.asdict(o)
@@ -196,66 +329,280 @@ class Encoder(json.JSONEncoder):
         return super().default(o)
 
 
+def encode_report(result: dict) -> str:
+    return json.dumps(result, cls=Encoder)
+
+
+backends = BackendRegistry(ioloop, encode_report, config.BACKEND_TOKENS)
+# NOTE: Shards get messages the front already routed
+ingest_pipeline = IngestPipeline(
+    build_challenge, register_challenge, report_build_error,
+    route=backends.route if config.SHARD_INDEX is None else None,
+    prepare=prepare_challenge,
+)
+shard_router: ShardRouter | None = None  # front process of sharded mode
+
+
 # TODO: 避免 challenge 已經在 challenge 的 chal
 class JudgeWebSocketClient(tornado.websocket.WebSocketHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.settings["websocket_ping_interval"] = 5
 
-    async def open(self):
-        utils.logger.info("Backend connected")
-        pass
+    def prepare(self):
+        self.backend = backends.authenticate(
+            self.request.headers.get("Authorization", ""), self.get_argument("session", None)
+        )
+        if self.backend is None:
+            raise tornado.web.HTTPError(401)
 
-    def reporter(self, result):
-        ioloop.add_callback(lambda: self.write_message(json.dumps(result, cls=Encoder)))
+    async def open(self):
+        utils.logger.info(f"Backend {self.backend.name} connected")
+        backends.attach(self.backend, self)
 
     async def on_message(self, msg):
         self.ping()
-        obj = json.loads(msg)
-        try:
-            chal, tasks = build_challenge(obj)
-        except Exception as e:
-            import traceback
-
-            # TODO: 有可能連 chal_id 都不知道，這個只有 backend 知道而已
-            chal_id = 1110
-            result = Result(chal_id)
-            result.total_result.status = Status.InternalError
-            result.total_result.memory = 0
-            result.total_result.time = 0
-            result.total_result.score = decimal.Decimal()
-            if __debug__:
-                result.total_result.ie_message = "\n".join(
-                    traceback.format_exception(e)
-                )
-                result.total_result.message_type = MessageType.TEXT
-
-            self.reporter({"chal_id": chal_id, "task": "summary", "result": result})
+        if (seq := parse_ack(msg)) is not None:
+            self.backend.outbox.ack(seq)
+            return
+        if (names := parse_subscribe(msg)) is not None:
+            backends.subscribe(self.backend, names)
+            return
+        if (chal_ids := eta.parse_query(msg)) is not None:
+            # NOTE: Not awaited, the next message of this connection would wait for it
+            ioloop.spawn_callback(self.answer_eta, chal_ids)
             return
+        if cas.is_chunk_frame(msg):
+            if shard_router is not None:
+                shard_router.forward_chunk(msg)
+            else:
+                cas.get_store().receive_chunk(msg)
+            return
+        self.backend.submitted_one()
+        if shard_router is not None:
+            shard_router.submit(msg, backends.reply(self.backend))
+            return
+        recorder.record_challenge(time.monotonic_ns(), msg)
+        ingest_pipeline.submit(msg, backends.reply(self.backend))
+
+    async def answer_eta(self, chal_ids: list[int]):
+        if shard_router is not None:
+            estimates = await shard_router.query(self.backend, chal_ids)
+        else:
+            backend = self.backend
+            wanted = set(chal_ids)
 
-        chal.reporter = self.reporter
-        challenge_list[chal.internal_id] = chal
-        push_tasks(tasks)
+            def match(chal: Challenge):
+                if chal.chal_id in wanted and getattr(chal.reporter, "origin", None) is backend:
+                    return chal.chal_id
+                return None
+
+            found = await ioloop.run_in_executor(None, lookup_estimates, match)
+            estimates = [{"chal_id": chal_id, **estimate.to_dict()} for chal_id, estimate in found.items()]
+        if self.ws_connection is not None:
+            self.write_message(json.dumps({"task": "eta", "estimates": estimates}))
 
     def on_close(self):
         utils.logger.info(
-            f"Backend disconnected close_code: {self.close_code} close_reason: {self.close_reason}"
+            f"Backend {self.backend.name} disconnected close_code: {self.close_code} close_reason: {self.close_reason}"
         )
+        backends.detach(self.backend, self)
 
     def check_origin(self, _: str) -> bool:
         return True
 
 
-def init_socket_server():
+class ChallengeStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        stats = challenge_tracker.stats()
+        if self.get_argument("footprint", None):
+            stats["footprints"] = challenge_tracker.footprints()
+        self.write(stats)
+
+
+class SchedulerStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        stats = slot_tracker.stats()
+        stats["slots"] = config.JUDGE_TASK_MAXCONCURRENT
+        stats["running_tasks"] = task_running_cnt
+        self.write(stats)
+
+
+class EtaStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(eta.estimator.stats())
+
+
+class TelemetryStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        groups = telemetry.export()
+        if kind := self.get_argument("kind", None):
+            groups = [group for group in groups if group["kind"] == kind]
+        self.write({"groups": groups})
+
+
+class AdminHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        if config.ADMIN_TOKEN is None:
+            raise tornado.web.HTTPError(403)
+        auth = self.request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {config.ADMIN_TOKEN}".encode()):
+            raise tornado.web.HTTPError(401)
+
+
+class TraceHandler(AdminHandler):
+    """
+    Chrome trace of one challenge (?chal_id=) and / or the last ?seconds=, with
+    ?dump=1 written to config.TRACE_DUMP_DIR instead of returned.
+    """
+    def get(self):
+        chal_id = self.get_argument("chal_id", None)
+        seconds = self.get_argument("seconds", None)
+        try:
+            chal_id = int(chal_id) if chal_id is not None else None
+            since = time.monotonic_ns() - int(float(seconds) * 10**9) if seconds is not None else None
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        if self.get_argument("dump", None):
+            self.write({"path": tracer.dump(chal_id, since)})
+            return
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(tracer.export(chal_id, since)))
+
+
+class ProfileHandler(AdminHandler):
+    """
+    Samples every thread for ?seconds= at ?rate= Hz, returns collapsed stacks for
+    flamegraph.pl / speedscope. ?idle=0 leaves out threads waiting for work.
+    """
+    async def get(self):
+        try:
+            seconds = float(self.get_argument("seconds", "10"))
+            rate = int(self.get_argument("rate", str(config.PROFILE_DEFAULT_RATE)))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if not 0 < seconds <= config.PROFILE_MAX_SECONDS or not 0 < rate <= config.PROFILE_MAX_RATE:
+            raise tornado.web.HTTPError(400)
+
+        utils.logger.info(f"Profiling for {seconds}s at {rate}Hz")
+        include_idle = self.get_argument("idle", "1") != "0"
+        stacks = await ioloop.run_in_executor(None, profiler.profiler.sample, seconds, rate, include_idle)
+        if stacks is None:
+            raise tornado.web.HTTPError(409, reason="Another profile is running")
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.set_header("Content-Disposition", f'attachment; filename="ntoj-profile-{time.strftime("%Y%m%d-%H%M%S")}.folded"')
+        self.write(profiler.profiler.render(stacks))
+
+
+class BackendStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(backends.stats())
+
+
+class ShardStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(shard_router.stats())
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.registry.render())
+
+
+def init_metrics():
+    def queue_depth():
+        with queued_lock:
+            return {(task_type.name,): cnt for task_type, cnt in queued_cnt.items()}
+
+    metrics.queue_depth.set_function(queue_depth)
+    metrics.running_tasks.set_function(lambda: task_running_cnt)
+    metrics.live_challenges.set_function(lambda: len(challenge_list))
+    metrics.websocket_backlog.set_function(backends.unsent)
+    metrics.ingest_backlog.set_function(ingest_pipeline.depth)
+
+
+def init_socket_server(port: int = 2502, judge: bool = True):
+    """
+    judge=False leaves out /judge, shards serve only their stats endpoints.
+    """
+    handlers = [
+        (r"/stats/challenges", ChallengeStatsHandler),
+        (r"/stats/scheduler", SchedulerStatsHandler),
+        (r"/stats/telemetry", TelemetryStatsHandler),
+        (r"/stats/eta", EtaStatsHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/debug/trace", TraceHandler),
+        (r"/debug/profile", ProfileHandler),
+    ]
+    if judge:
+        handlers.insert(0, (r"/judge", JudgeWebSocketClient))
+        handlers.insert(1, (r"/stats/backends", BackendStatsHandler))
+    app = tornado.web.Application(handlers)
+    app.listen(port)
+    return app
+
+
+def init_front_server():
     app = tornado.web.Application(
         [
             (r"/judge", JudgeWebSocketClient),
+            (r"/stats/shards", ShardStatsHandler),
+            (r"/stats/backends", BackendStatsHandler),
         ]
     )
     app.listen(2502)
     return app
 
 
+def init_shard_connection():
+    """
+    Shard side of sharded mode, challenge messages come from the front process and
+    reports go back to it instead of a websocket.
+    """
+    conn = ShardConnection.from_env()
+
+    def on_message(route_id: int, msg: bytes):
+        recorder.record_challenge(time.monotonic_ns(), msg)
+        ingest_pipeline.submit(msg, ShardReporter(conn, route_id, encode_report))
+
+    def on_chunk(frame: bytes):
+        cas.get_store().receive_chunk(frame)
+
+    def on_query(query_id: int, payload: bytes):
+        routes = set(json.loads(payload)["routes"])
+
+        def match(chal: Challenge):
+            route_id = getattr(chal.reporter, "route_id", None)
+            return route_id if route_id in routes else None
+
+        # NOTE: On the reader thread, snapshots are cached so this is mostly a lookup
+        found = lookup_estimates(match)
+        answer = {route_id: estimate.to_dict() for route_id, estimate in found.items()}
+        conn.send(FRAME_ANSWER, query_id, json.dumps(answer).encode())
+
+    def on_closed():
+        # NOTE: The front is gone, there is nobody left to report to
+        utils.logger.info(f"Shard {config.SHARD_INDEX} disconnected from the front, exiting")
+        clean_sandbox()
+        os._exit(0)
+
+    threading.Thread(
+        target=conn.read_loop, args=(on_message, on_chunk, on_query, on_closed), name="shard-reader", daemon=True
+    ).start()
+
+
+def main_front():
+    global shard_router
+    utils.logger.info(f"Judge front start, {config.SHARD_COUNT} shards")
+    shard_router = ShardRouter(config.SHARD_COUNT, report_build_error, backends.route, backends.broadcast)
+    shard_router.start()
+    atexit.register(shard_router.stop)
+    init_front_server()
+    ioloop.start()
+
+
 def sig_handler(sig, _):
     def stop_loop(deadline):
         now = time.time()
@@ -279,19 +626,34 @@ def sig_handler(sig, _):
     ioloop.add_callback_from_signal(shutdown)
 
 def init_sandbox():
-    os.mkdir("/dev/shm/ntoj-judge-sandbox")
+    os.mkdir(config.SANDBOX_ROOT)
+    get_workdir_pool()
 
 def clean_sandbox():
     import shutil
-    shutil.rmtree("/dev/shm/ntoj-judge-sandbox", ignore_errors=True)
+    shutil.rmtree(config.SANDBOX_ROOT, ignore_errors=True)
 
 def main():
+    if config.SHARD_COUNT and config.SHARD_INDEX is None:
+        main_front()
+        return
+
     utils.logger.info("Judge Start")
 
+    offload.start()
+    atexit.register(offload.stop)
     init_sandbox()
     atexit.register(clean_sandbox)
     init_langs()
-    app = init_socket_server()
+    calibration.init_calibration()
+    ingest_pipeline.start()
+    recorder.start()
+    init_metrics()
+    if config.SHARD_INDEX is not None:
+        init_shard_connection()
+        app = init_socket_server(config.SHARD_STATS_PORT + config.SHARD_INDEX, judge=False)
+    else:
+        app = init_socket_server()
 
     # TODO: handle signal Ctrl+C (SIGINT, SIGTERM, SIGQUIT)
     # signal.signal(signal.SIGINT, functools.partial(sig_handler))
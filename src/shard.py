@@ -0,0 +1,366 @@
+"""
+Sharded judge on one host
+
+backend <-> front process (/judge) <-> N shard processes (server.py, NTOJ_SHARD_INDEX=i)
+
+The front only routes: it sends every challenge message to the shard with the least
+outstanding work and forwards the encoded reports of the shards unparsed to the
+backend the message replies to (see backends.py). Each shard runs the usual ingest pipeline, scheduler and sandbox root on its
+slice of CPUSET, so building, result bookkeeping, JSON encoding and summaries run
+under N GILs.
+
+Front and shard talk over a socketpair with frames of HEADER + payload. Each challenge
+message gets a route id that the shard puts in the header of every report of that
+message, chal_ids are only unique per backend. A lost shard fails its outstanding
+challenges with InternalError and is respawned.
+"""
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+
+import config
+import utils
+from utils import cas
+
+# NOTE: payload length, route id, frame kind
+HEADER = struct.Struct(">IqB")
+FRAME_CHALLENGE = 0  # front -> shard, raw challenge message
+FRAME_REPORT = 1  # shard -> front, execute / scoring report
+FRAME_SUMMARY = 2  # shard -> front, last report of a challenge
+FRAME_BROADCAST = 3  # shard -> front, report for every backend (backpressure)
+FRAME_FETCH = 4  # shard -> front, resource objects the shard misses (see utils/cas.py)
+FRAME_CHUNK = 5  # front -> shard, resource chunk frame from the backend
+FRAME_QUERY = 6  # front -> shard, ETA query for route ids, header has the query id (see utils/eta.py)
+FRAME_ANSWER = 7  # shard -> front, estimates by route id, header has the query id
+# NOTE: Report task of a frame kind for Reply.deliver, None is any result
+FRAME_TASKS = {FRAME_REPORT: None, FRAME_SUMMARY: "summary", FRAME_FETCH: "fetch"}
+
+SHARD_FD_ENV = "NTOJ_SHARD_FD"
+
+
+def report_frame_kind(result: dict) -> int:
+    task = result.get("task")
+    if task == "summary":
+        return FRAME_SUMMARY
+    if task == "backpressure":
+        return FRAME_BROADCAST
+    if task == "fetch":
+        return FRAME_FETCH
+    return FRAME_REPORT
+
+
+class ShardConnection:
+    """
+    Shard side of the socketpair. Reports are sent by worker threads, challenge
+    messages are read by one thread.
+    """
+    def __init__(self, fd: int):
+        self.sock = socket.socket(fileno=fd)
+        self.reader = self.sock.makefile("rb")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ShardConnection":
+        return cls(int(os.environ[SHARD_FD_ENV]))
+
+    def send(self, kind: int, route_id: int, payload: bytes):
+        with self.lock:
+            self.sock.sendall(HEADER.pack(len(payload), route_id, kind) + payload)
+
+    def read_loop(
+        self,
+        on_message: Callable[[int, bytes], None],
+        on_chunk: Callable[[bytes], None],
+        on_query: Callable[[int, bytes], None],
+        on_closed: Callable[[], None],
+    ):
+        try:
+            while header := self.reader.read(HEADER.size):
+                if len(header) < HEADER.size:
+                    break
+                length, route_id, kind = HEADER.unpack(header)
+                payload = self.reader.read(length)
+                if len(payload) < length:
+                    break
+                if kind == FRAME_CHALLENGE:
+                    on_message(route_id, payload)
+                elif kind == FRAME_CHUNK:
+                    on_chunk(payload)
+                elif kind == FRAME_QUERY:
+                    on_query(route_id, payload)
+        finally:
+            on_closed()
+
+
+@dataclass(slots=True)
+class ShardReporter:
+    """
+    Reporter of one challenge message in a shard, its reports carry the route id.
+    """
+    conn: ShardConnection
+    route_id: int
+    encode: Callable[[dict], str]
+
+    def __call__(self, result: dict):
+        self.conn.send(report_frame_kind(result), self.route_id, self.encode(result).encode())
+
+
+@dataclass(slots=True)
+class Route:
+    shard: "Shard"
+    reply: object  # backends.Reply
+    weight: int
+    chal_id: int | None
+
+
+@dataclass(slots=True)
+class Shard:
+    index: int
+    proc: subprocess.Popen | None = None
+    stream: tornado.iostream.IOStream | None = None
+    alive: bool = False
+    load: int = 0
+    challenges: int = 0
+    respawns: int = 0
+
+
+def shard_sandbox_root(index: int) -> str:
+    return f"{config.SANDBOX_ROOT}-{index}"
+
+
+class ShardRouter:
+    def __init__(
+        self,
+        count: int,
+        on_error: Callable[[dict | None, Exception, object], None],
+        route: Callable[[object, object], object],
+        broadcast: Callable[[str], None],
+    ):
+        """
+        on_error(obj, exception, reply) reports a message that failed in the front or
+        whose shard died, route(obj, reply) picks the reply of a parsed message and
+        broadcast(report) writes a report to every backend.
+        """
+        self.shards = [Shard(index=i) for i in range(count)]
+        self.on_error = on_error
+        self.route = route
+        self.broadcast = broadcast
+        self.route_ids = itertools.count(1)
+        self.routes: dict[int, Route] = {}
+        self.query_ids = itertools.count(1)
+        self.queries: dict[int, asyncio.Future] = {}
+        # NOTE: digest -> shards waiting for the chunks of that object
+        self.fetches: dict[str, list[Shard]] = {}
+
+    def start(self):
+        for shard in self.shards:
+            self.spawn(shard)
+
+    def stop(self):
+        # NOTE: Shards exit and clean their sandbox root when the front end of the
+        # socketpair closes
+        for shard in self.shards:
+            if shard.stream is not None:
+                shard.stream.close()
+        for shard in self.shards:
+            if shard.proc is None:
+                continue
+            try:
+                shard.proc.wait(config.SHARD_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                shard.proc.kill()
+                shard.proc.wait()
+                shutil.rmtree(shard_sandbox_root(shard.index), ignore_errors=True)
+
+    def spawn(self, shard: Shard):
+        front_sock, shard_sock = socket.socketpair()
+        env = dict(
+            os.environ,
+            NTOJ_SHARD_COUNT=str(len(self.shards)),
+            NTOJ_SHARD_INDEX=str(shard.index),
+            **{SHARD_FD_ENV: str(shard_sock.fileno())},
+        )
+        shard.proc = subprocess.Popen([sys.executable, "server.py"], env=env, pass_fds=[shard_sock.fileno()])
+        shard_sock.close()
+        shard.stream = tornado.iostream.IOStream(front_sock)
+        shard.alive = True
+        utils.logger.info(f"Started shard {shard.index}, pid {shard.proc.pid}")
+        tornado.ioloop.IOLoop.current().spawn_callback(self.read_loop, shard)
+
+    def submit(self, msg: str | bytes, reply):
+        """
+        Route a raw challenge message, runs on the IOLoop. The shard validates it.
+        """
+        if isinstance(msg, str):
+            msg = msg.encode()
+        try:
+            obj = json.loads(msg)
+        except ValueError as e:
+            self.on_error(None, e, reply)
+            return
+        reply = self.route(obj, reply)
+        chal_id = obj.get("chal_id") if isinstance(obj, dict) else None
+        testdatas = obj.get("testdatas") if isinstance(obj, dict) else None
+        weight = len(testdatas) + 1 if isinstance(testdatas, list) else 1
+
+        alive = [shard for shard in self.shards if shard.alive]
+        if not alive:
+            self.lost(chal_id, reply)
+            return
+        shard = min(alive, key=lambda s: s.load)
+        route_id = next(self.route_ids)
+        self.routes[route_id] = Route(shard, reply, weight, chal_id)
+        shard.load += weight
+        shard.challenges += 1
+
+        try:
+            shard.stream.write(HEADER.pack(len(msg), route_id, FRAME_CHALLENGE) + msg)
+        except tornado.iostream.StreamClosedError:
+            # NOTE: The shard died before read_loop noticed, shard_lost may have run already
+            if route_id in self.routes:
+                self.finish_route(route_id)
+                self.lost(chal_id, reply)
+
+    def lost(self, chal_id: int | None, reply):
+        obj = {"chal_id": chal_id} if chal_id is not None else None
+        self.on_error(obj, RuntimeError("Shard process exited"), reply)
+
+    def forward_chunk(self, frame: bytes):
+        """
+        Pass a resource chunk frame to the shards that requested the object, runs on the IOLoop.
+        """
+        digest = cas.chunk_digest(frame)
+        shards = self.fetches.get(digest)
+        if not shards:
+            return
+        _, _, size, offset = cas.CHUNK_HEADER.unpack_from(frame)
+        if offset + len(frame) - cas.CHUNK_HEADER.size >= size:
+            del self.fetches[digest]
+        data = HEADER.pack(len(frame), 0, FRAME_CHUNK) + frame
+        for shard in shards:
+            if shard.alive:
+                try:
+                    shard.stream.write(data)
+                except tornado.iostream.StreamClosedError:
+                    pass
+
+    def finish_route(self, route_id: int):
+        route = self.routes.pop(route_id)
+        route.shard.load -= route.weight
+        route.shard.challenges -= 1
+
+    async def read_loop(self, shard: Shard):
+        stream = shard.stream
+        try:
+            while True:
+                header = await stream.read_bytes(HEADER.size)
+                length, route_id, kind = HEADER.unpack(header)
+                payload = (await stream.read_bytes(length)).decode()
+                if kind == FRAME_BROADCAST:
+                    self.broadcast(payload)
+                    continue
+                if kind == FRAME_ANSWER:
+                    future = self.queries.pop(route_id, None)
+                    if future is not None and not future.done():
+                        future.set_result(json.loads(payload))
+                    continue
+                route = self.routes.get(route_id)
+                if route is None:
+                    utils.logger.warning(f"Report of unknown route {route_id} from shard {shard.index}")
+                    continue
+                if kind == FRAME_FETCH:
+                    for digest in json.loads(payload)["digests"]:
+                        shards = self.fetches.setdefault(digest, [])
+                        if shard not in shards:
+                            shards.append(shard)
+                elif kind == FRAME_SUMMARY:
+                    self.finish_route(route_id)
+                route.reply.deliver(payload, FRAME_TASKS.get(kind))
+        except tornado.iostream.StreamClosedError:
+            pass
+
+        await self.shard_lost(shard)
+
+    async def query(self, origin, chal_ids: list[int]) -> list[dict]:
+        """
+        ETA estimates of the challenges origin sent, from the shards that run them.
+        """
+        wanted = set(chal_ids)
+        by_shard: dict[int, dict[int, int]] = {}
+        for route_id, route in self.routes.items():
+            if route.chal_id in wanted and route.reply.origin is origin:
+                by_shard.setdefault(route.shard.index, {})[route_id] = route.chal_id
+
+        waits = []
+        for index, routes in by_shard.items():
+            query_id = next(self.query_ids)
+            payload = json.dumps({"routes": list(routes)}).encode()
+            try:
+                self.shards[index].stream.write(HEADER.pack(len(payload), query_id, FRAME_QUERY) + payload)
+            except tornado.iostream.StreamClosedError:
+                continue
+            future = self.queries[query_id] = asyncio.get_running_loop().create_future()
+            waits.append((query_id, routes, future))
+
+        estimates: dict[int, dict] = {}
+        for query_id, routes, future in waits:
+            try:
+                answer = await asyncio.wait_for(future, config.ETA_QUERY_TIMEOUT)
+            except asyncio.TimeoutError:
+                # NOTE: The shard died or is busy, its challenges are left out
+                self.queries.pop(query_id, None)
+                continue
+            for route_id, estimate in answer.items():
+                chal_id = routes[int(route_id)]
+                # NOTE: A rejudge next to the first judge, the later one counts
+                if chal_id not in estimates or estimate["eta"] > estimates[chal_id]["eta"]:
+                    estimates[chal_id] = {"chal_id": chal_id, **estimate}
+        return list(estimates.values())
+
+    async def shard_lost(self, shard: Shard):
+        shard.alive = False
+        if shard.proc.poll() is None:
+            shard.proc.kill()
+        code = shard.proc.wait()
+        # NOTE: A killed shard leaves its sandbox root behind, the respawned one creates it again
+        shutil.rmtree(shard_sandbox_root(shard.index), ignore_errors=True)
+        utils.logger.error(f"Shard {shard.index} exited with {code}, {shard.challenges} challenges lost")
+        for route_id, route in list(self.routes.items()):
+            if route.shard is shard:
+                del self.routes[route_id]
+                self.lost(route.chal_id, route.reply)
+        shard.load = shard.challenges = 0
+
+        shard.respawns += 1
+        await tornado.gen.sleep(config.SHARD_RESPAWN_DELAY)
+        self.spawn(shard)
+
+    def stats(self) -> dict:
+        return {
+            "shards": [
+                {
+                    "index": shard.index,
+                    "pid": shard.proc.pid if shard.proc else None,
+                    "alive": shard.alive,
+                    "load": shard.load,
+                    "challenges": shard.challenges,
+                    "respawns": shard.respawns,
+                    "stats_port": config.SHARD_STATS_PORT + shard.index,
+                }
+                for shard in self.shards
+            ],
+            "routes": len(self.routes),
+        }
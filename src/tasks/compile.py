@@ -1,18 +1,22 @@
 from dataclasses import dataclass
+from typing import ClassVar
 from models import (
     SandboxStatus,
     Task,
     TaskEntry,
     Challenge,
     CompilationTarget,
+    TaskType,
 )
 
 from lang.base import langs
 from utils import logger
+from utils.telemetry import telemetry
 
 @dataclass(slots=True)
 class CompileTask(Task):
     target: CompilationTarget
+    task_type: ClassVar[TaskType] = TaskType.COMPILE
 
     def setup(self, chal: Challenge, task: TaskEntry) -> bool:
         # NOTE: Check CE / CLE / JE
@@ -29,6 +33,7 @@ class CompileTask(Task):
             addition_args=self.target.get_compile_args(chal),
             executable_name=self.target.get_output_name(chal)
         )
+        telemetry.record("compile", lang.name, chal.pro_id, res)
 
         if res.status == SandboxStatus.Normal:
             output_name = self.target.get_output_name(chal)
@@ -11,11 +11,14 @@ from models import (
     Status,
     Task,
     TaskEntry,
+    TaskType,
     TestData,
     Compiler,
 )
 
-from utils import logger
+import config
+from utils import logger, offload, testcase_logger
+from utils.telemetry import telemetry
 from lang.base import langs
 from problem.mixins import CheckerMixin, UserProgramMixin
 from sandbox.sandbox import SandboxParams
@@ -36,7 +39,25 @@ def generate_random_string(length):
     characters = string.ascii_letters + string.digits
     return 'f' + ''.join(random.choices(characters, k=length))
 
+def read_checker_output(stdout: str | None, stderr: str | None, stdout_first_line: bool) -> tuple[str, str]:
+    """
+    Returns the checker stdout, only its first line when stdout_first_line, and the first
+    line of its stderr. Runs in the offload pool for large outputs (see utils/offload.py).
+    """
+    stdout_content = stderr_content = ""
+    if stdout:
+        with open(stdout) as f:
+            stdout_content = f.readline().rstrip("\n") if stdout_first_line else f.read()
+    if stderr:
+        with open(stderr) as f:
+            stderr_content = f.readline().rstrip("\n")
+    return stdout_content, stderr_content
+
+
 class ScoringTask(Task):
+    __slots__ = ("testdata",)
+    task_type = TaskType.SCORING
+
     def __init__(self, testdata: TestData):
         self.testdata = testdata
 
@@ -73,8 +94,13 @@ class ScoringTask(Task):
         assert chal.problem_context.checker_type not in (CheckerType.TOJ, CheckerType.IOREDIR), (
             "TODO: CheckerType TOJ and IOREDIR"
         )
-        logger.debug(f"Scoring testdata {self.testdata.id} for chal {chal.chal_id} with checker type {chal.problem_context.checker_type}")
+        testcase_logger.debug("Scoring testdata %s for chal %s with checker type %s", self.testdata.id, chal.chal_id, chal.problem_context.checker_type)
         testdata_result = chal.result.testdata_results[self.testdata.id]
+        if self.testdata.stream_checked:
+            # NOTE: The verdict was decided while executing, see utils/stream_checker.py
+            testcase_logger.info("Testdata %s accepted for chal %s (stream checked)", self.testdata.id, chal.chal_id)
+            return
+
         in_name = generate_random_string(11)
         out_name = generate_random_string(10)
         ans_name = generate_random_string(10)
@@ -109,11 +135,12 @@ class ScoringTask(Task):
             assert self.testdata.useroutput_path
             param.add_copy_in_path(self.testdata.useroutput_path, ans_name)
             res = chal.box.run_sandbox([param])[0]
+            telemetry.record("checker", DEFAULT_CHECKER[chal.problem_context.checker_type], chal.pro_id, res)
             if res.status == SandboxStatus.Normal:
                 testdata_result.status = Status.Accepted
-                logger.info(f"Testdata {self.testdata.id} accepted for chal {chal.chal_id}")
+                testcase_logger.info("Testdata %s accepted for chal %s", self.testdata.id, chal.chal_id)
             else:
-                logger.info(f"Testdata {self.testdata.id} wrong answer for chal {chal.chal_id}, checker status: {res.status}")
+                testcase_logger.info("Testdata %s wrong answer for chal %s, checker status: %s", self.testdata.id, chal.chal_id, res.status)
                 chal.result.testdata_results[self.testdata.id].status = Status.WrongAnswer
 
         elif chal.problem_context.checker_type in (
@@ -122,6 +149,10 @@ class ScoringTask(Task):
         ):
             assert isinstance(chal.problem_context, UserProgramMixin)
             assert chal.problem_context.checker_compiler
+            if chal.checker_hosts is not None:
+                self.run_checker_host(chal)
+                return
+
             lang = langs[chal.problem_context.checker_compiler]
             if chal.problem_context.userprog_compiler != Compiler.java:
                 exec, args = lang.get_execute_command("checker", args=[in_name, out_name, ans_name])
@@ -148,95 +179,127 @@ class ScoringTask(Task):
             assert self.testdata.useroutput_path
             param.add_copy_in_path(self.testdata.useroutput_path, ans_name)
             res = chal.box.run_sandbox([param])[0]
+            telemetry.record("checker", lang.name, chal.pro_id, res)
 
-            # TODO: Move this to utils
-            stderr_content = ""
+            stdout = chal.box.get_file(f"{self.testdata.id}-checker-stdout")
             stderr = chal.box.get_file(f"{self.testdata.id}-checker-stderr")
-            if stderr:
-                with open(stderr) as f:
-                    stderr_content = f.read()
-                chal.box.delete_file(f"{self.testdata.id}-checker-stderr")
+            size = sum(os.path.getsize(path) for path in (stdout, stderr) if path)
+            stdout_content, stderr_content = offload.run(
+                read_checker_output,
+                stdout,
+                stderr,
+                chal.problem_context.checker_type == CheckerType.CMS_TPS_TESTLIB,
+                offload=size >= config.OFFLOAD_CHECKER_OUTPUT_MIN_BYTES,
+            )
+            chal.box.delete_file(f"{self.testdata.id}-checker-stdout")
+            chal.box.delete_file(f"{self.testdata.id}-checker-stderr")
 
-            stdout_content = ""
-            stdout = chal.box.get_file(f"{self.testdata.id}-checker-stdout")
-            if stdout:
-                with open(stdout) as f:
-                    stdout_content = f.read()
-                chal.box.delete_file(f"{self.testdata.id}-checker-stdout")
+            self.apply_testlib_result(chal, res.status, res.exit_status, stdout_content, stderr_content)
 
-            if chal.problem_context.checker_type == CheckerType.CMS_TPS_TESTLIB:
-                if res.status != SandboxStatus.Normal:
-                    self.set_testdata_result_je(chal, "checker runtime error")
-                    return
+    def run_checker_host(self, chal: Challenge):
+        """
+        Check the testcase in a persistent checker host, see utils/checker_host.py.
+        The checker sees the same files as in its own sandbox, under other names.
+        """
+        assert self.testdata.useroutput_path
+        args = [
+            os.path.relpath(self.testdata.inputpath, chal.res_path),
+            os.path.relpath(self.testdata.outputpath, chal.res_path),
+            os.path.join("file", os.path.relpath(self.testdata.useroutput_path, chal.box.file_folder)),
+        ]
+        outcome = chal.checker_hosts.check(args)
+        if outcome is None:
+            self.set_testdata_result_je(chal, "checker host failed")
+            return
 
-                checker_message = stderr_content.split("\n")[0]
-                if checker_message:
-                    testdata_result.message = checker_message
-                    testdata_result.message_type = MessageType.TEXT
-                    logger.debug(f"Checker message for testdata {self.testdata.id}: {checker_message}")
+        self.apply_testlib_result(chal, outcome.status, outcome.exit_status, outcome.stdout, outcome.stderr)
 
-                try:
-                    score = float(stdout_content.split("\n")[0])
-                    logger.debug(f"Checker score for testdata {self.testdata.id}: {score}")
-                except ValueError:
-                    self.set_testdata_result_je(chal, "invalid score")
-                    return
+    def apply_testlib_result(
+        self,
+        chal: Challenge,
+        status: SandboxStatus,
+        exit_status: int,
+        stdout_content: str,
+        stderr_content: str,
+    ):
+        """
+        Set the testdata result from a testlib checker run.
+        """
+        assert isinstance(chal.problem_context, CheckerMixin)
+        testdata_result = chal.result.testdata_results[self.testdata.id]
+        if chal.problem_context.checker_type == CheckerType.CMS_TPS_TESTLIB:
+            if status != SandboxStatus.Normal:
+                self.set_testdata_result_je(chal, "checker runtime error")
+                return
+
+            checker_message = stderr_content.split("\n")[0]
+            if checker_message:
+                testdata_result.message = checker_message
+                testdata_result.message_type = MessageType.TEXT
+                testcase_logger.debug("Checker message for testdata %s: %s", self.testdata.id, checker_message)
+
+            try:
+                score = float(stdout_content.split("\n")[0])
+                testcase_logger.debug("Checker score for testdata %s: %s", self.testdata.id, score)
+            except ValueError:
+                self.set_testdata_result_je(chal, "invalid score")
+                return
 
-                if score >= 1.0:
-                    score = 1.0
-                    if score > 1.0:
-                        logger.warning(f"Checker score for testdata {self.testdata.id} exceeds 1.0, treating as 1.0")
-                    testdata_result.status = Status.Accepted
-                    logger.info(f"Testdata {self.testdata.id} accepted with full score for chal {chal.chal_id}")
-                elif score <= 0.0:
-                    if score < 0.0:
-                        logger.warning(f"Checker score for testdata {self.testdata.id} below 0.0, treating as 0.0")
-                    score = 0.0
-                    chal.result.testdata_results[
-                        self.testdata.id
-                    ].status = Status.WrongAnswer
-                    logger.info(f"Testdata {self.testdata.id} wrong answer for chal {chal.chal_id}")
-                else:
-                    chal.result.testdata_results[
-                        self.testdata.id
-                    ].status = Status.PartialCorrect
-                    logger.info(f"Testdata {self.testdata.id} partial correct ({score}) for chal {chal.chal_id}")
-                testdata_result.score = decimal.Decimal(score)
+            if score >= 1.0:
+                score = 1.0
+                if score > 1.0:
+                    logger.warning(f"Checker score for testdata {self.testdata.id} exceeds 1.0, treating as 1.0")
+                testdata_result.status = Status.Accepted
+                testcase_logger.info("Testdata %s accepted with full score for chal %s", self.testdata.id, chal.chal_id)
+            elif score <= 0.0:
+                if score < 0.0:
+                    logger.warning(f"Checker score for testdata {self.testdata.id} below 0.0, treating as 0.0")
+                score = 0.0
+                chal.result.testdata_results[
+                    self.testdata.id
+                ].status = Status.WrongAnswer
+                testcase_logger.info("Testdata %s wrong answer for chal %s", self.testdata.id, chal.chal_id)
+            else:
+                chal.result.testdata_results[
+                    self.testdata.id
+                ].status = Status.PartialCorrect
+                testcase_logger.info("Testdata %s partial correct (%s) for chal %s", self.testdata.id, score, chal.chal_id)
+            testdata_result.score = decimal.Decimal(score)
 
-            elif chal.problem_context.checker_type == CheckerType.STD_TESTLIB:
-                if res.status not in (
-                    SandboxStatus.Normal,
-                    SandboxStatus.NonzeroExitStatus,
-                ):
-                    self.set_testdata_result_je(chal, "checker runtime error")
-                    return
+        elif chal.problem_context.checker_type == CheckerType.STD_TESTLIB:
+            if status not in (
+                SandboxStatus.Normal,
+                SandboxStatus.NonzeroExitStatus,
+            ):
+                self.set_testdata_result_je(chal, "checker runtime error")
+                return
 
-                if res.exit_status == 0:
-                    testdata_result.status = Status.Accepted
-                    logger.info(f"Testdata {self.testdata.id} accepted for chal {chal.chal_id}")
-                elif res.exit_status in (1, 2):
-                    testdata_result.status = Status.WrongAnswer
-                    logger.info(f"Testdata {self.testdata.id} wrong answer for chal {chal.chal_id}")
-                elif res.exit_status == 3:
-                    self.set_testdata_result_je(chal, "checker internal error")
-                elif res.exit_status == 7:
-                    testdata_result.status = Status.PartialCorrect
-                    line = stderr_content.split("\n")[0]
-                    line = line.split(" ")
-                    try:
-                        if line[0] != "points":
-                            self.set_testdata_result_je(chal, "invalid score")
-                        testdata_result.score = decimal.Decimal(line[1])
-                        logger.info(f"Testdata {self.testdata.id} partial correct ({line[1]}) for chal {chal.chal_id}")
-                    except (IndexError, decimal.DecimalException):
-                        testdata_result.status = Status.JudgeError
-                        testdata_result.score = decimal.Decimal()
+            if exit_status == 0:
+                testdata_result.status = Status.Accepted
+                testcase_logger.info("Testdata %s accepted for chal %s", self.testdata.id, chal.chal_id)
+            elif exit_status in (1, 2):
+                testdata_result.status = Status.WrongAnswer
+                testcase_logger.info("Testdata %s wrong answer for chal %s", self.testdata.id, chal.chal_id)
+            elif exit_status == 3:
+                self.set_testdata_result_je(chal, "checker internal error")
+            elif exit_status == 7:
+                testdata_result.status = Status.PartialCorrect
+                line = stderr_content.split("\n")[0]
+                line = line.split(" ")
+                try:
+                    if line[0] != "points":
+                        self.set_testdata_result_je(chal, "invalid score")
+                    testdata_result.score = decimal.Decimal(line[1])
+                    testcase_logger.info("Testdata %s partial correct (%s) for chal %s", self.testdata.id, line[1], chal.chal_id)
+                except (IndexError, decimal.DecimalException):
+                    testdata_result.status = Status.JudgeError
+                    testdata_result.score = decimal.Decimal()
 
-                # TODO: testlib message
-                checker_message = stdout_content
-                if checker_message:
-                    testdata_result.message = checker_message
-                    testdata_result.message_type = MessageType.TEXT
+            # TODO: testlib message
+            checker_message = stdout_content
+            if checker_message:
+                testdata_result.message = checker_message
+                testdata_result.message_type = MessageType.TEXT
 
     def finish(self, chal: Challenge, task: TaskEntry):
         chal.reporter(
@@ -253,5 +316,5 @@ class ScoringTask(Task):
         ):
             chal.skip_subtasks.update(self.testdata.subtasks)
 
-        assert self.testdata.useroutput_path
-        chal.box.delete_file(self.testdata.useroutput_path)
+        if self.testdata.useroutput_path:
+            chal.box.delete_file(self.testdata.useroutput_path)
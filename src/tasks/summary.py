@@ -1,18 +1,171 @@
 import decimal
+from array import array
+from dataclasses import dataclass, field
+
+import config
 from models import (
     CheckerType,
     MessageType,
     Status,
+    SubtaskResult,
     SummaryType,
     Task,
     TaskEntry,
+    TaskType,
     Challenge,
+    fixed_to_score,
+    gather,
 )
-from problem.mixins import UserProgramMixin, CheckerMixin, SummaryMixin
-from utils import logger
+from problem.mixins import CheckerMixin, InteractorMixin, SummaryMixin
+from utils import logger, offload
+
+SKIPPED = Status.Skipped.value
+COMPILE_ERRORS = frozenset((Status.CompileError.value, Status.CompileLimitExceeded.value))
+
+
+@dataclass(slots=True)
+class SummaryInput:
+    """
+    What the summary needs from a challenge, compact enough to send to an offload worker.
+    """
+    summary_type: SummaryType
+    use_testdata_score: bool
+    status: array
+    time: array
+    memory: array
+    score: array
+    # NOTE: subtask id -> (score, testdata indexes, dependency subtask ids)
+    subtasks: dict[int, tuple[decimal.Decimal, list[int], list[int]]]
+    subtask_results: dict[int, SubtaskResult]
+    total: tuple[int, int, decimal.Decimal, Status | None]  # time, memory, score, status
+    exact_scores: dict[int, decimal.Decimal] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class SummaryOutput:
+    status: array
+    subtask_results: dict[int, SubtaskResult]
+    total: tuple[int, int, decimal.Decimal, Status | None]
+    no_testdata: bool = False
+
+
+def compute_summary(inp: SummaryInput) -> SummaryOutput:
+    """
+    Subtask and total results from the testdata result columns, runs in the offload
+    pool for large challenges (see utils/offload.py).
+    """
+    status_column = inp.status
+    subtask_results = inp.subtask_results
+    total_time, total_memory, total_score, total_status = inp.total
+
+    for subtask_id, subtask_result in subtask_results.items():
+        subtask_score, idxs, dependency_subtasks = inp.subtasks[subtask_id]
+        statuses = gather(status_column, idxs)
+
+        # NOTE: Testdata without status or skipped do not count toward the subtask
+        first_counted = -1
+        counted = []
+        for pos, status in enumerate(statuses):
+            if status and status != SKIPPED:
+                if first_counted == -1:
+                    first_counted = pos
+                counted.append(idxs[pos])
+
+        if counted:
+            counted_statuses = gather(status_column, counted)
+            assert COMPILE_ERRORS.isdisjoint(counted_statuses)
+            subtask_result.memory += sum(gather(inp.memory, counted))
+            subtask_result.time = max(subtask_result.time, *gather(inp.time, counted))
+            status = max(counted_statuses)
+            if subtask_result.status:
+                status = max(subtask_result.status, status)
+            subtask_result.status = Status(status)
+
+        subtask_result.score = decimal.Decimal()
+        if subtask_result.status in (Status.Accepted, Status.PartialCorrect):
+            if inp.use_testdata_score:
+                # NOTE: Score takes every testdata from the first counted one on
+                scored = idxs[first_counted:]
+                scores = gather(inp.score, scored)
+                to_score = fixed_to_score
+                if inp.exact_scores:
+                    # NOTE: Scores the fixed-point column rounds compare exactly
+                    exact_scores = inp.exact_scores
+                    scores = [exact_scores.get(idx) or fixed_to_score(score) for idx, score in zip(scored, scores)]
+                    to_score = decimal.Decimal
+
+                if inp.summary_type == SummaryType.GROUPMIN:
+                    score = min(scores) if subtask_score >= 0 else max(scores)
+                    subtask_result.score = subtask_score * to_score(score)
+
+                elif inp.summary_type == SummaryType.OVERWRITE:
+                    subtask_result.score = to_score(min(scores))
+            else:
+                subtask_result.score = subtask_score
+
+        for dep_subtask in dependency_subtasks:
+            if subtask_results[dep_subtask].status not in (
+                Status.Accepted,
+                Status.PartialCorrect,
+            ):
+                subtask_result.status = Status.Skipped
+                subtask_result.score = decimal.Decimal()
+                subtask_result.memory = 0
+                subtask_result.time = 0
+
+    # NOTE: This only occur CE/CLE/JE (when checker / summary got CE/CLE)
+    if 0 in status_column:
+        assert total_status in (
+            Status.CompileError,
+            Status.CompileLimitExceeded,
+            Status.JudgeError,
+            Status.InternalError,
+        )
+        for idx in range(len(status_column)):
+            if status_column[idx] == 0:
+                status_column[idx] = SKIPPED
+
+    # NOTE: This only occur CE/CLE/JE (when checker / summary got CE/CLE) or subtask without having any testdata
+    for subtask_id, subtask_result in subtask_results.items():
+        if subtask_result.status is None:
+            if len(inp.subtasks[subtask_id][1]) == 0:
+                subtask_result.status = Status.JudgeError
+                continue
+
+            assert total_status in (
+                Status.CompileError,
+                Status.CompileLimitExceeded,
+                Status.JudgeError,
+                Status.InternalError,
+            )
+            subtask_result.status = Status.Skipped
+
+    # NOTE: is no None means already CE/CLE/JE/IE
+    if total_status is None:
+        for subtask_result in subtask_results.values():
+            total_memory += subtask_result.memory
+            total_time = max(subtask_result.time, total_time)
+
+            assert subtask_result.status
+            if subtask_result.status != Status.Skipped:
+                if total_status:
+                    total_status = max(subtask_result.status, total_status)
+                else:
+                    total_status = subtask_result.status
+            total_score += subtask_result.score
+
+    # NOTE: If total status still None, it means there are no testdata and subtask
+    no_testdata = total_status is None
+    if no_testdata:
+        total_status = Status.JudgeError
+
+    return SummaryOutput(status_column, subtask_results, (total_time, total_memory, total_score, total_status), no_testdata)
 
 
 class SummaryTask(Task):
+    __slots__ = ()
+    task_type = TaskType.SUMMARY
+
     def setup(self, chal: Challenge, task: TaskEntry) -> bool:
         # NOTE: CE / CLE / JE need summary set testdata results and subtask results status to Status.Skipped
         assert isinstance(chal.problem_context, SummaryMixin)
@@ -25,123 +178,51 @@ class SummaryTask(Task):
 
     def run(self, chal: Challenge, task: TaskEntry):
         assert isinstance(chal.problem_context, SummaryMixin)
-        assert isinstance(chal.problem_context, CheckerMixin)
+        assert isinstance(chal.problem_context, (CheckerMixin, InteractorMixin))
         assert chal.problem_context.summary_type != SummaryType.CUSTOM, "TODO: Custom summary"
-        logger.info(f"Starting summary task for chal {chal.chal_id} with summary type {chal.problem_context.summary_type}")
+        logger.info("Starting summary task for chal %s with summary type %s", chal.chal_id, chal.problem_context.summary_type)
         result = chal.result
+        table = result.testdata_results
+        total = result.total_result
+        # NOTE: Interactors report testlib points like a testlib checker
+        use_testdata_score = isinstance(chal.problem_context, InteractorMixin) or chal.problem_context.checker_type in (
+            CheckerType.CMS_TPS_TESTLIB,
+            CheckerType.STD_TESTLIB,
+            CheckerType.TOJ,
+        )
 
-        for subtask_id, subtask_result in result.subtask_results.items():
-            subtask_result.score = decimal.Decimal("Infinity")
-            for testdata in chal.subtasks[subtask_id].testdatas:
-                testdata_result = result.testdata_results[testdata.id]
-
-                if testdata_result.status and testdata_result.status != Status.Skipped:
-                    assert testdata_result.status not in (
-                        Status.CompileError,
-                        Status.CompileLimitExceeded,
-                    )
-                    subtask_result.memory += testdata_result.memory
-                    subtask_result.time = max(subtask_result.time, testdata_result.time)
-                    if subtask_result.status:
-                        subtask_result.status = max(
-                            subtask_result.status, testdata_result.status
-                        )
-                    else:
-                        subtask_result.status = testdata_result.status
-
-                if subtask_result.status in (
-                    Status.Accepted,
-                    Status.PartialCorrect,
-                ):
-                    if chal.problem_context.checker_type in (
-                        CheckerType.CMS_TPS_TESTLIB,
-                        CheckerType.STD_TESTLIB,
-                        CheckerType.TOJ,
-                    ):
-                        if chal.problem_context.summary_type == SummaryType.GROUPMIN:
-                            subtask_result.score = min(
-                                subtask_result.score,
-                                chal.subtasks[subtask_id].score * testdata_result.score,
-                            )
-
-                        elif chal.problem_context.summary_type == SummaryType.OVERWRITE:
-                            subtask_result.score = min(
-                                subtask_result.score, testdata_result.score
-                            )
-                    else:
-                        subtask_result.score = chal.subtasks[subtask_id].score
-                else:
-                    subtask_result.score = decimal.Decimal("Infinity")
-
-            if subtask_result.score.is_infinite():
-                subtask_result.score = decimal.Decimal()
-
-            for dep_subtask in chal.subtasks[subtask_id].dependency_subtasks:
-                if result.subtask_results[dep_subtask].status not in (
-                    Status.Accepted,
-                    Status.PartialCorrect,
-                ):
-                    subtask_result.status = Status.Skipped
-                    subtask_result.score = decimal.Decimal()
-                    subtask_result.memory = 0
-                    subtask_result.time = 0
-
-        # NOTE: This only occur CE/CLE/JE (when checker / summary got CE/CLE)
-        for testdata_result in result.testdata_results.values():
-            if not testdata_result.status:
-                assert result.total_result.status in (
-                    Status.CompileError,
-                    Status.CompileLimitExceeded,
-                    Status.JudgeError,
-                    Status.InternalError,
-                )
-                testdata_result.status = Status.Skipped
-
-        # NOTE: This only occur CE/CLE/JE (when checker / summary got CE/CLE) or subtask without having any testdata
-        for subtask_id, subtask_result in result.subtask_results.items():
-            if subtask_result.status is None:
-                if len(chal.subtasks[subtask_id].testdatas) == 0:
-                    subtask_result.status = Status.JudgeError
-                    continue
-
-                assert result.total_result.status in (
-                    Status.CompileError,
-                    Status.CompileLimitExceeded,
-                    Status.JudgeError,
-                    Status.InternalError,
-                )
-                subtask_result.status = Status.Skipped
-
-        # NOTE: is no None means already CE/CLE/JE/IE
-        if result.total_result.status is None:
-            for subtask_result in result.subtask_results.values():
-                result.total_result.memory += subtask_result.memory
-                result.total_result.time = max(
-                    subtask_result.time, result.total_result.time
+        inp = SummaryInput(
+            summary_type=chal.problem_context.summary_type,
+            use_testdata_score=use_testdata_score,
+            status=table.status,
+            time=table.time,
+            memory=table.memory,
+            score=table.score,
+            subtasks={
+                subtask_id: (
+                    subtask.score,
+                    table.indexes(testdata.id for testdata in subtask.testdatas),
+                    subtask.dependency_subtasks,
                 )
+                for subtask_id, subtask in chal.subtasks.items()
+            },
+            subtask_results=result.subtask_results,
+            total=(total.time, total.memory, total.score, total.status),
+            exact_scores=table.exact_scores,
+        )
+        out = offload.run(compute_summary, inp, offload=len(table) >= config.OFFLOAD_SUMMARY_MIN_TESTDATAS)
+        table.status = out.status
+        result.subtask_results = out.subtask_results
+        total.time, total.memory, total.score, total.status = out.total
 
-                assert subtask_result.status
-                if subtask_result.status != Status.Skipped:
-                    if result.total_result.status:
-                        result.total_result.status = max(
-                            subtask_result.status, result.total_result.status
-                        )
-                    else:
-                        result.total_result.status = subtask_result.status
-                result.total_result.score += subtask_result.score
-
-        # NOTE: If total_result.status still None, it means there are no testdata and subtask
-        if result.total_result.status is None:
+        if out.no_testdata:
             logger.error(f"No testdata or subtask found for chal {chal.chal_id}")
-            result.total_result.status = Status.JudgeError
-            result.total_result.ie_message = "Problem do not have any testdata or subtask. Please contact administrator or problem setter."
-            result.total_result.message_type = MessageType.TEXT
+            total.ie_message = "Problem do not have any testdata or subtask. Please contact administrator or problem setter."
+            total.message_type = MessageType.TEXT
 
     def finish(self, chal: Challenge, task: TaskEntry):
         assert isinstance(chal.problem_context, SummaryMixin)
-        assert isinstance(chal.problem_context, CheckerMixin)
-        assert isinstance(chal.problem_context, UserProgramMixin)
-        logger.info(f"Summary finished for chal {chal.chal_id}, final status: {chal.result.total_result.status}")
+        logger.info("Summary finished for chal %s, final status: %s", chal.chal_id, chal.result.total_result.status)
         chal.reporter(
             {
                 "chal_id": chal.chal_id,
@@ -149,5 +230,6 @@ class SummaryTask(Task):
                 "result": chal.result,
             }
         )
+        chal.summary_reported = True
 
         chal.box.cleanup()
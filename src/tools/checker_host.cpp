@@ -0,0 +1,130 @@
+// Persistent checker host, driven by utils/checker_host.py
+//
+// Built as one translation unit with the problem checker: checker.cpp is included at
+// the end of this file with its main renamed. Every request runs the checker in a
+// forked child, so each testcase starts from the same process state as a fresh
+// checker process.
+//
+// Usage: checker_host <cpu limit sec> <wall limit sec>
+// Request  (stdin):  "<arg1>\t<arg2>\t<arg3>\n", argv[1..3] of the checker
+// Response (stdout): "<exited|signaled|error> <code> <stdout size> <stderr size>\n"
+//                    followed by the checker stdout and stderr
+
+#include <cerrno>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+
+#include <fcntl.h>
+#include <signal.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+int ntoj_checker_main(int argc, char *argv[]);
+
+namespace ntoj_checker_host {
+
+const char *kStdout = "ntoj-checker-stdout";
+const char *kStderr = "ntoj-checker-stderr";
+
+std::string read_file(const char *path) {
+    std::string content;
+    FILE *f = fopen(path, "rb");
+    if (!f) {
+        return content;
+    }
+    char buf[1 << 16];
+    size_t n;
+    while ((n = fread(buf, 1, sizeof(buf), f)) > 0) {
+        content.append(buf, n);
+    }
+    fclose(f);
+    return content;
+}
+
+void redirect(const char *path, int fd, int flags) {
+    int f = open(path, flags, 0644);
+    if (f < 0) {
+        _exit(127);
+    }
+    dup2(f, fd);
+    close(f);
+}
+
+void respond(const char *kind, int code, const std::string &out, const std::string &err) {
+    printf("%s %d %zu %zu\n", kind, code, out.size(), err.size());
+    fwrite(out.data(), 1, out.size(), stdout);
+    fwrite(err.data(), 1, err.size(), stdout);
+    fflush(stdout);
+}
+
+}  // namespace ntoj_checker_host
+
+int main(int argc, char *argv[]) {
+    using namespace ntoj_checker_host;
+    long cpu_limit = argc > 1 ? atol(argv[1]) : 0;
+    long wall_limit = argc > 2 ? atol(argv[2]) : 0;
+
+    static char line[1 << 16];
+    while (fgets(line, sizeof(line), stdin)) {
+        size_t len = strlen(line);
+        if (len > 0 && line[len - 1] == '\n') {
+            line[--len] = '\0';
+        }
+
+        char *args[5] = {argv[0], line, nullptr, nullptr, nullptr};
+        char *tab = strchr(line, '\t');
+        if (tab) {
+            *tab = '\0';
+            args[2] = tab + 1;
+            tab = strchr(args[2], '\t');
+            if (tab) {
+                *tab = '\0';
+                args[3] = tab + 1;
+            }
+        }
+        if (!args[3]) {
+            respond("error", 0, "", "malformed request");
+            continue;
+        }
+
+        // NOTE: stdout is flushed after every response, so the child does not inherit
+        // buffered output
+        pid_t pid = fork();
+        if (pid < 0) {
+            respond("error", errno, "", "fork failed");
+            continue;
+        }
+        if (pid == 0) {
+            redirect("/dev/null", 0, O_RDONLY);
+            redirect(kStdout, 1, O_WRONLY | O_CREAT | O_TRUNC);
+            redirect(kStderr, 2, O_WRONLY | O_CREAT | O_TRUNC);
+            if (cpu_limit > 0) {
+                struct rlimit rl = {(rlim_t)cpu_limit, (rlim_t)cpu_limit + 1};
+                setrlimit(RLIMIT_CPU, &rl);
+            }
+            if (wall_limit > 0) {
+                alarm(wall_limit);
+            }
+            exit(ntoj_checker_main(4, args));
+        }
+
+        int status = 0;
+        while (waitpid(pid, &status, 0) < 0 && errno == EINTR) {
+        }
+        std::string out = read_file(kStdout), err = read_file(kStderr);
+        if (WIFSIGNALED(status)) {
+            respond("signaled", WTERMSIG(status), out, err);
+        } else {
+            respond("exited", WEXITSTATUS(status), out, err);
+        }
+    }
+    // NOTE: Skip the exit handlers of the checker (testlib complains that it was never registered)
+    _exit(0);
+}
+
+#define main ntoj_checker_main
+#include "checker.cpp"
+#undef main
@@ -1,16 +1,155 @@
+"""
+Judge logging.
+
+Records are put on a bounded queue by the calling thread and formatted and written to
+stderr by a QueueListener thread, so worker threads never wait on the stream handler
+lock or on stderr. Hot paths log with %-style arguments, formatting only happens on the
+listener thread, for records that passed the level, sampling and rate limit checks.
+
+Per-task and per-testcase lines go to the task_logger / testcase_logger categories,
+sampled and rate limited by config.LOG_CATEGORIES. Records carry the chal_id / task_id
+set by set_log_context on the worker thread.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
 
 import config
+from utils import metrics
+
+log_context = threading.local()
+dropped_records = metrics.registry.counter(
+    "ntoj_log_records_dropped_total", "Log records not written", ("category", "reason")
+)
+
+
+def set_log_context(chal_id: int, task_id: int):
+    log_context.chal_id = chal_id
+    log_context.task_id = task_id
+
+
+def clear_log_context():
+    log_context.chal_id = log_context.task_id = 0
+
+
+class CategoryFilter(logging.Filter):
+    """
+    Keeps a sample_rate fraction of the records of a category, then at most rate_limit
+    records per second (token bucket, 0 disables). Warnings and errors always pass.
+    """
+    def __init__(self, category: str, sample_rate: float, rate_limit: int):
+        super().__init__()
+        self.category = category
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.tokens = float(rate_limit)
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            dropped_records.inc(self.category, "sampled")
+            return False
+        if not self.rate_limit:
+            return True
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.refilled_at) * self.rate_limit, self.rate_limit)
+            self.refilled_at = now
+            if self.tokens < 1:
+                allowed = False
+            else:
+                self.tokens -= 1
+                allowed = True
+        if not allowed:
+            dropped_records.inc(self.category, "rate_limited")
+        return allowed
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Attaches the log context and enqueues without blocking, the record is formatted by
+    the listener. A full queue drops the record.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.chal_id = getattr(log_context, "chal_id", 0)
+        record.task_id = getattr(log_context, "task_id", 0)
+        # NOTE: Tracebacks are rendered now, the frames may be gone once the listener runs
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc(record.name.rpartition(".")[2], "queue_full")
+
+
+class ContextFormatter(logging.Formatter):
+    """
+    Provides %(context)s, "[chal <id> task <id>] " inside a task and empty otherwise.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        chal_id = getattr(record, "chal_id", 0)
+        record.context = f"[chal {chal_id} task {record.task_id}] " if chal_id else ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        obj = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        chal_id = getattr(record, "chal_id", 0)
+        if chal_id:
+            obj["chal_id"] = chal_id
+            obj["task_id"] = record.task_id
+        if record.exc_text:
+            obj["exc"] = record.exc_text
+        return json.dumps(obj)
+
+
+# NOTE: Skip the per-record caller frame walk and process lookups the text format does
+# not print (see "Optimization" in the logging docs)
+if config.LOGGER_LEVEL != logging.DEBUG:
+    logging._srcfile = None
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 logger = logging.getLogger("Judge")
 logger.setLevel(config.LOGGER_LEVEL)
+task_logger = logger.getChild("task")
+testcase_logger = logger.getChild("testcase")
+for category, (sample_rate, rate_limit) in config.LOG_CATEGORIES.items():
+    logger.getChild(category).addFilter(CategoryFilter(category, sample_rate, rate_limit))
+
 handler = logging.StreamHandler()
-if config.LOGGER_LEVEL == logging.DEBUG:
-    formatter = logging.Formatter(
-        "%(asctime)s %(filename)s %(name)s - %(levelname)s: %(message)s"
+if config.LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+elif config.LOGGER_LEVEL == logging.DEBUG:
+    formatter = ContextFormatter(
+        "%(asctime)s %(filename)s %(name)s - %(levelname)s: %(context)s%(message)s"
     )
 else:
-    formatter = logging.Formatter("%(asctime)s %(name)s %(message)s")
+    formatter = ContextFormatter("%(asctime)s %(name)s %(context)s%(message)s")
 
 handler.setFormatter(formatter)
-logger.addHandler(handler)
\ No newline at end of file
+log_queue: queue.Queue[logging.LogRecord] = queue.Queue(config.LOG_QUEUE_SIZE)
+logger.addHandler(ContextQueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, handler)
+log_listener.start()
+# NOTE: Flushes the queued records on exit
+atexit.register(log_listener.stop)
@@ -0,0 +1,498 @@
+"""
+Local content-addressed store for challenges sent without a shared filesystem.
+
+A challenge message may carry its source inline ("code", written into the challenge
+box by the compile task) and list its problem files by content hash ("resources":
+{relpath: sha256}) instead of naming code_path / res_path. Objects the store misses are requested from the backend with a "fetch"
+report, the backend streams them back as binary websocket frames of CHUNK_HEADER +
+data in offset order. A problem is materialized as a tree of hard links into the
+store, so the rest of the judge keeps reading res_path as before and a warm judge
+reads everything from local storage. A challenge waiting for its objects is parked
+instead of holding an ingest worker, it is resumed by the chunk that completes its
+last object, by a failed object, or when the fetch times out.
+
+Once the objects outgrow CAS_MAX_BYTES the least recently used are collected, first
+objects no tree links to, then trees with their objects. Challenges hold a shared
+flock on the .lock file of their tree while they are live, in any shard, and objects
+and trees used within CAS_GC_MIN_AGE are kept, so nothing a challenge is about to read
+goes away. Collecting is best effort, the store may stay above the limit when
+everything in it is in use.
+
+    objects/ab/cdef...   one file per sha256
+    trees/<tree hash>/   testdata/, checker/, ... hard links to objects, .lock
+    tmp/                 partial downloads
+    gc.lock              held by the process collecting
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import config
+from utils import logger, metrics, manifest
+
+# NOTE: magic, sha256, object size, offset of the data in the object
+CHUNK_HEADER = struct.Struct(">4s32sQQ")
+CHUNK_MAGIC = b"NTCH"
+
+fetched_bytes = metrics.registry.counter("ntoj_cas_fetched_bytes_total", "Resource bytes received from the backend")
+collected_bytes = metrics.registry.counter("ntoj_cas_collected_bytes_total", "Resource bytes removed from the store")
+
+
+def is_chunk_frame(msg: str | bytes) -> bool:
+    return isinstance(msg, bytes) and msg[:4] == CHUNK_MAGIC
+
+
+def pack_chunk(digest: str, size: int, offset: int, data: bytes) -> bytes:
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, bytes.fromhex(digest), size, offset) + data
+
+
+def chunk_digest(frame: bytes) -> str:
+    return frame[4:36].hex()
+
+
+class FetchError(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class FetchWait:
+    """
+    A parked challenge, resume(error) is called once, error is None when every object arrived.
+    """
+    remaining: int
+    resume: Callable[[str | None], None]
+    done: bool = False
+
+
+@dataclass(slots=True)
+class FetchRequest:
+    """
+    The objects of one fetch report, they share one timeout.
+    """
+    remaining: int = 0
+    timer: threading.Timer | None = None
+
+
+@dataclass(slots=True)
+class PendingObject:
+    digest: str
+    request: FetchRequest
+    waits: list[FetchWait] = field(default_factory=list)
+    file: object = None
+    hash: object = field(default_factory=hashlib.sha256)
+    received: int = 0
+
+
+class ContentStore:
+    def __init__(self, root: str, max_bytes: int = config.CAS_MAX_BYTES, min_age: float = config.CAS_GC_MIN_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.lock = threading.Lock()
+        self.pending: dict[str, PendingObject] = {}
+        for folder in ("objects", "trees", "tmp"):
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+        # NOTE: tree path -> (challenges using it, fd of its shared .lock flock)
+        self.tree_users: dict[str, tuple[int, int]] = {}
+        self.collecting = False
+        self.size = sum(size for _, size, _, _ in self.scan_objects())
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def has(self, digest: str) -> bool:
+        """
+        Whether the object is in the store, marking it used.
+        """
+        path = self.object_path(digest)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        self.touch(path, mtime)
+        return True
+
+    def touch(self, path: str, mtime: float):
+        # NOTE: mtime is the last use, only refreshed once it is halfway to collectable
+        if time.time() - mtime > self.min_age / 2:
+            with contextlib.suppress(OSError):
+                os.utime(path)
+
+    def publish(self, tmp_path: str, digest: str, size: int):
+        path = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # NOTE: Atomic, a concurrent writer of the same object (another shard) writes the same bytes
+        os.replace(tmp_path, path)
+        self.size += size
+        if self.size > self.max_bytes and not self.collecting:
+            self.collecting = True
+            threading.Thread(target=self.collect, name="cas-gc", daemon=True).start()
+
+    def fetch(
+        self,
+        digests: list[str],
+        request: Callable[[list[str]], None],
+        resume: Callable[[str | None], None],
+        timeout: float = config.CAS_FETCH_TIMEOUT,
+    ) -> bool:
+        """
+        True when every object is in the store. Otherwise misses not already being
+        fetched are requested with one request() call and resume(error) is called once
+        the last object arrived or one of them failed, on whichever thread that happens.
+        """
+        wait = FetchWait(0, resume)
+        missing = []
+        with self.lock:
+            fetch_request = FetchRequest()
+            for digest in set(digests):
+                if self.has(digest):
+                    metrics.cache_requests.inc("cas", "hit")
+                    continue
+                metrics.cache_requests.inc("cas", "miss")
+                pending = self.pending.get(digest)
+                if pending is None:
+                    pending = self.pending[digest] = PendingObject(digest, fetch_request)
+                    missing.append(digest)
+                pending.waits.append(wait)
+                wait.remaining += 1
+            if not wait.remaining:
+                return True
+
+            if missing:
+                # NOTE: One timer per fetch report, not per parked challenge
+                fetch_request.remaining = len(missing)
+                fetch_request.timer = threading.Timer(timeout, self.expire, (fetch_request, missing))
+                fetch_request.timer.daemon = True
+                fetch_request.timer.start()
+
+        if missing:
+            logger.info(f"Fetching {len(missing)} resource objects from the backend")
+            try:
+                request(missing)
+            except Exception as e:
+                for digest in missing:
+                    self.fail(digest, repr(e))
+        return False
+
+    def expire(self, fetch_request: FetchRequest, digests: list[str]):
+        for digest in digests:
+            with self.lock:
+                pending = self.pending.get(digest)
+                # NOTE: Failed and requested again meanwhile
+                if pending is None or pending.request is not fetch_request:
+                    continue
+                ready = self.fail_locked(digest, "timed out")
+            self.resume_waits(ready)
+
+    def fail(self, digest: str, error: str):
+        with self.lock:
+            ready = self.fail_locked(digest, error)
+        self.resume_waits(ready)
+
+    def fail_locked(self, digest: str, error: str) -> list[tuple[FetchWait, str | None]]:
+        pending = self.pending.pop(digest, None)
+        if pending is None:
+            return []
+        if pending.file is not None:
+            pending.file.close()
+            os.unlink(pending.file.name)
+        return self.settle_locked(pending, f"Fetching {digest} failed: {error}")
+
+    def settle_locked(self, pending: PendingObject, error: str | None) -> list[tuple[FetchWait, str | None]]:
+        """
+        The waits to resume now that pending is stored or failed.
+        """
+        fetch_request = pending.request
+        fetch_request.remaining -= 1
+        if not fetch_request.remaining and fetch_request.timer is not None:
+            fetch_request.timer.cancel()
+
+        ready = []
+        for wait in pending.waits:
+            if wait.done:
+                continue
+            wait.remaining -= 1
+            if error is not None or not wait.remaining:
+                wait.done = True
+                ready.append((wait, error))
+        return ready
+
+    @staticmethod
+    def resume_waits(ready: list[tuple[FetchWait, str | None]]):
+        # NOTE: Outside the lock, resuming queues the challenge for an ingest worker
+        for wait, error in ready:
+            try:
+                wait.resume(error)
+            except Exception as e:
+                logger.error(f"Resuming a challenge after its fetch raised {e!r}")
+
+    def receive_chunk(self, frame: bytes):
+        """
+        Store one chunk frame. Chunks of an object arrive in offset order.
+        """
+        if len(frame) < CHUNK_HEADER.size:
+            logger.warning(f"Truncated resource chunk of {len(frame)} bytes")
+            return
+        _, raw_digest, size, offset = CHUNK_HEADER.unpack_from(frame)
+        digest = raw_digest.hex()
+        data = memoryview(frame)[CHUNK_HEADER.size:]
+        with self.lock:
+            ready = self.store_chunk(digest, size, offset, data)
+        self.resume_waits(ready)
+
+    def store_chunk(self, digest: str, size: int, offset: int, data: memoryview) -> list[tuple[FetchWait, str | None]]:
+        pending = self.pending.get(digest)
+        # NOTE: Not requested by this process, or already failed
+        if pending is None:
+            return []
+        if offset != pending.received or offset + len(data) > size:
+            return self.fail_locked(digest, f"unexpected chunk at {offset}, expected {pending.received}")
+
+        if pending.file is None:
+            pending.file = open(os.path.join(self.root, "tmp", f"{digest}.{os.getpid()}"), "wb")
+        pending.file.write(data)
+        pending.hash.update(data)
+        pending.received += len(data)
+        fetched_bytes.inc(value=len(data))
+        if pending.received < size:
+            return []
+
+        pending.file.close()
+        if pending.hash.hexdigest() != digest:
+            return self.fail_locked(digest, "content does not match its hash")
+        self.publish(pending.file.name, digest, size)
+        del self.pending[digest]
+        return self.settle_locked(pending, None)
+
+    def materialize(self, resources: dict[str, str]) -> str:
+        """
+        Returns a folder with every relpath hard linked to its object, shared by every
+        challenge with the same resources.
+        """
+        listing = json.dumps(sorted(resources.items())).encode()
+        path = os.path.join(self.root, "trees", hashlib.sha256(listing).hexdigest())
+        try:
+            self.touch(path, os.stat(path).st_mtime)
+            return path
+        except FileNotFoundError:
+            pass
+
+        tmp_path = os.path.join(self.root, "tmp", f"tree.{os.getpid()}.{threading.get_ident()}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        for relpath, digest in resources.items():
+            target = os.path.join(tmp_path, relpath)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.link(self.object_path(digest), target)
+        open(os.path.join(tmp_path, ".lock"), "wb").close()
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # NOTE: Materialized by another thread or shard meanwhile
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+
+    def acquire_tree(self, path: str):
+        """
+        A live challenge reads the tree, it is not collected until release_tree().
+        """
+        with self.lock:
+            users, fd = self.tree_users.get(path, (0, -1))
+            if not users:
+                try:
+                    fd = os.open(os.path.join(path, ".lock"), os.O_RDONLY)
+                    fcntl.flock(fd, fcntl.LOCK_SH)
+                except OSError as e:
+                    logger.warning(f"Cannot lock resource tree {path}: {e!r}")
+                    return
+            self.tree_users[path] = (users + 1, fd)
+
+    def release_tree(self, path: str):
+        with self.lock:
+            users, fd = self.tree_users.get(path, (0, -1))
+            if users > 1:
+                self.tree_users[path] = (users - 1, fd)
+                return
+            if users:
+                del self.tree_users[path]
+                os.close(fd)
+
+    def scan_objects(self) -> list[tuple[float, int, int, str]]:
+        """
+        (mtime, size, link count, path) of every object.
+        """
+        objects = []
+        with os.scandir(os.path.join(self.root, "objects")) as folders:
+            for folder in folders:
+                if not folder.is_dir():
+                    continue
+                with os.scandir(folder.path) as it:
+                    for entry in it:
+                        with contextlib.suppress(FileNotFoundError):
+                            st = entry.stat()
+                            objects.append((st.st_mtime, st.st_size, st.st_nlink, entry.path))
+        return objects
+
+    def collect(self):
+        """
+        Remove least recently used objects and trees until the store fits max_bytes,
+        runs on its own thread.
+        """
+        lock_fd = os.open(os.path.join(self.root, "gc.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # NOTE: One collecting process per store, the others skip
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            self.collecting = False
+            return
+
+        try:
+            start = time.perf_counter()
+            before = self.size = sum(size for _, size, _, _ in self.scan_objects())
+            self.remove_orphans()
+            if self.size > self.max_bytes:
+                self.remove_trees()
+                self.remove_orphans()
+            logger.info(
+                f"Collected {before - self.size} bytes of resources in {time.perf_counter() - start:.3f}s, "
+                f"{self.size} bytes left"
+            )
+        except Exception as e:
+            logger.error(f"Collecting the content store raised {e!r}")
+        finally:
+            os.close(lock_fd)
+            self.collecting = False
+
+    def remove_orphans(self):
+        """
+        Objects no tree links to, oldest first.
+        """
+        deadline = time.time() - self.min_age
+        orphans = sorted(obj for obj in self.scan_objects() if obj[2] == 1 and obj[0] < deadline)
+        for _, size, _, path in orphans:
+            if self.size <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+                self.size -= size
+                collected_bytes.inc(value=size)
+
+    def remove_trees(self):
+        """
+        Trees no challenge holds, oldest first, until the objects only they link to
+        make up the excess.
+        """
+        root = os.path.join(self.root, "trees")
+        deadline = time.time() - self.min_age
+        trees = []
+        with os.scandir(root) as it:
+            for entry in it:
+                with contextlib.suppress(FileNotFoundError):
+                    mtime = entry.stat().st_mtime
+                    if entry.is_dir() and mtime < deadline:
+                        trees.append((mtime, entry.path))
+
+        excess = self.size - self.max_bytes
+        for _, path in sorted(trees):
+            if excess <= 0:
+                break
+            try:
+                lock_fd = os.open(os.path.join(path, ".lock"), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_fd)
+                continue
+            try:
+                # NOTE: Only linked by this tree and its object
+                for dirpath, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        st = os.stat(os.path.join(dirpath, filename))
+                        if st.st_nlink == 2:
+                            excess -= st.st_size
+                trash = os.path.join(self.root, "tmp", f"gc.{os.path.basename(path)}")
+                os.rename(path, trash)
+            finally:
+                os.close(lock_fd)
+            shutil.rmtree(trash, ignore_errors=True)
+            manifest.forget_manifest(path)
+
+
+def validate_resources(resources: dict) -> dict[str, str]:
+    if not isinstance(resources, dict):
+        raise ValueError("resources must map relative paths to sha256 digests")
+    for relpath, digest in resources.items():
+        normalized = os.path.normpath(relpath)
+        if os.path.isabs(normalized) or normalized.startswith(".."):
+            raise ValueError(f"Resource path {relpath} escapes the problem folder")
+        if not isinstance(digest, str) or len(digest) != 64:
+            raise ValueError(f"Resource {relpath} has an invalid sha256 digest")
+        try:
+            bytes.fromhex(digest)
+        except ValueError:
+            raise ValueError(f"Resource {relpath} has an invalid sha256 digest")
+    return resources
+
+
+def fetch_resources(obj: object, request: Callable[[list[str]], None], resume: Callable[[str | None], None]) -> bool:
+    """
+    Start fetching the hashed resources of a message the store misses. True when there
+    is nothing to wait for, otherwise resume(error) is called once they arrived.
+    """
+    resources = obj.get("resources") if isinstance(obj, dict) else None
+    if resources is None:
+        return True
+    validate_resources(resources)
+    return get_store().fetch(list(resources.values()), request, resume)
+
+
+def resolve_challenge(obj: dict) -> dict[str, str] | None:
+    """
+    Fill in res_path of a message with hashed resources, they must have been fetched
+    with fetch_resources. Returns the resources, None without any.
+    """
+    resources = obj.get("resources")
+    if resources is None:
+        return None
+    store = get_store()
+    validate_resources(resources)
+    missing = sum(not store.has(digest) for digest in set(resources.values()))
+    if missing:
+        raise FetchError(f"{missing} resource objects are not in the store")
+    obj["res_path"] = store.materialize(resources)
+    return resources
+
+
+store: ContentStore | None = None
+store_lock = threading.Lock()
+
+
+def get_store() -> ContentStore:
+    global store
+    with store_lock:
+        if store is None:
+            store = ContentStore(config.CAS_ROOT)
+        return store
+
+
+def acquire_tree(res_path: str):
+    """
+    Pin the tree of a registered challenge, a no-op for res_path outside the store.
+    """
+    if store is not None and os.path.dirname(res_path) == os.path.join(store.root, "trees"):
+        store.acquire_tree(res_path)
+
+
+def release_tree(res_path: str):
+    if store is not None:
+        store.release_tree(res_path)
@@ -1,7 +1,37 @@
+import bisect
 import decimal
+import os
 
 from models import Limits, CheckerType, SummaryType, TestData, Subtask, Compiler, ProblemContext, Challenge, TaskEntry
 
+REQUIRED_CHALLENGE_KEYS = ('chal_id', 'pro_id', 'acct_id')
+
+def validate_challenge_message(obj: dict):
+    if not isinstance(obj, dict):
+        raise ValueError("Challenge message must be a JSON object")
+
+    missing = [key for key in REQUIRED_CHALLENGE_KEYS if key not in obj]
+    if missing:
+        raise ValueError(f"Challenge message missing keys: {', '.join(missing)}")
+    # NOTE: Inline source / hashed resources replace the shared filesystem paths (see utils/cas.py)
+    if 'code_path' not in obj and 'code' not in obj:
+        raise ValueError("Challenge message needs code_path or code")
+    if 'code' in obj and not isinstance(obj['code'], str):
+        raise ValueError("code must be a string")
+    if 'res_path' not in obj and 'resources' not in obj:
+        raise ValueError("Challenge message needs res_path or resources")
+
+    testdata_ids = set()
+    for td_obj in obj.get('testdatas', []):
+        if td_obj['id'] in testdata_ids:
+            raise ValueError(f"Duplicate testdata id {td_obj['id']}")
+        testdata_ids.add(td_obj['id'])
+
+    for st_obj in obj.get('subtasks', []):
+        for td_id in st_obj.get('testdatas', []):
+            if td_id not in testdata_ids:
+                raise ValueError(f"Subtask {st_obj['id']} refers to unknown testdata {td_id}")
+
 def parse_base_challenge_info(obj: dict) -> dict:
     return {
         'chal_id': obj['chal_id'],
@@ -9,7 +39,8 @@ def parse_base_challenge_info(obj: dict) -> dict:
         'contest_id': obj.get('contest_id', 0),
         'acct_id': obj['acct_id'],
         'priority': obj.get('priority', 0),
-        'code_path': obj['code_path'],
+        'code_path': obj.get('code_path', ''),
+        'code': obj.get('code'),
         'res_path': obj['res_path'],
         'skip_nonac': obj.get('skip_nonac', False),
         'skip_subtasks': set(obj.get('skip_subtasks', [])),
@@ -31,6 +62,14 @@ def parse_checker_info(obj: dict) -> dict:
         'checker_type': CheckerType(obj['checker_type']),
         'checker_compiler': Compiler(checker_compiler_val) if checker_compiler_val else None,
         'checker_compile_args': obj.get('checker_compile_args', []),
+        'checker_host': bool(obj.get('checker_host', False)),
+    }
+
+
+def parse_interactor_info(obj: dict) -> dict:
+    return {
+        'interactor_compiler': Compiler(obj['interactor_compiler']),
+        'interactor_compile_args': obj.get('interactor_compile_args', []),
     }
 
 
@@ -46,6 +85,22 @@ def parse_user_program_info(obj: dict) -> dict:
         'has_grader': obj.get('has_grader', False),
     }
 
+def create_file_testdata(chal: 'Challenge', testdata_obj: dict) -> TestData:
+    """
+    Testdata whose input and output are files under res_path/testdata.
+    """
+    input_relpath = os.path.join("testdata", testdata_obj['input'])
+    output_relpath = os.path.join("testdata", testdata_obj['output'])
+    for relpath in (input_relpath, output_relpath):
+        if chal.manifest.get(relpath) is None:
+            raise FileNotFoundError(f"Testdata file {relpath} not found in {chal.res_path}")
+
+    return TestData(
+        id=int(testdata_obj['id']),
+        inputpath=chal.manifest.abspath(input_relpath),
+        outputpath=chal.manifest.abspath(output_relpath),
+    )
+
 def parse_testdatas_and_subtasks(obj: dict, chal: 'Challenge', context: ProblemContext) -> tuple[dict[int, TestData], dict[int, Subtask]]:
     testdatas = {}
     subtasks = {}
@@ -69,43 +124,33 @@ def parse_testdatas_and_subtasks(obj: dict, chal: 'Challenge', context: ProblemC
     return testdatas, subtasks
 
 def get_exec_order(chal: Challenge, skip_nonac=False) -> list[int]:
-    def lower_bound(layers: list[set[int]], pred) -> int:
-        left, right = 0, len(layers)
-        while left < right:
-            mid = (left + right) // 2
-            if pred(layers[mid]):
-                left = mid + 1
-            else:
-                right = mid
-        return left
-
     testdata_cnt = len(chal.testdatas)
     order = list(range(testdata_cnt))
 
     if skip_nonac:
+        subtask_sets = [frozenset(testdata.subtasks) for testdata in chal.testdatas.values()]
         testdata_layer = [0] * testdata_cnt
         scan_order = sorted(
             range(testdata_cnt),
-            key=lambda i: len(chal.testdatas[i].subtasks),
+            key=lambda i: len(subtask_sets[i]),
             reverse=True,
         )
+        # NOTE: Layers are monotone: a testdata's subtasks are contained in every layer
+        # before its position and in none after, so binary search on issubset
         subtask_layers: list[set[int]] = []
         for testdata_idx in scan_order:
-            pos = lower_bound(
-                subtask_layers,
-                lambda layer: all(
-                    subtask in layer
-                    for subtask in chal.testdatas[testdata_idx].subtasks
-                ),
+            subtasks = subtask_sets[testdata_idx]
+            pos = bisect.bisect_left(
+                subtask_layers, True, key=lambda layer: not subtasks.issubset(layer)
             )
 
             if pos == len(subtask_layers):
                 subtask_layers.append(set())
 
-            subtask_layers[pos].update(chal.testdatas[testdata_idx].subtasks)
+            subtask_layers[pos].update(subtasks)
             testdata_layer[testdata_idx] = pos
 
-        inverse_order = sorted(range(testdata_cnt), key=lambda i: testdata_layer[i])
+        inverse_order = sorted(range(testdata_cnt), key=testdata_layer.__getitem__)
         for i, idx in enumerate(inverse_order):
             order[idx] = i
 
@@ -114,10 +159,32 @@ def get_exec_order(chal: Challenge, skip_nonac=False) -> list[int]:
 def link_task(a: TaskEntry, b: TaskEntry):
     """
     Link two TaskEntry objects by adding an edge from 'a' to 'b'.
+    The first edge of 'a' is stored as its implicit successor.
 
     Args:
         a (TaskEntry): The source task entry.
         b (TaskEntry): The destination task entry.
     """
-    a.edges.append(b.task_id)
-    b.indeg_cnt += 1
\ No newline at end of file
+    if a.successor is None:
+        a.successor = b
+    elif isinstance(a.fanout, list):
+        a.fanout.append(b)
+    else:
+        a.fanout = [*a.fanout, b]
+    b.indeg_cnt += 1
+
+def link_fanout(a: TaskEntry, bs: list[TaskEntry]):
+    """
+    Add edges from 'a' to every task entry in 'bs'. The list is shared with 'a',
+    it must not be modified afterwards.
+
+    Args:
+        a (TaskEntry): The source task entry.
+        bs (list[TaskEntry]): The destination task entries.
+    """
+    if a.fanout:
+        a.fanout = [*a.fanout, *bs]
+    else:
+        a.fanout = bs
+    for b in bs:
+        b.indeg_cnt += 1
@@ -0,0 +1,228 @@
+"""
+Persistent checker host for compiled testlib checkers.
+
+The checker is compiled together with tools/checker_host.cpp, and one sandboxed host
+process checks many testcases: it reads argument triples from a pipe, runs the
+checker in a forked child for each of them and sends back the exit status, stdout
+and stderr. ScoringTask interprets these exactly like the result of a per-testcase
+checker sandbox.
+"""
+import itertools
+import math
+import os
+import signal
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO, Callable
+
+import config
+from lang.base import langs
+from models import Challenge, SandboxStatus
+from sandbox.sandbox import ChallengeBox, SandboxParams, SandboxProcess
+from utils import logger, metrics
+
+TOOLS_PATH = os.path.join(os.getcwd(), "tools")
+CHECKER_HOST_SOURCE = "ntoj_checker_host.cpp"
+
+host_ids = itertools.count(1)
+
+
+@dataclass(slots=True)
+class CheckerOutcome:
+    status: SandboxStatus
+    exit_status: int
+    stdout: str
+    stderr: str
+
+
+class CheckerHostClient:
+    """
+    Request / response protocol of tools/checker_host.cpp over a pair of byte streams.
+    """
+    def __init__(self, requests: BinaryIO, responses: BinaryIO):
+        self.requests = requests
+        self.responses = responses
+
+    def check(self, args: list[str]) -> CheckerOutcome | None:
+        """
+        Run the checker with argv[1..3] = args, returns None when the host is gone.
+        """
+        assert len(args) == 3 and not any("\t" in arg or "\n" in arg for arg in args)
+        try:
+            self.requests.write(("\t".join(args) + "\n").encode())
+            self.requests.flush()
+        except (BrokenPipeError, ValueError):
+            return None
+
+        header = self.responses.readline().split()
+        if len(header) != 4:
+            return None
+        kind, code, stdout_size, stderr_size = header[0], int(header[1]), int(header[2]), int(header[3])
+        stdout = self.responses.read(stdout_size)
+        stderr = self.responses.read(stderr_size)
+        if len(stdout) != stdout_size or len(stderr) != stderr_size:
+            return None
+
+        if kind == b"exited":
+            status = SandboxStatus.Normal if code == 0 else SandboxStatus.NonzeroExitStatus
+        elif kind == b"signaled":
+            if code in (signal.SIGXCPU, signal.SIGALRM):
+                status = SandboxStatus.TimeLimitExceeded
+            else:
+                status = SandboxStatus.Signalled
+        else:
+            logger.error(f"Checker host error: {stderr!r}")
+            status = SandboxStatus.RunnerError
+
+        return CheckerOutcome(
+            status=status,
+            exit_status=code,
+            stdout=stdout.decode(errors="replace"),
+            stderr=stderr.decode(errors="replace"),
+        )
+
+    def close(self):
+        for f in (self.requests, self.responses):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+
+class CheckerHost:
+    """
+    A checker host running in its own sandbox, connected through two box FIFOs.
+    """
+    def __init__(self, box: ChallengeBox, params: SandboxParams):
+        host_id = next(host_ids)
+        request_fifo = f"checker-host-{host_id}-request"
+        response_fifo = f"checker-host-{host_id}-response"
+        request_r, request_w = box.open_fifo_pipe(request_fifo)
+        response_r, response_w = box.open_fifo_pipe(response_fifo)
+        # NOTE: Open descriptors keep the pipes alive, the names are not needed anymore
+        box.delete_fifo(request_fifo)
+        box.delete_fifo(response_fifo)
+
+        params.set_stdin_fd(request_r).set_stdout_fd(response_w)
+        try:
+            self.proc: SandboxProcess = box.spawn_sandbox(params)
+        except Exception:
+            params.close_inherited_fds()
+            os.close(request_w)
+            os.close(response_r)
+            raise
+        params.close_inherited_fds()
+        self.client = CheckerHostClient(os.fdopen(request_w, "wb"), os.fdopen(response_r, "rb"))
+        self.alive = True
+
+    def check(self, args: list[str]) -> CheckerOutcome | None:
+        outcome = self.client.check(args)
+        if outcome is None:
+            self.alive = False
+        return outcome
+
+    def close(self):
+        # NOTE: EOF on the request pipe makes the host exit
+        self.client.close()
+        res = self.proc.wait()
+        logger.debug(f"Checker host exited, status: {res.status}, time: {res.time}ns")
+
+
+class CheckerHostPool:
+    """
+    Checker hosts of one challenge. Hosts are started on first use, at most
+    config.CHECKER_HOST_MAX_PROCS of them, and closed when the challenge is evicted.
+    """
+    def __init__(self, factory: Callable[[], CheckerHost], max_hosts: int = config.CHECKER_HOST_MAX_PROCS):
+        self.factory = factory
+        self.max_hosts = max_hosts
+        self.cond = threading.Condition()
+        self.idle: list[CheckerHost] = []
+        self.started = 0
+        self.closed = False
+
+    def acquire(self) -> CheckerHost:
+        with self.cond:
+            while not self.idle and self.started >= self.max_hosts:
+                self.cond.wait()
+            assert not self.closed, "Checker host pool already closed"
+            if self.idle:
+                metrics.cache_requests.inc("checker_host", "hit")
+                return self.idle.pop()
+            self.started += 1
+
+        metrics.cache_requests.inc("checker_host", "miss")
+        try:
+            return self.factory()
+        except Exception:
+            with self.cond:
+                self.started -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, host: CheckerHost):
+        with self.cond:
+            if host.alive and not self.closed:
+                self.idle.append(host)
+                self.cond.notify()
+                return
+            self.started -= 1
+            self.cond.notify()
+        host.close()
+
+    def check(self, args: list[str]) -> CheckerOutcome | None:
+        """
+        Check one testcase, retried once on a new host when the host died.
+        """
+        for _ in range(2):
+            host = self.acquire()
+            try:
+                outcome = host.check(args)
+            finally:
+                self.release(host)
+            if outcome is not None:
+                return outcome
+            logger.warning("Checker host died, retrying on a new host")
+        return None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            hosts, self.idle = self.idle, []
+            self.started -= len(hosts)
+        for host in hosts:
+            host.close()
+
+
+def create_checker_host_pool(chal: Challenge) -> CheckerHostPool:
+    """
+    Checker host pool of a challenge whose problem context uses the checker host.
+    The checker is compiled when the first host starts, so the sandbox parameters are
+    built lazily.
+    """
+    context = chal.problem_context
+
+    def factory() -> CheckerHost:
+        assert context.checker_path
+        # NOTE: The per-testcase limits of the host are second granularity
+        time_limit = math.ceil(chal.limits.time / 10**9)
+        exec, args = langs[context.checker_compiler].get_execute_command(
+            "checker", args=[str(time_limit), str(time_limit * 2)]
+        )
+        param = SandboxParams(
+            exe_path=exec,
+            args=args,
+            time_limit=config.CHECKER_HOST_REALTIME_LIMIT,
+            realtime_limit=config.CHECKER_HOST_REALTIME_LIMIT,
+            memory_limit=chal.limits.memory // 1024,
+            stack_limit=65536,
+            proc_limit=2,
+            allow_proc=True,
+        )
+        param.add_copy_in_path(context.checker_path, "checker")
+        param.add_copy_in_path(chal.manifest.abspath("testdata"), "testdata")
+        param.add_copy_in_path(chal.box.file_folder, "file")
+        logger.info(f"Starting checker host for chal {chal.chal_id}")
+        return CheckerHost(chal.box, param)
+
+    return CheckerHostPool(factory)
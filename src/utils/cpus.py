@@ -0,0 +1,54 @@
+"""
+CPU allocation for sandboxes pinned to config.CPUSET.
+
+A run takes the least used CPUs for its duration, one for a batch run and two for an
+interactive run, the user program and the interactor. Runs only share a CPU when more
+sandboxes run than CPUSET has CPUs. Among CPUs in equal use the allocation goes round
+robin, so an idle judge still spreads its runs.
+"""
+import contextlib
+import threading
+from typing import Iterator
+
+import config
+
+
+class CpuAllocator:
+    def __init__(self, cpus: list[str]):
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.usage = [0] * len(cpus)
+        self.cursor = 0
+
+    def acquire(self, count: int) -> list[int]:
+        n = len(self.cpus)
+        with self.lock:
+            order = sorted(range(n), key=lambda i: (self.usage[i], (i - self.cursor) % n))
+            # NOTE: A CPUSET smaller than count gives one run the same CPU twice
+            picked = [order[k % n] for k in range(count)]
+            for i in picked:
+                self.usage[i] += 1
+            self.cursor = (picked[-1] + 1) % n
+        return picked
+
+    def release(self, picked: list[int]):
+        with self.lock:
+            for i in picked:
+                self.usage[i] -= 1
+
+    @contextlib.contextmanager
+    def reserve(self, count: int) -> Iterator[list[str]]:
+        """
+        count cpusets for SandboxParams, all "" when CPUSET is empty.
+        """
+        if not self.cpus:
+            yield [""] * count
+            return
+        picked = self.acquire(count)
+        try:
+            yield [self.cpus[i] for i in picked]
+        finally:
+            self.release(picked)
+
+
+cpus = CpuAllocator(config.CPUSET)
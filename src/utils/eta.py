@@ -0,0 +1,233 @@
+"""
+Queue position and completion time estimates.
+
+Every finished task feeds its wall time (setup, run and finish) into an EWMA keyed by
+(problem, language, task type), (language, task type) and (task type) are the
+fallbacks for problems and languages not seen yet. An update is a few dict operations
+on the task thread. Another EWMA follows the drain rate, task seconds finished per
+wall clock second while tasks wait in the queue. It is below the slot count when the
+judge is bound by something else than its slots, the IOLoop, ingest or the CPUs.
+
+estimate() gets, per challenge, its queue position (queued tasks dispatched before its
+first one), the estimated slot seconds of its own unfinished tasks and the estimated
+slot seconds ahead of it. A slot second is a second of wall clock time a task holds one
+of the JUDGE_TASK_MAXCONCURRENT slots, not CPU time: it includes compiling, sandbox
+setup and waiting on I/O or the interactor, which is what delays the challenges behind
+it. Tasks are dispatched by (priority, challenge), so the work ahead
+is every unfinished task of the challenges that sort first, queued or still waiting
+for the tasks they depend on. The predicted completion drains both at the drain
+rate, challenges that arrive later with a better priority delay it. Backends poll,
+so snapshots are reused for ETA_CACHE_SECONDS.
+
+    {"task": "eta", "chal_ids": [...]}  ->  {"task": "eta", "estimates": [{"chal_id": ...}]}
+
+Challenges that are not live (still being built, finished, or sent by another backend)
+are left out.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import config
+from models import Challenge, TaskEntry, TaskType
+
+RATE_WINDOW = 1.0  # seconds of backlog per drain rate sample
+MIN_RATE = 0.05  # task seconds per second, keeps a stalled judge from predicting forever
+
+
+@dataclass(slots=True)
+class Ewma:
+    value: float
+    count: int = 1
+
+
+@dataclass(slots=True)
+class Estimate:
+    position: int = 0
+    queued: int = 0
+    ahead: float = 0.0  # slot seconds
+    remaining: float = 0.0  # slot seconds
+    eta: float = 0.0  # time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "position": self.position,
+            "queued_tasks": self.queued,
+            "ahead_slot_seconds": round(self.ahead, 3),
+            "remaining_slot_seconds": round(self.remaining, 3),
+            "eta": round(self.eta, 1),
+        }
+
+
+def parse_query(msg: str | bytes) -> list[int] | None:
+    """
+    The chal_ids of an {"task": "eta", "chal_ids": [...]} message, None for anything else.
+    """
+    if not isinstance(msg, str) or len(msg) > 1 << 16 or '"eta"' not in msg:
+        return None
+    try:
+        obj = json.loads(msg)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict) or obj.get("task") != "eta" or not isinstance(obj.get("chal_ids"), list):
+        return None
+    return [chal_id for chal_id in obj["chal_ids"] if isinstance(chal_id, int)]
+
+
+def challenge_key(chal: Challenge) -> tuple[int, str | None]:
+    compiler = getattr(chal.problem_context, "userprog_compiler", None)
+    return chal.pro_id, compiler.name if compiler is not None else None
+
+
+class DurationEstimator:
+    def __init__(
+        self,
+        alpha: float = config.ETA_ALPHA,
+        default: float = config.ETA_DEFAULT_SECONDS,
+        max_groups: int = config.ETA_MAX_GROUPS,
+    ):
+        self.alpha = alpha
+        self.default = default
+        self.max_groups = max_groups
+        self.lock = threading.Lock()
+        # NOTE: (pro_id, lang, task type), None for the fallback levels
+        self.groups: dict[tuple[int | None, str | None, TaskType], Ewma] = {}
+        self.rate: float | None = None
+        self.window_start = 0.0
+        self.window_seconds = 0.0
+
+    def observe(self, chal: Challenge, task_type: TaskType, seconds: float, backlog: bool):
+        """
+        backlog tells whether tasks are waiting in the queue, only then the finished task
+        seconds measure the drain rate.
+        """
+        pro_id, lang = challenge_key(chal)
+        alpha = self.alpha
+        with self.lock:
+            now = time.monotonic()
+            if not backlog:
+                self.window_start = 0.0
+            elif not self.window_start:
+                self.window_start = now
+                self.window_seconds = 0.0
+            else:
+                self.window_seconds += seconds
+                if now - self.window_start >= RATE_WINDOW:
+                    rate = self.window_seconds / (now - self.window_start)
+                    self.rate = rate if self.rate is None else self.rate + alpha * (rate - self.rate)
+                    self.window_start = now
+                    self.window_seconds = 0.0
+
+            for key in ((pro_id, lang, task_type), (None, lang, task_type), (None, None, task_type)):
+                group = self.groups.get(key)
+                if group is None:
+                    # NOTE: Past the limit new problems only update the fallbacks
+                    if key[0] is not None and len(self.groups) >= self.max_groups:
+                        continue
+                    self.groups[key] = Ewma(seconds)
+                    continue
+                group.value += alpha * (seconds - group.value)
+                group.count += 1
+
+    def estimate(self, pro_id: int | None, lang: str | None, task_type: TaskType) -> float:
+        groups = self.groups
+        group = (
+            groups.get((pro_id, lang, task_type))
+            or groups.get((None, lang, task_type))
+            or groups.get((None, None, task_type))
+        )
+        return group.value if group is not None else self.default
+
+    def drain_rate(self, slots: int) -> float:
+        if self.rate is None:
+            return slots
+        return min(max(self.rate, MIN_RATE), slots)
+
+    def stats(self) -> dict:
+        with self.lock:
+            groups = list(self.groups.items())
+        return {
+            "alpha": self.alpha,
+            "drain_rate": self.rate,
+            "groups": [
+                {"pro_id": pro_id, "lang": lang, "task_type": task_type.name, "seconds": group.value, "count": group.count}
+                for (pro_id, lang, task_type), group in groups
+            ],
+        }
+
+
+def estimate(
+    queued: list[TaskEntry],
+    tasks: list[TaskEntry],
+    challenges: dict[int, Challenge],
+    slots: int,
+    estimator: "DurationEstimator",
+) -> dict[int, Estimate]:
+    """
+    Estimates by internal_id. queued is a copy of the task queue, tasks every task not
+    finished yet.
+    """
+    now = time.time()
+    queued.sort()
+    keys: dict[int, tuple[int | None, str | None]] = {}
+    seconds: dict[tuple, float] = {}
+
+    def task_seconds(task: TaskEntry) -> float:
+        key = keys.get(task.internal_id)
+        if key is None:
+            chal = challenges.get(task.internal_id)
+            key = keys[task.internal_id] = challenge_key(chal) if chal is not None else (None, None)
+        key = (*key, task.task.task_type)
+        value = seconds.get(key)
+        if value is None:
+            value = seconds[key] = estimator.estimate(*key)
+        return value
+
+    estimates: dict[int, Estimate] = {}
+    order: dict[int, tuple[int, int]] = {}
+    for task in tasks:
+        est = estimates.get(task.internal_id)
+        if est is None:
+            est = estimates[task.internal_id] = Estimate()
+            order[task.internal_id] = (task.priority, task.internal_id)
+        est.remaining += task_seconds(task)
+
+    for position, task in enumerate(queued):
+        est = estimates.get(task.internal_id)
+        # NOTE: Finished between the two copies
+        if est is None:
+            continue
+        if not est.queued:
+            est.position = position
+        est.queued += 1
+
+    ahead = 0.0
+    rate = estimator.drain_rate(slots)
+    for internal_id in sorted(order, key=order.__getitem__):
+        est = estimates[internal_id]
+        est.ahead = ahead
+        est.eta = now + (ahead + est.remaining) / rate
+        ahead += est.remaining
+    return estimates
+
+
+class SnapshotCache:
+    def __init__(self, max_age: float = config.ETA_CACHE_SECONDS):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.taken = 0.0
+        self.snapshot: dict[int, Estimate] = {}
+
+    def get(self, take: Callable[[], dict[int, Estimate]]) -> dict[int, Estimate]:
+        # NOTE: Concurrent queries wait for one walk instead of each taking their own
+        with self.lock:
+            if time.monotonic() - self.taken > self.max_age:
+                self.snapshot = take()
+                self.taken = time.monotonic()
+            return self.snapshot
+
+
+estimator = DurationEstimator()
+snapshots = SnapshotCache()
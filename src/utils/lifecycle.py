@@ -0,0 +1,134 @@
+import sys
+import threading
+import time
+import weakref
+from dataclasses import fields, is_dataclass
+
+from models import Challenge, TaskEntry
+from sandbox.sandbox import watchdog_stats
+from utils import logger, cas
+
+
+def approx_size(obj, seen: set[int] | None = None) -> int:
+    """
+    Approximate deep size in bytes of a challenge object graph.
+    Enums, ints and strings shared between challenges are counted as well, so this is
+    an upper bound rather than an exact number.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, seen) + approx_size(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += approx_size(v, seen)
+    elif is_dataclass(obj) and not isinstance(obj, type):
+        for f in fields(obj):
+            size += approx_size(getattr(obj, f.name, None), seen)
+    elif hasattr(obj, "__slots__") and not callable(obj):
+        for name in getattr(type(obj), "__slots__", ()):
+            size += approx_size(getattr(obj, name, None), seen)
+    return size
+
+
+class ChallengeTracker:
+    """
+    Track challenges from registration until eviction.
+
+    A challenge is evicted once its summary was reported, its box was cleaned and it
+    has no outstanding task. If its tasks all finish without a summary (e.g. the
+    summary setup was skipped), it is cleaned and evicted anyway.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.challenges: dict[int, Challenge] = {}
+        self.remaining_tasks: dict[int, int] = {}
+        self.live: weakref.WeakValueDictionary[int, Challenge] = weakref.WeakValueDictionary()
+        self.evicted_cnt = 0
+
+    def register(self, chal: Challenge, tasks: list[TaskEntry]):
+        with self.lock:
+            self.challenges[chal.internal_id] = chal
+            self.remaining_tasks[chal.internal_id] = len(tasks)
+            self.live[chal.internal_id] = chal
+        cas.acquire_tree(chal.res_path)
+
+    def get(self, internal_id: int) -> Challenge:
+        return self.challenges[internal_id]
+
+    def task_done(self, task: TaskEntry) -> bool:
+        with self.lock:
+            remaining = self.remaining_tasks[task.internal_id] - 1
+            self.remaining_tasks[task.internal_id] = remaining
+            if remaining > 0:
+                return False
+
+            chal = self.challenges.pop(task.internal_id)
+            self.remaining_tasks.pop(task.internal_id)
+            self.evicted_cnt += 1
+
+        if not chal.summary_reported:
+            logger.warning(f"Challenge {chal.chal_id} finished all tasks without reporting summary")
+        if chal.checker_hosts is not None:
+            chal.checker_hosts.close()
+        if not chal.box.cleaned:
+            chal.box.cleanup()
+        cas.release_tree(chal.res_path)
+
+        # NOTE: The reporter pins the websocket handler
+        chal.reporter = lambda _: 0
+        logger.debug(f"Challenge {chal.chal_id} evicted")
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "live_challenges": len(self.challenges),
+                "pending_tasks": sum(self.remaining_tasks.values()),
+                # NOTE: Includes evicted challenges that are still referenced somewhere
+                "alive_challenge_objects": len(self.live),
+                "evicted_challenges": self.evicted_cnt,
+            }
+
+    def footprints(self) -> dict[int, int]:
+        with self.lock:
+            challenges = list(self.challenges.values())
+        return {chal.chal_id: footprint(chal) for chal in challenges}
+
+
+def footprint(chal: Challenge) -> int:
+    # NOTE: The manifest is shared by every challenge of the problem
+    return approx_size(chal, {id(chal.manifest), id(chal.reporter)})
+
+
+class SlotTracker:
+    """
+    Worker slot usage of the scheduler: how long tasks held a slot, and how much slot
+    time the sandbox watchdog reclaimed from idle programs (see WatchdogStats).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic_ns()
+        self.tasks = 0
+        self.busy_time = 0  # ns
+
+    def task_finished(self, elapsed: int):
+        with self.lock:
+            self.tasks += 1
+            self.busy_time += elapsed
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {
+                "tasks": self.tasks,
+                "busy_slot_time": self.busy_time,
+                "uptime": time.monotonic_ns() - self.started,
+            }
+        stats.update(watchdog_stats.stats())
+        return stats
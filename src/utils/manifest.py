@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import config
+from utils import logger, metrics
+
+# NOTE: Folders under res_path that challenges read from
+MANIFEST_FOLDERS = ("testdata", "grader", "checker", "interactor")
+
+
+@dataclass(slots=True)
+class ManifestEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    # NOTE: sha256, only known up front for content-addressed files, see get_digest()
+    digest: str | None = None
+
+    def get_digest(self) -> str:
+        """
+        Hash the file on first use, scanning only stats it.
+        """
+        if self.digest is None:
+            self.digest = hash_file(self.path)
+        return self.digest
+
+
+@dataclass(slots=True)
+class ResourceManifest:
+    """
+    Snapshot of the files under a problem res_path.
+
+    A manifest is never mutated after it is built, apart from digests filled in on first
+    use; a rescan produces a new one, so a challenge holding a manifest always sees a
+    consistent listing.
+    """
+    res_path: str
+    files: dict[str, ManifestEntry] = field(default_factory=dict)  # relpath -> entry
+    folders: dict[str, list[str]] = field(default_factory=dict)  # relpath -> file names
+    folder_mtimes: dict[str, int] = field(default_factory=dict)  # abspath -> mtime_ns
+    scanned_at: float = 0.0
+
+    def abspath(self, relpath: str) -> str:
+        return os.path.join(self.res_path, relpath)
+
+    def exists(self, relpath: str) -> bool:
+        relpath = os.path.normpath(relpath)
+        return relpath in self.files or relpath in self.folders
+
+    def get(self, relpath: str) -> ManifestEntry | None:
+        return self.files.get(os.path.normpath(relpath))
+
+    def listdir(self, relpath: str) -> list[str]:
+        """
+        Returns the names of the regular files directly under the folder.
+        """
+        return self.folders.get(os.path.normpath(relpath), [])
+
+    def list_with_ext(self, relpath: str, ext: str) -> list[str]:
+        return [name for name in self.listdir(relpath) if name.endswith(ext)]
+
+    def is_stale(self) -> bool:
+        if time.monotonic() - self.scanned_at > config.MANIFEST_MAX_AGE:
+            return True
+
+        for path, mtime_ns in self.folder_mtimes.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return True
+            except FileNotFoundError:
+                if mtime_ns != -1:
+                    return True
+        return False
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan_manifest(
+    res_path: str, previous: ResourceManifest | None = None, known_digests: dict[str, str] | None = None
+) -> ResourceManifest:
+    """
+    Walk the resource folders of res_path, stat only. Entries of the previous manifest
+    are reused when size and mtime did not change, so a hash computed by get_digest()
+    survives rescans. known_digests (relpath -> digest) fills in the hashes of
+    content-addressed files.
+    """
+    manifest = ResourceManifest(res_path=res_path)
+
+    def track_folder(path: str) -> bool:
+        try:
+            manifest.folder_mtimes[path] = os.stat(path).st_mtime_ns
+            return True
+        except FileNotFoundError:
+            manifest.folder_mtimes[path] = -1
+            return False
+
+    def scan(relpath: str):
+        path = os.path.join(res_path, relpath)
+        if not track_folder(path):
+            return
+
+        names = []
+        manifest.folders[relpath] = names
+        with os.scandir(path) as it:
+            for entry in it:
+                entry_relpath = os.path.join(relpath, entry.name)
+                if entry.is_dir():
+                    scan(entry_relpath)
+                    continue
+
+                if not entry.is_file():
+                    continue
+
+                st = entry.stat()
+                old = previous.files.get(entry_relpath) if previous else None
+                if old and old.size == st.st_size and old.mtime_ns == st.st_mtime_ns:
+                    manifest.files[entry_relpath] = old
+                else:
+                    manifest.files[entry_relpath] = ManifestEntry(
+                        path=entry.path,
+                        size=st.st_size,
+                        mtime_ns=st.st_mtime_ns,
+                        digest=known_digests.get(entry_relpath) if known_digests else None,
+                    )
+                names.append(entry.name)
+        names.sort()
+
+    track_folder(res_path)
+    for folder in MANIFEST_FOLDERS:
+        scan(folder)
+
+    manifest.scanned_at = time.monotonic()
+    return manifest
+
+
+# NOTE: Least recently used first, bounded by MANIFEST_MAX_ENTRIES
+manifests: OrderedDict[str, ResourceManifest] = OrderedDict()
+manifest_locks: dict[str, threading.Lock] = {}
+manifest_lock = threading.Lock()
+manifest_hits = 0
+manifest_misses = 0
+
+
+def get_manifest(res_path: str, known_digests: dict[str, str] | None = None) -> ResourceManifest:
+    global manifest_hits, manifest_misses
+    res_path = os.path.normpath(res_path)
+    with manifest_lock:
+        lock = manifest_locks.setdefault(res_path, threading.Lock())
+
+    # NOTE: Lock per res_path, so scanning a large problem does not block the others
+    with lock:
+        with manifest_lock:
+            manifest = manifests.get(res_path)
+            if manifest is not None:
+                manifests.move_to_end(res_path)
+        if manifest is not None and not manifest.is_stale():
+            manifest_hits += 1
+            metrics.cache_requests.inc("manifest", "hit")
+            return manifest
+
+        manifest_misses += 1
+        metrics.cache_requests.inc("manifest", "miss")
+        start = time.perf_counter()
+        manifest = scan_manifest(res_path, manifest, known_digests)
+        with manifest_lock:
+            manifests[res_path] = manifest
+            manifests.move_to_end(res_path)
+            while len(manifests) > config.MANIFEST_MAX_ENTRIES:
+                evicted, _ = manifests.popitem(last=False)
+                # NOTE: A scan holding the lock of the evicted path keeps using its own lock object
+                manifest_locks.pop(evicted, None)
+        logger.debug(f"Scanned manifest for {res_path} ({len(manifest.files)} files) in {time.perf_counter() - start:.3f}s")
+        return manifest
+
+
+def forget_manifest(res_path: str):
+    """
+    Drop the cached manifest of a removed res_path.
+    """
+    res_path = os.path.normpath(res_path)
+    with manifest_lock:
+        manifests.pop(res_path, None)
+        manifest_locks.pop(res_path, None)
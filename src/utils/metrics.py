@@ -0,0 +1,147 @@
+"""
+Prometheus text format metrics, served by /metrics.
+
+Counters and histograms are updated on the task path, so an update is a lock plus a
+few integer adds. Gauges are callbacks evaluated only when /metrics is scraped.
+"""
+import bisect
+import threading
+from typing import Callable, Iterable
+
+# NOTE: Seconds, roughly x2.5 apart, from sandbox setup (ms) to long runs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    items = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    return "{" + items + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels: str, value: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(dict(zip(self.label_names, labels)))} {value}"
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.callback: Callable[[], dict[tuple, float] | float] = lambda: 0
+
+    def set_function(self, callback: Callable[[], dict[tuple, float] | float]):
+        """
+        callback returns the value, or {label values: value} for a labelled gauge.
+        """
+        self.callback = callback
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{format_labels(dict(zip(self.label_names, labels)))} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.buckets_ns = tuple(int(bound * 10**9) for bound in buckets)
+        self.lock = threading.Lock()
+        # NOTE: labels -> [count per bucket (the last one is +Inf), sum in ns]
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        self.observe_ns(int(value * 10**9), *labels)
+
+    def observe_ns(self, value: int, *labels: str):
+        idx = bisect.bisect_left(self.buckets_ns, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][idx] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in series:
+            label_dict = dict(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{format_labels({**label_dict, 'le': le})} {cumulative}"
+            yield f"{self.name}_sum{format_labels(label_dict)} {total / 10**9}"
+            yield f"{self.name}_count{format_labels(label_dict)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Gauge | Histogram] = []
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# NOTE: Task metrics are labelled by TaskType name
+task_queue_wait = registry.histogram("ntoj_task_queue_wait_seconds", "Time from enqueue to task start", ("task_type",))
+task_setup_time = registry.histogram("ntoj_task_setup_seconds", "Task.setup duration", ("task_type",))
+task_run_time = registry.histogram("ntoj_task_run_seconds", "Task.run duration", ("task_type",))
+task_finish_time = registry.histogram("ntoj_task_finish_seconds", "Task.finish duration", ("task_type",))
+tasks_total = registry.counter("ntoj_tasks_total", "Finished tasks", ("task_type",))
+sandbox_overhead = registry.histogram(
+    "ntoj_sandbox_overhead_seconds", "Sandbox spawn to result time not spent running the program"
+)
+queue_depth = registry.gauge("ntoj_task_queue_depth", "Tasks waiting in the task queue", ("task_type",))
+running_tasks = registry.gauge("ntoj_running_tasks", "Tasks running on worker slots")
+live_challenges = registry.gauge("ntoj_live_challenges", "Challenges with outstanding tasks")
+websocket_backlog = registry.gauge("ntoj_websocket_backlog", "Reports waiting to be written to the backend websocket")
+ingest_backlog = registry.gauge("ntoj_ingest_backlog", "Challenge messages waiting to be built")
+cache_requests = registry.counter("ntoj_cache_requests_total", "Cache lookups", ("cache", "result"))
@@ -0,0 +1,92 @@
+"""
+Process pool for CPU-heavy Python phases of tasks.
+
+Task threads share the GIL with the IOLoop and the scheduler, a long summary or a
+large checker output decoded on a task thread delays pings, result writes and task
+dispatch. run() sends a module-level function and its compact arguments (array
+columns, tuples) to a worker process and blocks the calling task thread, which
+releases the GIL while it waits. Small inputs run inline, below the OFFLOAD_* size
+thresholds the pickling round trip costs more than the work.
+
+The workers are forked once at startup by start(), before the judge is busy. They
+only run the pure functions they are given and never log or touch judge state.
+"""
+import concurrent.futures
+import concurrent.futures.process
+import ctypes
+import multiprocessing
+import os
+import signal
+import threading
+from typing import Callable, TypeVar
+
+import config
+from utils import logger, metrics
+
+T = TypeVar("T")
+
+offloaded_calls = metrics.registry.counter("ntoj_offload_calls_total", "Task phases run in the offload pool", ("function",))
+
+pool: concurrent.futures.ProcessPoolExecutor | None = None
+pool_lock = threading.Lock()
+
+
+PR_SET_PDEATHSIG = 1
+
+
+def init_worker(parent_pid: int):
+    # NOTE: Die with the judge, a judge stopped by a signal skips stop()
+    ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    if os.getppid() != parent_pid:
+        os._exit(0)
+
+
+def warmup() -> int:
+    return 0
+
+
+def start():
+    global pool
+    if not config.OFFLOAD_ENABLED or config.OFFLOAD_WORKERS <= 0:
+        return
+    with pool_lock:
+        if pool is not None:
+            return
+        # NOTE: fork starts every worker on the first submit, do it now while few threads run
+        pool = concurrent.futures.ProcessPoolExecutor(
+            config.OFFLOAD_WORKERS,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+            initargs=(os.getpid(),),
+        )
+        pool.submit(warmup).result()
+    logger.info(f"Started {config.OFFLOAD_WORKERS} offload workers")
+
+
+def stop():
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+            pool = None
+
+
+def run(fn: Callable[..., T], *args, offload: bool = True) -> T:
+    """
+    fn(*args) in a worker process when offload holds and the pool runs, inline otherwise.
+    """
+    # NOTE: Read once, stop() may clear the global meanwhile
+    p = pool
+    if not offload or p is None:
+        return fn(*args)
+    offloaded_calls.inc(fn.__name__)
+    try:
+        return p.submit(fn, *args).result()
+    except concurrent.futures.process.BrokenProcessPool:
+        # NOTE: A worker died, no new workers are forked from the busy judge
+        logger.error("Offload pool broken, running task phases inline from now on")
+        stop()
+        return fn(*args)
+    except (RuntimeError, concurrent.futures.CancelledError):
+        # NOTE: stop() shut the pool down after the read
+        return fn(*args)
@@ -0,0 +1,105 @@
+"""
+On-demand sampling profiler, served by /debug/profile.
+
+A sampler thread reads the stack of every thread (sys._current_frames) at a fixed rate
+and counts collapsed stacks, the "frame;frame;frame count" format of flamegraph.pl and
+speedscope. Worker threads register the task they run, so stacks are rooted at
+"<task type>;chal <id>" where possible. Nothing is hooked into the profiled code, a
+sample costs one stack walk per thread while the profile runs and nothing otherwise.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+from types import CodeType, FrameType
+
+# NOTE: Leaf frames of threads blocked waiting for work, left out with include_idle=False
+IDLE_LEAVES = {
+    "threading.py:Condition.wait",
+    "threading.py:Event.wait",
+    "queue.py:Queue.get",
+    "selectors.py:_PollLikeSelector.select",
+    "pool.py:Pool._handle_tasks",
+    "pool.py:Pool._handle_results",
+    "pool.py:Pool._handle_workers",
+    "thread.py:_worker",
+    "handlers.py:QueueListener.dequeue",
+}
+
+# NOTE: thread id -> (task type name, chal_id), updated by run_task
+running_tasks: dict[int, tuple[str, int]] = {}
+
+
+def set_task(task_type: str, chal_id: int):
+    running_tasks[threading.get_ident()] = (task_type, chal_id)
+
+
+def clear_task():
+    running_tasks.pop(threading.get_ident(), None)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        # NOTE: One profile at a time, concurrent requests are rejected
+        self.lock = threading.Lock()
+        self.labels: dict[CodeType, str] = {}
+
+    def label(self, code: CodeType) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+        return label
+
+    def collapse(self, frame: FrameType | None) -> list[str]:
+        stack = []
+        while frame is not None:
+            stack.append(self.label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def sample(self, seconds: float, rate: int, include_idle: bool = True) -> collections.Counter | None:
+        """
+        Sample every thread but the sampler for seconds at rate Hz, returns the collapsed
+        stack counts, or None when another profile is running.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+
+        try:
+            me = threading.get_ident()
+            stacks: collections.Counter = collections.Counter()
+            interval = 1 / rate
+            deadline = time.monotonic() + seconds
+            next_at = time.monotonic()
+            while next_at < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = self.collapse(frame)
+                    if not include_idle and stack and stack[-1] in IDLE_LEAVES:
+                        continue
+                    root = [names.get(ident, str(ident))]
+                    task = running_tasks.get(ident)
+                    if task is not None:
+                        root.append(task[0])
+                        root.append(f"chal {task[1]}")
+                    stacks[";".join(root + stack)] += 1
+                del frame
+
+                next_at += interval
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            return stacks
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def render(stacks: collections.Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
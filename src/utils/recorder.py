@@ -0,0 +1,91 @@
+"""
+Scheduler trace recorder, replayed offline by bench/simulate.py.
+
+Writes JSON lines to config.RECORD_TRACE_PATH, times are time.monotonic_ns():
+
+    {"ev": "chal", "t": .., "msg": "<raw challenge message>"}
+    {"ev": "dag", "t": .., "chal_id": .., "priority": .., "tasks": [[type, order, successor, [fanout]], ..]}
+    {"ev": "task", "t": .., "chal_id": .., "idx": .., "queue": .., "setup": .., "run": .., "finish": .., "ran": ..}
+
+successor / fanout and idx are positions in the task list of the dag line, so the DAG
+can be rebuilt without the problem resources. Lines are written by a background
+thread, the task path only puts a tuple on a queue.
+"""
+import json
+import queue
+import threading
+
+import config
+from models import Challenge, TaskEntry
+from utils import logger
+
+
+class TraceRecorder:
+    def __init__(self, path: str | None = config.RECORD_TRACE_PATH):
+        self.path = path
+        self.enabled = path is not None
+        self.queue: queue.SimpleQueue[dict | None] = queue.SimpleQueue()
+        # NOTE: task_id -> (chal_id, position in the DAG), dropped when the task is recorded
+        self.positions: dict[int, tuple[int, int]] = {}
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.thread = threading.Thread(target=self.write_loop, name="trace-recorder", daemon=True)
+        self.thread.start()
+        logger.info(f"Recording scheduler trace to {self.path}")
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def write_loop(self):
+        with open(self.path, "a") as f:
+            while (line := self.queue.get()) is not None:
+                f.write(json.dumps(line, separators=(",", ":")))
+                f.write("\n")
+                if self.queue.empty():
+                    f.flush()
+
+    def record_challenge(self, t: int, msg: str | bytes):
+        if not self.enabled:
+            return
+        if isinstance(msg, bytes):
+            msg = msg.decode(errors="replace")
+        self.queue.put({"ev": "chal", "t": t, "msg": msg})
+
+    def record_dag(self, t: int, chal: Challenge, tasks: list[TaskEntry]):
+        if not self.enabled:
+            return
+        positions = {id(task): idx for idx, task in enumerate(tasks)}
+        shape = []
+        for idx, task in enumerate(tasks):
+            self.positions[task.task_id] = (chal.chal_id, idx)
+            successor = positions[id(task.successor)] if task.successor is not None else -1
+            shape.append([task.task.task_type.value, task.order, successor, [positions[id(t)] for t in task.fanout]])
+        self.queue.put({"ev": "dag", "t": t, "chal_id": chal.chal_id, "priority": chal.priority, "tasks": shape})
+
+    def record_task(self, t: int, task: TaskEntry, queue_time: int, setup: int, run: int, finish: int, ran: bool):
+        if not self.enabled:
+            return
+        position = self.positions.pop(task.task_id, None)
+        if position is None:
+            return
+        chal_id, idx = position
+        self.queue.put({
+            "ev": "task",
+            "t": t,
+            "chal_id": chal_id,
+            "idx": idx,
+            "queue": queue_time,
+            "setup": setup,
+            "run": run,
+            "finish": finish,
+            "ran": ran,
+        })
+
+
+recorder = TraceRecorder()
@@ -0,0 +1,210 @@
+"""
+Streaming comparators for the default checkers.
+
+The user program writes stdout into a FIFO, and the judge compares each chunk against
+the expected output while the program runs. The sandbox is killed on the first
+mismatch, so a wrong answer never has its full output written to disk.
+"""
+import os
+import select
+from dataclasses import dataclass
+
+from models import CheckerType
+from sandbox.sandbox import SandboxProcess
+
+CHUNK_SIZE = 1 << 16
+POLL_INTERVAL = 100  # ms
+# NOTE: Same characters trimmed by default-checker/lcmp.cpp
+WHITESPACE = b" \n\r\t"
+
+
+class StrictComparator:
+    """
+    Same verdict as default-checker/fcmp.cpp: the outputs must be byte identical.
+    """
+    def __init__(self, expected_path: str):
+        self.expected = open(expected_path, "rb")
+        self.mismatch = False
+
+    def feed(self, data: bytes) -> bool:
+        if not self.mismatch and self.expected.read(len(data)) != data:
+            self.mismatch = True
+        return not self.mismatch
+
+    def finish(self) -> bool:
+        return not self.mismatch and self.expected.read(1) == b""
+
+    def close(self):
+        self.expected.close()
+
+
+class LineComparator:
+    """
+    Same verdict as default-checker/lcmp.cpp: both outputs are split on '\\n', lines are
+    compared with trailing " \\n\\r\\t" removed, and whichever output is longer may
+    only have blank lines left.
+
+    While the user output is byte identical to the expected output, chunks are
+    compared with a single bytes compare. Line by line comparison starts at the line
+    where the outputs first differ.
+    """
+    def __init__(self, expected_path: str):
+        self.expected = open(expected_path, "rb")
+        self.synced = True
+        self.offset = 0  # user output bytes consumed
+        self.line_start = 0  # offset of the current line, only tracked while synced
+        self.line = b""  # current expected line, trimmed
+        self.pos = 0  # bytes of the current user line matched against self.line
+        self.exhausted = False  # expected output has no line left
+        self.mismatch = False
+
+    def feed(self, data: bytes) -> bool:
+        if self.mismatch:
+            return False
+
+        if self.synced:
+            if self.expected.read(len(data)) == data:
+                nl = data.rfind(b"\n")
+                if nl != -1:
+                    self.line_start = self.offset + nl + 1
+                self.offset += len(data)
+                return True
+
+            self.desync()
+
+        self.offset += len(data)
+        self.feed_lines(data)
+        return not self.mismatch
+
+    def finish(self) -> bool:
+        if self.mismatch:
+            return False
+
+        if self.synced:
+            if self.expected.read(1) == b"":
+                return True
+            self.desync()
+
+        # NOTE: The last user line ends at EOF
+        if self.pos != len(self.line):
+            return False
+        while line := self.expected.readline():
+            if line.rstrip(WHITESPACE):
+                return False
+        return True
+
+    def close(self):
+        self.expected.close()
+
+    def desync(self):
+        """
+        Switch to line by line comparison. The identical part of the current line is
+        replayed from the expected output.
+        """
+        self.synced = False
+        self.expected.seek(self.line_start)
+        prefix = self.expected.read(self.offset - self.line_start)
+        self.expected.seek(self.line_start)
+        self.next_line()
+        self.match(prefix)
+
+    def next_line(self):
+        # NOTE: Past EOF the expected output is treated as blank lines
+        line = self.expected.readline()
+        self.exhausted = not line
+        self.line = line.rstrip(WHITESPACE)
+        self.pos = 0
+
+    def feed_lines(self, data: bytes):
+        if self.exhausted:
+            # NOTE: Only whitespace may follow, no need to split lines
+            if data.rstrip(WHITESPACE):
+                self.mismatch = True
+            return
+
+        pieces = data.split(b"\n")
+        for piece in pieces[:-1]:
+            if not self.match(piece) or self.pos != len(self.line):
+                self.mismatch = True
+                return
+            self.next_line()
+
+        if not self.match(pieces[-1]):
+            self.mismatch = True
+
+    def match(self, piece: bytes) -> bool:
+        """
+        Match a part of the current user line, the line may continue in the next chunk.
+        """
+        line = self.line
+        pos = self.pos
+        if pos < len(line):
+            n = min(len(piece), len(line) - pos)
+            if not line.startswith(piece[:n], pos):
+                return False
+            self.pos = pos + n
+            piece = piece[n:]
+
+        # NOTE: Anything after the expected line must be trimmed whitespace
+        return not piece.rstrip(WHITESPACE)
+
+
+STREAM_COMPARATORS = {
+    CheckerType.DIFF: LineComparator,
+    CheckerType.DIFF_STRICT: StrictComparator,
+}
+
+
+@dataclass(slots=True)
+class StreamResult:
+    accepted: bool = False
+    aborted: bool = False  # the sandbox was killed before the program finished
+    output_size: int = 0
+    output_limit_exceeded: bool = False
+
+
+def stream_compare(
+    fd: int,
+    proc: SandboxProcess,
+    comparator: StrictComparator | LineComparator,
+    output_limit: int,
+) -> StreamResult:
+    """
+    Read the program output from the non-blocking FIFO fd until EOF, killing the
+    sandbox on the first mismatch or when the output exceeds output_limit bytes.
+    """
+    result = StreamResult()
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+
+    eof = False
+    while not eof:
+        # NOTE: POLLHUP is only reported after the sandbox opened the FIFO
+        if not poller.poll(POLL_INTERVAL):
+            if proc.poll() is not None:
+                break
+            continue
+
+        while True:
+            try:
+                data = os.read(fd, CHUNK_SIZE)
+            except BlockingIOError:
+                break
+
+            if not data:
+                eof = True
+                break
+
+            result.output_size += len(data)
+            if result.output_size > output_limit:
+                result.output_limit_exceeded = result.aborted = True
+                proc.kill()
+                return result
+
+            if not comparator.feed(data):
+                result.aborted = True
+                proc.kill()
+                return result
+
+    result.accepted = comparator.finish()
+    return result
@@ -0,0 +1,102 @@
+"""
+Sandbox telemetry aggregated per run kind, language and problem.
+
+Tasks record the SandboxResult of every run they make, /stats/telemetry exports the
+totals and means, e.g. how much of the judge time of a language is sandbox setup
+rather than the program itself.
+"""
+import threading
+from dataclasses import dataclass, field
+
+import config
+from sandbox.sandbox import SandboxResult
+
+# NOTE: Summed over runs, means are derived on export
+SUM_FIELDS = (
+    "time",
+    "run_time",
+    "minor_faults",
+    "major_faults",
+    "voluntary_ctx_switches",
+    "involuntary_ctx_switches",
+    "throttled_time",
+    "io_read_bytes",
+    "io_write_bytes",
+    "setup_time",
+    "sandbox_time",
+    "judge_time",
+)
+# NOTE: Maximum over runs
+PEAK_FIELDS = ("memory", "memory_peak", "max_rss")
+
+# NOTE: Problems beyond config.TELEMETRY_MAX_GROUPS are folded into this pro_id
+OTHER_PROBLEMS = 0
+
+
+@dataclass(slots=True)
+class TelemetryGroup:
+    runs: int = 0
+    sums: dict[str, int] = field(default_factory=lambda: dict.fromkeys(SUM_FIELDS, 0))
+    peaks: dict[str, int] = field(default_factory=lambda: dict.fromkeys(PEAK_FIELDS, 0))
+
+    def add(self, res: SandboxResult):
+        self.runs += 1
+        sums = self.sums
+        for name in SUM_FIELDS:
+            sums[name] += getattr(res, name)
+        peaks = self.peaks
+        for name in PEAK_FIELDS:
+            value = getattr(res, name)
+            if value > peaks[name]:
+                peaks[name] = value
+
+    def to_dict(self) -> dict:
+        means = {name: total // self.runs for name, total in self.sums.items()}
+        return {
+            "runs": self.runs,
+            "sum": dict(self.sums),
+            "mean": means,
+            "peak": dict(self.peaks),
+            # NOTE: Judge time not spent running the program: sandbox setup, cgroup
+            # and mount work, result parsing
+            "mean_overhead": max(means["judge_time"] - means["run_time"], 0),
+        }
+
+
+class TelemetryAggregator:
+    def __init__(self, max_groups: int = config.TELEMETRY_MAX_GROUPS):
+        self.lock = threading.Lock()
+        self.max_groups = max_groups
+        self.groups: dict[tuple[str, str, int], TelemetryGroup] = {}
+
+    def record(self, kind: str, lang: str, pro_id: int, res: SandboxResult):
+        """
+        kind is what the run was for: "execute", "interactor", "compile" or "checker".
+        """
+        if not config.TELEMETRY_ENABLED:
+            return
+
+        key = (kind, lang, pro_id)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                if len(self.groups) >= self.max_groups:
+                    key = (kind, lang, OTHER_PROBLEMS)
+                    group = self.groups.get(key)
+                if group is None:
+                    group = self.groups[key] = TelemetryGroup()
+            group.add(res)
+
+    def export(self) -> list[dict]:
+        with self.lock:
+            return [
+                {"kind": kind, "lang": lang, "pro_id": pro_id, **group.to_dict()}
+                for (kind, lang, pro_id), group in self.groups.items()
+            ]
+
+    def reset(self):
+        with self.lock:
+            self.groups.clear()
+
+
+telemetry = TelemetryAggregator()
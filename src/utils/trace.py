@@ -0,0 +1,117 @@
+"""
+Execution trace of tasks and sandbox runs, exported in Chrome trace-event format
+(chrome://tracing, Perfetto).
+
+Spans are written into a preallocated ring buffer, one tuple per slot, so recording
+is a tuple allocation and a list store and can stay on in production. The oldest
+spans are overwritten once config.TRACE_BUFFER_SIZE spans were recorded.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+
+import config
+
+# NOTE: Slot layout: (start ns, duration ns, name, category, chal_id, task_id, thread id, args)
+TraceSpan = tuple[int, int, str, str, int, int, int, dict | None]
+
+
+class TraceBuffer:
+    def __init__(self, size: int = config.TRACE_BUFFER_SIZE):
+        self.size = size
+        self.slots: list[TraceSpan | None] = [None] * size
+        self.cursor = itertools.count()
+        # NOTE: Task context of the worker thread, so sandbox spans know their challenge
+        self.context = threading.local()
+
+    def set_context(self, chal_id: int, task_id: int):
+        self.context.chal_id = chal_id
+        self.context.task_id = task_id
+
+    def clear_context(self):
+        self.context.chal_id = self.context.task_id = 0
+
+    def span(self, name: str, category: str, start: int, end: int,
+             chal_id: int | None = None, task_id: int | None = None, args: dict | None = None):
+        """
+        Record a span from start to end (time.monotonic_ns()). The challenge and task
+        default to the context of the calling thread.
+        """
+        if not config.TRACE_ENABLED:
+            return
+
+        if chal_id is None:
+            chal_id = getattr(self.context, "chal_id", 0)
+        if task_id is None:
+            task_id = getattr(self.context, "task_id", 0)
+        # NOTE: next() on itertools.count is atomic, so threads never share a slot
+        idx = next(self.cursor) % self.size
+        self.slots[idx] = (start, end - start, name, category, chal_id, task_id, threading.get_ident(), args)
+
+    def spans(self, chal_id: int | None = None, since: int | None = None, until: int | None = None) -> list[TraceSpan]:
+        """
+        Recorded spans of one challenge and / or overlapping [since, until], oldest first.
+        """
+        result = []
+        for span in list(self.slots):
+            if span is None:
+                continue
+            start, duration, _, _, span_chal_id, _, _, _ = span
+            if chal_id is not None and span_chal_id != chal_id:
+                continue
+            if since is not None and start + duration < since:
+                continue
+            if until is not None and start > until:
+                continue
+            result.append(span)
+        result.sort(key=lambda span: span[0])
+        return result
+
+    def export(self, chal_id: int | None = None, since: int | None = None, until: int | None = None) -> dict:
+        """
+        Chrome trace-event JSON object. Each challenge is a process, each worker thread
+        a thread of it.
+        """
+        events = []
+        threads: dict[int, int] = {}
+        processes = set()
+        for start, duration, name, category, span_chal_id, task_id, thread, args in self.spans(chal_id, since, until):
+            tid = threads.setdefault(thread, len(threads) + 1)
+            processes.add(span_chal_id)
+            event_args = {"task_id": task_id}
+            if args:
+                event_args.update(args)
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": duration / 1000,
+                "pid": span_chal_id,
+                "tid": tid,
+                "args": event_args,
+            })
+
+        for pid in processes:
+            events.append({
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"chal {pid}" if pid else "judge"},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, chal_id: int | None = None, since: int | None = None, until: int | None = None) -> str:
+        """
+        Write the export to config.TRACE_DUMP_DIR, returns the file path.
+        """
+        name = f"ntoj-trace-{chal_id if chal_id is not None else 'all'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        path = os.path.join(config.TRACE_DUMP_DIR, name)
+        with open(path, "w") as f:
+            json.dump(self.export(chal_id, since, until), f)
+        return path
+
+
+tracer = TraceBuffer()